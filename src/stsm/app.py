@@ -2,9 +2,12 @@ import tkinter as tk
 from tkinter import ttk, messagebox
 import cv2
 import numpy as np
+from build_tab import build_tab
 from binary_tab import binary_tab
 from processing_tab import processing_tab
 from visualize_tab import visualize_tab
+from result_cache import default_cache
+from load_save import release_binary_images
 
 class stsmApp:
     def __init__(self, root):
@@ -14,21 +17,34 @@ class stsmApp:
         
         # Initialize image variables and control flags
         self.images = []
+        self.binary_path = None  # Binary mosaic fused to a temporary file (see load_save.load_image)
         self.tk_images = []
+        self.display_cache = {}  # Fitted layer images, see display.fitted_photo_image
         self.layer_visibility = [tk.BooleanVar(value=True) for _ in range(3)]
         self.layer_order = [2, 0, 1]  # Default order: binary mosaic, mosaic 1, mosaic 2
         self.controls_visible = False
         self.layer_names = ["Mosaic 1", "Mosaic 2", "Binary mosaic"]
         self.index = 0  # Index for the current image being processed
         
+        # Initialize build tab variables
+        self.tile_paths = []  # Tiles of the mosaic to build (see stitching.py)
+        self.build_preview = None  # Preview of the built mosaic (overlays.PreviewLayer)
+        self.build_tk_image = None
+        self.build_display_cache = {}
+        
         # Initialize processing tab variables
-        self.proc_images = []  # Original, contours < 50, contours > 50
+        self.proc_images = []  # Contour layers (overlays.ContourOverlay): < 50, > 50, all
         self.proc_tk_images = []
+        self.proc_display_cache = {}
         self.proc_layer_visibility = [tk.BooleanVar(value=True) for _ in range(3)]
         self.proc_layer_order = [0, 1, 2]  # Default order: Original, pores <= 50, pores > 50
         self.proc_controls_visible = False
         self.proc_layer_names = ["Original", "Pore \u2264 50μm", "Pore > 50μm"]
         self.original_image = None  # Store the original image before ROI selection
+        self.mosaic_key = None  # Identity of the loaded mosaic file
+        self.processed_region = None  # Last region processed from scratch (see processed_region.py)
+        self.result_cache = default_cache()  # Results of the mosaics already processed, or None (see result_cache.py)
+        self.stats_saved = False  # Global pore stats of the loaded mosaic appended already
         
         # ROI selection variables
         self.roi_mode = False
@@ -45,7 +61,7 @@ class stsmApp:
         
         # Create the tabs
         #self.acquire_frame = ttk.Frame(self.notebook)
-        #self.build_frame = ttk.Frame(self.notebook)
+        self.build_frame = ttk.Frame(self.notebook)
         #self.align_frame = ttk.Frame(self.notebook)
         self.binary_frame = ttk.Frame(self.notebook)
         self.processing_frame = ttk.Frame(self.notebook)
@@ -53,12 +69,15 @@ class stsmApp:
         
         # Add tabs to notebook
         #self.notebook.add(self.acquire_frame, text="Acquire")
-        #self.notebook.add(self.build_frame, text="Build")
+        self.notebook.add(self.build_frame, text="Build")
         #self.notebook.add(self.align_frame, text="Align")
         self.notebook.add(self.binary_frame, text="Binary")
         self.notebook.add(self.processing_frame, text="Processing")
         self.notebook.add(self.visualize_frame, text="Visualize")
         
+        # Setup the Build tab
+        build_tab(self)
+
         # Setup the Binary tab
         binary_tab(self)
 
@@ -73,6 +92,7 @@ if __name__ == "__main__":
     root = tk.Tk()
     app = stsmApp(root)
     root.mainloop()
+    release_binary_images(app)  # Delete the temporary binary mosaic, if any
 
 
 
@@ -91,15 +111,9 @@ def visualize_contour_group(self, index):
     # Get the parent and children contours
     parent, children, area, perimeter = self.processed_contours[index]
     
-    # Create a copy of the original binary image
+    # Use the binary image being processed
     if len(self.proc_images) > 0:
-        # Use the first processed image (binary)
-        if len(self.proc_images[0].shape) == 3:
-            # If it's already a color image, convert to grayscale
-            binary_image = cv2.cvtColor(self.proc_images[0], cv2.COLOR_BGR2GRAY)
-        else:
-            # If it's already grayscale, make a copy
-            binary_image = self.proc_images[0].copy()
+        binary_image = self.image
     else:
         messagebox.showwarning("Warning", "No processed image available.")
         return
@@ -0,0 +1,335 @@
+"""
+Headless batch processing of soil thin section mosaics.
+
+Runs the Processing tab pipeline (binarization, contour extraction, global
+stats and segmentation) over a folder or a manifest of mosaics, one mosaic per
+worker process, and writes the same outputs as "Save Stats & Data":
+
+    <output>/Global_Pore_Stats.xlsx
+    <output>/<mosaic>/<mosaic>.tiff, <mosaic>.h5 and <mosaic>_<shape>.xlsx
+    <output>/<mosaic>/<mosaic>_run_report.json/.csv, the time (and with
+    --trace-memory the memory) of each stage, see instrumentation.py
+    (or <mosaic>_<shape>_<size>.csv/.tsv with --segmented-format)
+    <output>/<mosaic>/<mosaic>.parquet/.arrow with --pore-table (or, for mosaics of
+    a campaign, <output>/pore_tables/campaign=<campaign>/<mosaic>.parquet)
+
+Usage:
+    python batch.py MOSAICS_DIR_OR_MANIFEST -o OUTPUT_DIR [-c 0.3051] [-w WORKERS] [--overwrite]
+
+A run refuses to start if a mosaic already has outputs in OUTPUT_DIR. With
+--overwrite they are deleted first (with the mosaic's Global Pore Stats row)
+and written again.
+
+A manifest is a CSV file with a "path" column and optional "name",
+"calibration" and "campaign" columns; relative paths are resolved against the
+manifest folder.
+"""
+import argparse
+import csv
+import os
+import shutil
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from types import SimpleNamespace
+import cv2
+from image_source import open_image_source
+from proc_mosaic import to_binary, process_binary_mosaic
+from result_cache import ResultCache
+from pore_io import (mosaic_output_path, write_binary_image, append_gpd_stats, remove_gpd_stats,
+                     write_contours_hdf5, write_segmented_pore_data, SEGMENTED_FORMATS)
+from pore_table import pore_table_available, pore_table_path, write_pore_table, PORE_TABLE_FORMATS, PORE_TABLES_DIR
+from instrumentation import stage, start_run, end_run
+
+# Image files picked up when the input is a directory
+MOSAIC_EXTENSIONS = (".jpg", ".jpeg", ".bmp", ".png", ".tif", ".tiff")
+
+# Default pixel calibration (pixel/micron), same as the Processing tab
+DEFAULT_CALIBRATION = 0.3051
+
+
+def find_mosaics(input_path, calibration=DEFAULT_CALIBRATION, campaign=None):
+    """
+    List the mosaics to process.
+
+    Args:
+        input_path: Directory of mosaic images or CSV manifest
+        calibration: Calibration used when the manifest does not give one
+        campaign: Campaign used when the manifest does not give one
+
+    Returns:
+        List of dicts with "name", "path", "calibration" and "campaign"
+    """
+    jobs = []
+    if os.path.isdir(input_path):
+        for entry in sorted(os.listdir(input_path)):
+            if entry.lower().endswith(MOSAIC_EXTENSIONS):
+                jobs.append({
+                    "name": os.path.splitext(entry)[0],
+                    "path": os.path.join(input_path, entry),
+                    "calibration": float(calibration),
+                    "campaign": campaign,
+                })
+        return jobs
+
+    base_dir = os.path.dirname(os.path.abspath(input_path))
+    with open(input_path, newline="") as f:
+        for row in csv.DictReader(f):
+            path = row["path"].strip()
+            if not os.path.isabs(path):
+                path = os.path.join(base_dir, path)
+            jobs.append({
+                "name": (row.get("name") or "").strip() or os.path.splitext(os.path.basename(path))[0],
+                "path": path,
+                "calibration": float(row.get("calibration") or calibration),
+                "campaign": (row.get("campaign") or "").strip() or campaign,
+            })
+    return jobs
+
+
+def _init_worker():
+    # One mosaic per process: keep OpenCV from spawning its own threads on top
+    cv2.setNumThreads(1)
+
+
+def process_one(job, output_dir, tile_size=None, threads=None, border_size=1, backend="contours",
+                trace_all=True, morpho_workers=None, cache_dir=None, segmented_format="xlsx",
+                pore_table_format=None, trace_memory=False, profile=False):
+    """
+    Process a single mosaic and write its per-mosaic outputs.
+
+    `tile_size` and `threads` select the tiled contour extraction,
+    `border_size` the width of the frame used for is_edge, and `backend` and
+    `trace_all` the pore extraction backend and `morpho_workers` the processes
+    used for the morphometrics (see process_binary_mosaic). With `cache_dir`,
+    results are read from / stored in a ResultCache in that folder.
+    `segmented_format` is the format of the segmented pore data ("xlsx", "csv"
+    or "tsv", see write_segmented_pore_data). With `pore_table_format`
+    ("parquet" or "arrow") the table of every pore is written too, in the
+    partition of the campaign of the job if it has one (see pore_table.py).
+    The stages are recorded in a run report next to the .h5 file, with their
+    traced memory if `trace_memory` and a cProfile profile if `profile`.
+
+    Never raises: failures are returned in the result so the rest of the run goes on.
+
+    Returns:
+        Dict with name, path, status ("ok" or "failed"), seconds, number of
+        pores, the global stats summary row and the error message (if any)
+    """
+    result = {"name": job["name"], "path": job["path"], "status": "failed",
+              "seconds": 0.0, "pores": 0, "summary": None, "error": ""}
+    start = time.perf_counter()
+    run = start_run(job["name"], trace_memory, profile)
+    try:
+        # Load the mosaic the same way the Processing tab does
+        with stage("load_mosaic"):
+            source = open_image_source(job["path"], gray=True)
+            image = source[:, :]
+            source.close()
+        with stage("threshold", image.shape[0] * image.shape[1]):
+            binary = to_binary(image)
+        del image
+
+        state = SimpleNamespace()
+        cache = ResultCache(cache_dir) if cache_dir else None
+        with stage("process"):
+            process_binary_mosaic(state, binary, job["calibration"], tile_size, threads, border_size,
+                                  backend, trace_all, morpho_workers, cache=cache)
+
+        with stage("save_binary"):
+            write_binary_image(mosaic_output_path(output_dir, job["name"], ".tiff"), binary)
+        with stage("save_hdf5", len(state.processed_contours)):
+            write_contours_hdf5(mosaic_output_path(output_dir, job["name"], ".h5"), state.processed_contours)
+        with stage("save_segmented"):
+            write_segmented_pore_data(output_dir, job["name"], state.shapes, state.sizes,
+                                      state.processed_cont_great_50_sz, segmented_format)
+        if pore_table_format:
+            with stage("save_pore_table", len(state.processed_contours)):
+                write_pore_table(pore_table_path(output_dir, job["name"], pore_table_format, job.get("campaign")),
+                                 job["name"], state.processed_contours, state.calibration, state.area_50,
+                                 state.pore_geometry)
+
+        result["pores"] = len(state.processed_contours)
+        result["summary"] = (job["name"], ) + tuple(state.summary)
+        result["status"] = "ok"
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+        result["traceback"] = traceback.format_exc()
+    end_run()
+    try:
+        run.write_report(mosaic_output_path(output_dir, job["name"], "_run_report"))
+    except OSError:
+        pass
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+
+def mosaic_outputs(job, output_dir, pore_table_format=None):
+    """Outputs of a mosaic that exist already: its folder and its campaign pore table"""
+    outputs = [os.path.join(output_dir, job["name"])]
+    if pore_table_format and job.get("campaign") is not None:
+        outputs.append(os.path.join(output_dir, PORE_TABLES_DIR, f"campaign={job['campaign']}",
+                                    f"{job['name']}.{pore_table_format}"))
+    return [path for path in outputs if os.path.exists(path)]
+
+
+def remove_mosaic_outputs(job, output_dir, pore_table_format=None):
+    """Delete the outputs of a mosaic (see mosaic_outputs)"""
+    for path in mosaic_outputs(job, output_dir, pore_table_format):
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+
+
+def run_batch(jobs, output_dir, workers=None, tile_size=None, threads=None, border_size=1,
+              backend="contours", trace_all=True, morpho_workers=None, cache_dir=None, segmented_format="xlsx",
+              pore_table_format=None, trace_memory=False, profile=False, overwrite=False, log=print):
+    """
+    Process the mosaics in `jobs` on a process pool.
+
+    The Global Pore Stats workbook is only written from this (parent) process,
+    as results arrive, so workers never race on it. A report with the wall time
+    and status of every mosaic is written to <output_dir>/batch_report.csv.
+
+    Args:
+        jobs: List of dicts from find_mosaics
+        output_dir: Output directory
+        workers: Number of worker processes (default: all cores)
+        tile_size, threads: Tiled contour extraction inside each worker (default: off)
+        border_size: Width of the image frame that flags a pore as is_edge
+        backend: "contours" or "components" pore extraction
+        trace_all: False to only trace the pores larger than 50 μm (components backend)
+        morpho_workers: Processes per worker for the morphometrics (default: serial)
+        cache_dir: Folder of a result cache shared by the workers (default: no cache)
+        segmented_format: "xlsx", "csv" or "tsv" segmented pore data
+        pore_table_format: "parquet" or "arrow" to write the table of every pore (default: none)
+        trace_memory: Record the peak memory of each stage in the run reports (slower)
+        profile: Save a cProfile profile of each mosaic next to its run report
+        overwrite: Delete the outputs of the mosaics processed before (and
+                   their Global Pore Stats rows) instead of refusing to start
+        log: Callable used to report progress
+
+    Returns:
+        List of per-mosaic results (see process_one), in completion order
+
+    Raises:
+        FileExistsError: If a mosaic has outputs already and not `overwrite`
+            (checked before anything is written)
+    """
+    existing = [job for job in jobs if mosaic_outputs(job, output_dir, pore_table_format)]
+    if existing and not overwrite:
+        names = ", ".join(job["name"] for job in existing[:5]) + (", ..." if len(existing) > 5 else "")
+        raise FileExistsError(f"{len(existing)} mosaic(s) already have outputs in '{output_dir}' ({names})")
+    os.makedirs(output_dir, exist_ok=True)
+    if existing:
+        # Start over for these mosaics: the savers never overwrite a file
+        for job in existing:
+            remove_mosaic_outputs(job, output_dir, pore_table_format)
+        remove_gpd_stats(output_dir, [job["name"] for job in existing])
+        log(f"Overwriting the outputs of {len(existing)} mosaic(s)")
+    workers = workers or os.cpu_count() or 1
+    results = []
+    run_start = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        futures = {pool.submit(process_one, job, output_dir, tile_size, threads, border_size,
+                               backend, trace_all, morpho_workers, cache_dir, segmented_format,
+                               pore_table_format, trace_memory, profile): job for job in jobs}
+        for future in as_completed(futures):
+            job = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                # The worker process itself died (e.g. out of memory)
+                result = {"name": job["name"], "path": job["path"], "status": "failed",
+                          "seconds": 0.0, "pores": 0, "summary": None,
+                          "error": f"{type(e).__name__}: {e}"}
+
+            if result["status"] == "ok":
+                try:
+                    append_gpd_stats(output_dir, result["summary"])
+                except Exception as e:
+                    result["status"] = "failed"
+                    result["error"] = f"Failed to save statistics: {e}"
+
+            results.append(result)
+            log(f"[{len(results)}/{len(jobs)}] {result['name']}: {result['status']} "
+                f"in {result['seconds']:.1f} s"
+                + (f" ({result['pores']} pores)" if result["status"] == "ok" else f" - {result['error']}"))
+
+    write_batch_report(os.path.join(output_dir, "batch_report.csv"), results)
+    failed = sum(1 for r in results if r["status"] != "ok")
+    log(f"Processed {len(results) - failed}/{len(results)} mosaics in "
+        f"{time.perf_counter() - run_start:.1f} s ({failed} failed)")
+    return results
+
+
+def write_batch_report(filename, results):
+    """Write one row per mosaic with its status, wall time and error"""
+    with open(filename, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["name", "path", "status", "seconds", "pores", "error"])
+        for r in results:
+            writer.writerow([r["name"], r["path"], r["status"], f"{r['seconds']:.3f}", r["pores"], r["error"]])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Batch processing of binary soil thin section mosaics")
+    parser.add_argument("input", help="Directory of mosaics or CSV manifest (path[,name][,calibration][,campaign])")
+    parser.add_argument("-o", "--output", required=True, help="Output directory")
+    parser.add_argument("-c", "--calibration", type=float, default=DEFAULT_CALIBRATION,
+                        help="Pixel calibration (pixel/μm) when the manifest does not give one")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="Worker processes (default: all cores)")
+    parser.add_argument("--tile-size", type=int, default=None,
+                        help="Extract contours in tiles of this size (for very large mosaics)")
+    parser.add_argument("--threads", type=int, default=None,
+                        help="Threads per worker for the tiled extraction (default: all cores)")
+    parser.add_argument("--edge-width", type=int, default=1,
+                        help="Pores within this many pixels of the mosaic border are flagged is_edge")
+    parser.add_argument("--backend", choices=["contours", "components"], default="contours",
+                        help="Pore extraction: contour polygons or pixel-exact connected components")
+    parser.add_argument("--trace", choices=["all", "large"], default="all",
+                        help="With --backend components, trace the contours of all pores or only of those > 50 μm")
+    parser.add_argument("--morpho-workers", type=int, default=None,
+                        help="Processes per mosaic for the pore morphometrics (useful with -w 1 on huge mosaics)")
+    parser.add_argument("--cache-dir", default=None,
+                        help="Reuse the results of mosaics already processed, cached in this folder")
+    parser.add_argument("--segmented-format", choices=SEGMENTED_FORMATS, default="xlsx",
+                        help="Segmented pore data as one workbook per shape (xlsx) or one text file per shape-size")
+    parser.add_argument("--pore-table", choices=PORE_TABLE_FORMATS, default=None,
+                        help="Also write the morphometrics of every pore as a Parquet or Arrow table (needs pyarrow)")
+    parser.add_argument("--campaign", default=None,
+                        help="Campaign of the mosaics when the manifest does not give one: pore tables are "
+                             "partitioned by campaign")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="Record the peak memory of each stage in the run reports (slower)")
+    parser.add_argument("--profile", action="store_true",
+                        help="Save a cProfile profile of each mosaic (<mosaic>_run_report.prof)")
+    parser.add_argument("--overwrite", action="store_true",
+                        help="Replace the outputs of mosaics already processed into OUTPUT_DIR")
+    args = parser.parse_args(argv)
+
+    if args.pore_table and not pore_table_available():
+        print("--pore-table needs the pyarrow package (pip install pyarrow)", file=sys.stderr)
+        return 1
+
+    jobs = find_mosaics(args.input, args.calibration, args.campaign)
+    if not jobs:
+        print(f"No mosaics found in '{args.input}'", file=sys.stderr)
+        return 1
+
+    try:
+        results = run_batch(jobs, os.path.abspath(args.output), args.workers, args.tile_size, args.threads,
+                            args.edge_width, args.backend, args.trace == "all", args.morpho_workers,
+                            args.cache_dir, args.segmented_format, args.pore_table, args.trace_memory,
+                            args.profile, args.overwrite)
+    except FileExistsError as e:
+        print(f"{e}: use --overwrite to replace them", file=sys.stderr)
+        return 1
+    return 0 if all(r["status"] == "ok" for r in results) else 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,384 @@
+"""
+Benchmark of the processing hot paths on synthetic thin sections.
+
+For each size, a seeded synthetic section (see synthetic.py) is generated and
+every stage of the pipeline is run on it:
+
+    contours               enhanced_process_mosaic_optimized (single call, the reference)
+    contours_tiled         same, tiled and multi-threaded
+    contours_components    same, connected-components backend
+    edges                  detect_edge_contours_optimized (checked against the original
+                           per-contour mask test)
+    global_stats           proc_cont_all (checked against the original list loops)
+    morphometrics          proc_cont_great_50
+    pore_geometry          convex hulls and ellipse fits of the pores > 50 micron
+                           (serial, the reference)
+    pore_geometry_parallel same, on a process pool (pore_geometry_parallel,
+                           whatever the number of pores)
+    save_hdf5              write_contours_hdf5 (save_enhanced_contours_hdf5)
+    vis_render             rendering of the Visualize tab (_vis_update_display
+                           without Tk) at several zoom levels
+
+Each stage reports its best wall time over --repeat runs, its CPU time, the
+peak memory traced by tracemalloc on an extra run (NumPy and Python
+allocations; OpenCV's own buffers are not traced) and its throughput. The
+optimized paths are checked against the reference ones (and the saved file
+against the table it was written from): a stage whose outputs differ is
+reported as FAILED and the exit code is 2.
+
+Usage:
+    python benchmark.py [--sizes 1 16 100] [--pores-per-mp 1000] [--distribution lognormal]
+                        [--repeat 3] [--workers N] [--on-disk DIR] [--report bench.csv|bench.json]
+
+Multi-gigapixel sections are written band by band to DIR with --on-disk and
+memory-mapped instead of held in memory.
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from types import SimpleNamespace
+import cv2
+import numpy as np
+from synthetic import SYNTHETIC_PORES_PER_MP, side_for_megapixels, synthetic_mosaic, write_synthetic_mosaic
+from proc_mosaic import (enhanced_process_mosaic_optimized, detect_edge_contours_optimized, proc_cont_all,
+                         proc_cont_great_50, diameter_to_area)
+from morphometrics import pore_geometry, pore_geometry_parallel
+from contour_table import ContourTable
+from pore_io import write_contours_hdf5, read_contours_hdf5, PoreReader
+from spatial_index import GridIndex
+from pyramid import ImagePyramid
+from visualize_tab import _vis_render_view
+
+# Section sizes (megapixels) benchmarked by default
+DEFAULT_SIZES = (1, 16)
+
+# Tile side of the tiled extraction: small enough for 1 MP sections to have seams
+BENCH_TILE_SIZE = 1024
+
+# Pixel calibration of the synthetic sections (pixel/micron), as the Processing tab default
+BENCH_CALIBRATION = 0.3051
+
+# Zoom levels rendered by the vis_render stage, and canvas size
+VIS_ZOOMS = (1, 4, 16)
+VIS_CANVAS = (1200, 800)
+
+# Columns of the report, in order
+REPORT_COLUMNS = ("megapixels", "stage", "seconds", "cpu_seconds", "peak_mb", "items", "mpix_per_s",
+                  "items_per_s", "check")
+
+
+def measure(fn, repeat=1, memory=True):
+    """
+    Time a function.
+
+    Args:
+        fn: Function without arguments
+        repeat: Timed runs (the best one is reported)
+        memory: Run once more under tracemalloc for the peak memory
+
+    Returns:
+        (result, seconds, cpu_seconds, peak_bytes): result of the last run,
+        best wall and CPU times, and peak traced memory (None without memory)
+    """
+    seconds = cpu_seconds = float("inf")
+    for _ in range(repeat):
+        start, cpu_start = time.perf_counter(), time.process_time()
+        result = fn()
+        seconds = min(seconds, time.perf_counter() - start)
+        cpu_seconds = min(cpu_seconds, time.process_time() - cpu_start)
+    peak = None
+    if memory:
+        # Separate run: tracing slows down Python code a lot
+        del result
+        tracemalloc.start()
+        try:
+            result = fn()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return result, seconds, cpu_seconds, peak
+
+
+def tables_equal(a, b, columns=ContourTable.COLUMNS[:-2]):
+    """True if two ContourTables hold the same pores (columns and contour points), in the same order"""
+    if len(a) != len(b):
+        return False
+    for name in columns:
+        if not np.array_equal(getattr(a, name), getattr(b, name), equal_nan=True):
+            return False
+    (pa, oa, ra), (pb, ob, rb) = a.pack(), b.pack()
+    return np.array_equal(oa, ob) and np.array_equal(ra, rb) and np.array_equal(pa, pb)
+
+
+def edge_flags_reference(image, contours, border_size=1):
+    """
+    Edge flags as the original detect_edge_contours_optimized computed them:
+    the contour of every pore whose bounding box is near the frame is drawn
+    in a small mask, and the mask is tested against each border it can touch.
+    """
+    height, width = image.shape[:2]
+    is_edge_contour = []
+
+    # A border mask for each edge of the image
+    left_edge = np.full((height, border_size), 255, dtype=np.uint8)
+    right_edge = np.full((height, border_size), 255, dtype=np.uint8)
+    top_edge = np.full((border_size, width), 255, dtype=np.uint8)
+    bottom_edge = np.full((border_size, width), 255, dtype=np.uint8)
+
+    for contour in contours:
+        x, y, w, h = cv2.boundingRect(contour)
+        if not (x <= border_size or y <= border_size or x + w >= width - border_size or
+                y + h >= height - border_size):
+            # Bounding box away from the edge: the contour is too
+            is_edge_contour.append(False)
+            continue
+
+        # Mask of the bounding rectangle (with padding) with the filled contour
+        padding = border_size + 1
+        x_start, y_start = max(0, x - padding), max(0, y - padding)
+        x_end, y_end = min(width, x + w + padding), min(height, y + h + padding)
+        small_mask = np.zeros((y_end - y_start, x_end - x_start), dtype=np.uint8)
+        cv2.drawContours(small_mask, [contour - np.array([[x_start, y_start]])], 0, 255, -1)
+
+        # Check each edge that the bounding box might touch
+        touches_edge = False
+        if x_start == 0:  # Left edge
+            edge_slice = left_edge[y_start:y_end, 0:min(border_size, small_mask.shape[1])]
+            if edge_slice.shape[1] > 0:
+                mask_slice = small_mask[:, 0:edge_slice.shape[1]]
+                touches_edge = bool(np.any(cv2.bitwise_and(mask_slice, edge_slice)))
+        if not touches_edge and x_end == width:  # Right edge
+            edge_slice = right_edge[y_start:y_end, 0:min(border_size, small_mask.shape[1])]
+            if edge_slice.shape[1] > 0:
+                mask_slice = small_mask[:, -edge_slice.shape[1]:]
+                touches_edge = bool(np.any(cv2.bitwise_and(mask_slice, edge_slice)))
+        if not touches_edge and y_start == 0:  # Top edge
+            edge_slice = top_edge[0:min(border_size, small_mask.shape[0]), x_start:x_end]
+            if edge_slice.shape[0] > 0:
+                mask_slice = small_mask[0:edge_slice.shape[0], :]
+                touches_edge = bool(np.any(cv2.bitwise_and(mask_slice, edge_slice)))
+        if not touches_edge and y_end == height:  # Bottom edge
+            edge_slice = bottom_edge[0:min(border_size, small_mask.shape[0]), x_start:x_end]
+            if edge_slice.shape[0] > 0:
+                mask_slice = small_mask[-edge_slice.shape[0]:, :]
+                touches_edge = bool(np.any(cv2.bitwise_and(mask_slice, edge_slice)))
+        is_edge_contour.append(touches_edge)
+    return np.array(is_edge_contour, dtype=bool)
+
+
+def summary_reference(image, table, area_50):
+    """Global stats row as the original proc_cont_all computed it, with list loops over the pore rows"""
+    # Rows [idx, is_edge, parent, children, area, perimeter], as the pores were held
+    processed_contours = list(table.iter_rows())
+    image_area = np.shape(image)[0] * np.shape(image)[1]
+
+    num_parent_contours = len(processed_contours)
+    num_child_contours = sum([len(contour[3]) for contour in processed_contours])
+    cont_total_area = sum([contour[4] for contour in processed_contours])
+
+    num_parent_contours_less_50 = sum([1 for contour in processed_contours if contour[4] <= area_50])
+    num_child_contours_less_50 = sum([len(contour[3]) for contour in processed_contours if contour[4] <= area_50])
+    cont_total_area_less_50 = sum([contour[4] for contour in processed_contours if contour[4] <= area_50])
+
+    num_parent_contours_great_50 = sum([1 for contour in processed_contours if contour[4] > area_50])
+    num_child_contours_great_50 = sum([len(contour[3]) for contour in processed_contours if contour[4] > area_50])
+    cont_total_area_great_50 = sum([contour[4] for contour in processed_contours if contour[4] > area_50])
+
+    return (
+        num_parent_contours, num_child_contours, cont_total_area / image_area,
+        num_parent_contours_less_50, num_child_contours_less_50, cont_total_area_less_50 / cont_total_area,
+        num_parent_contours_great_50, num_child_contours_great_50, cont_total_area_great_50 / cont_total_area,
+    )
+
+
+def vis_state(image, h5_path):
+    """Visualize tab state (see visualize_tab.py) for rendering without Tk"""
+    reader = PoreReader(h5_path)
+    pyramid = ImagePyramid(image)
+    # Every level is built beforehand, as the tab does in the background
+    pyramid.get(pyramid.num_levels - 1)
+    return SimpleNamespace(
+        vis_binary_image=image, vis_pyramid=pyramid, vis_reader=reader, vis_index=GridIndex(reader.bboxes()),
+        vis_zoom=1.0, vis_pan_x=0.0, vis_pan_y=0.0, vis_line_thickness_var=SimpleNamespace(get=lambda: 2),
+        _vis_pore=None,
+    )
+
+
+def render_views(state, zooms=VIS_ZOOMS, canvas=VIS_CANVAS):
+    """Render the centre of the section at each zoom level; returns the number of frames"""
+    for zoom in zooms:
+        state.vis_zoom = zoom
+        _vis_render_view(state, *canvas)
+    return len(zooms)
+
+
+def benchmark_section(image, repeat=1, memory=True, workers=None, tile_size=BENCH_TILE_SIZE,
+                      calibration=BENCH_CALIBRATION, log=print):
+    """
+    Run every stage on a section.
+
+    Args:
+        image: Binary section (array or memory-mapped array)
+        repeat: Timed runs per stage
+        memory: Also measure the peak traced memory of each stage
+        workers: Threads of the tiled extraction and processes of the parallel
+                 pore geometry (default: all cores)
+        tile_size: Tile side of the tiled extraction
+        calibration: Pixel calibration (pixel/micron)
+        log: Callable used to report each stage
+
+    Returns:
+        List of report rows (dicts with the keys of REPORT_COLUMNS)
+    """
+    workers = workers or os.cpu_count() or 1
+    megapixels = image.shape[0] * image.shape[1] / 1e6
+    rows = []
+
+    def stage(name, fn, items=None, check=None):
+        result, seconds, cpu_seconds, peak = measure(fn, repeat, memory)
+        num = items(result) if items is not None else None
+        ok = None if check is None else bool(check(result))
+        rows.append({
+            "megapixels": round(megapixels, 3),
+            "stage": name,
+            "seconds": seconds,
+            "cpu_seconds": cpu_seconds,
+            "peak_mb": None if peak is None else peak / 1024 ** 2,
+            "items": num,
+            "mpix_per_s": megapixels / seconds if seconds else None,
+            "items_per_s": num / seconds if num is not None and seconds else None,
+            "check": "-" if ok is None else "ok" if ok else "FAILED",
+        })
+        log(format_row(rows[-1]))
+        return result
+
+    table = stage("contours", lambda: enhanced_process_mosaic_optimized(image), len)
+    stage("contours_tiled", lambda: enhanced_process_mosaic_optimized(image, tile_size, workers), len,
+          lambda tiled: tables_equal(tiled, table))
+    # Pixel-exact areas differ from the polygon areas by design: the rest must match
+    stage("contours_components", lambda: enhanced_process_mosaic_optimized(image, backend="components"), len,
+          lambda components: tables_equal(components, table, ("idx", "is_edge", "perimeter", "num_children", "bbox")))
+
+    parents = [table.parent(i) for i in range(len(table))]
+    stage("edges", lambda: detect_edge_contours_optimized(image, parents), len,
+          lambda flags: np.array_equal(flags, edge_flags_reference(image, parents)))
+
+    state = SimpleNamespace(image=image, calibration=calibration, area_50=diameter_to_area(50, calibration),
+                            processed_contours=table)
+    def global_stats():
+        proc_cont_all(state)
+        return state.summary
+    stage("global_stats", global_stats, lambda _: len(table),
+          lambda summary: np.allclose(summary, summary_reference(image, table, state.area_50), rtol=1e-12))
+
+    def morphometrics():
+        proc_cont_great_50(state)
+        return state.morphometrics
+    stage("morphometrics", morphometrics, lambda m: len(m["idx"]))
+
+    # The convex hulls and ellipse fits alone, serial and on the process pool
+    # (called directly: proc_cont_great_50 only uses the pool above
+    # PARALLEL_MORPHO_MIN_PORES pores)
+    pores_great_50 = table[table.area > state.area_50]
+    geometry = stage("pore_geometry", lambda: pore_geometry(pores_great_50.points, pores_great_50.ring_offsets,
+                                                            pores_great_50.ring_start, pores_great_50.ring_stop),
+                     lambda _: len(pores_great_50))
+    stage("pore_geometry_parallel", lambda: pore_geometry_parallel(pores_great_50, workers),
+          lambda _: len(pores_great_50),
+          lambda parallel: all(np.array_equal(a, b, equal_nan=True) for a, b in zip(parallel, geometry)))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        h5_path = os.path.join(tmp, "section.h5")
+
+        def save():
+            if os.path.exists(h5_path):
+                os.remove(h5_path)
+            write_contours_hdf5(h5_path, table)
+            return h5_path
+        stage("save_hdf5", save, lambda _: len(table), lambda path: tables_equal(read_contours_hdf5(path), table))
+
+        vis = vis_state(image, h5_path)
+        try:
+            stage("vis_render", lambda: render_views(vis), lambda frames: frames)
+        finally:
+            vis.vis_reader.close()
+    return rows
+
+
+def format_row(row):
+    """One line of the console report"""
+    peak = "-" if row["peak_mb"] is None else f"{row['peak_mb']:.1f}"
+    items = "" if row["items_per_s"] is None else f"{row['items_per_s']:12.0f} items/s"
+    return (f"  {row['megapixels']:9.1f} MP  {row['stage']:24s} {row['seconds']:9.3f} s  "
+            f"cpu {row['cpu_seconds']:9.3f} s  peak {peak:>8s} MB  {row['mpix_per_s']:9.1f} MP/s "
+            f"{items}  {row['check']}")
+
+
+def write_report(filename, rows):
+    """Write the report rows as CSV, or as JSON if filename ends with .json"""
+    if filename.lower().endswith(".json"):
+        with open(filename, "w") as f:
+            json.dump(rows, f, indent=2)
+        return
+    with open(filename, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=REPORT_COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the processing hot paths on synthetic sections")
+    parser.add_argument("--sizes", type=float, nargs="+", default=list(DEFAULT_SIZES),
+                        help="Section sizes in megapixels (square sections)")
+    parser.add_argument("--pores-per-mp", type=float, default=SYNTHETIC_PORES_PER_MP, help="Pores per megapixel")
+    parser.add_argument("--distribution", choices=["lognormal", "powerlaw"], default="lognormal",
+                        help="Distribution of the pore equivalent diameters")
+    parser.add_argument("--median-diameter", type=float, default=8.0,
+                        help="Median (lognormal) or smallest (powerlaw) pore diameter in pixels")
+    parser.add_argument("--elongated", type=float, default=0.15, help="Fraction of elongated pores")
+    parser.add_argument("--holes", type=float, default=0.1, help="Fraction of pores with a hole")
+    parser.add_argument("--edge-pores", type=int, default=None,
+                        help="Pores on the section frame (default: 1%% of the pores)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic sections")
+    parser.add_argument("--repeat", type=int, default=1, help="Timed runs per stage (the best one is reported)")
+    parser.add_argument("--no-memory", action="store_true", help="Skip the peak memory runs")
+    parser.add_argument("-w", "--workers", type=int, default=None,
+                        help="Threads/processes of the parallel stages (default: all cores)")
+    parser.add_argument("--tile-size", type=int, default=BENCH_TILE_SIZE, help="Tile side of contours_tiled")
+    parser.add_argument("--on-disk", default=None,
+                        help="Write the sections to this folder (memory-mapped .npy) instead of memory")
+    parser.add_argument("--report", default=None, help="Write the results to this .csv or .json file")
+    args = parser.parse_args(argv)
+
+    rows = []
+    for megapixels in args.sizes:
+        side = side_for_megapixels(megapixels)
+        pore_args = dict(
+            num_pores=int(round(side * side / 1e6 * args.pores_per_mp)), seed=args.seed,
+            distribution=args.distribution, median_diameter=args.median_diameter,
+            elongated_fraction=args.elongated, hole_fraction=args.holes, edge_pores=args.edge_pores,
+        )
+        start = time.perf_counter()
+        if args.on_disk:
+            os.makedirs(args.on_disk, exist_ok=True)
+            path = os.path.join(args.on_disk, f"synthetic_{side}x{side}_seed{args.seed}.npy")
+            write_synthetic_mosaic(path, side, side, **pore_args)
+            image = np.load(path, mmap_mode="r")
+        else:
+            image = synthetic_mosaic(side, side, **pore_args)
+        print(f"Section {side}x{side} px ({side * side / 1e6:.1f} MP, {pore_args['num_pores']} pores drawn) "
+              f"generated in {time.perf_counter() - start:.1f} s")
+        rows.extend(benchmark_section(image, args.repeat, not args.no_memory, args.workers, args.tile_size))
+
+    if args.report:
+        write_report(args.report, rows)
+    return 2 if any(row["check"] == "FAILED" for row in rows) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
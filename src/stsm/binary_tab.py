@@ -1,7 +1,8 @@
 import tkinter as tk
 from tkinter import ttk
-from load_save import load_image, save_image
-from display import update_display
+from load_save import load_image, save_image, fuse_image
+from layer_controls import build_layer_rows
+from fusion import FUSION_REDUCERS
 
 def binary_tab(self):
     # Create a frame for controls
@@ -16,55 +17,48 @@ def binary_tab(self):
     )
     self.load_button.pack(pady=5, padx=60)
     
+    # Fusion settings of the polarized images (see fusion.py)
+    self.fusion_frame = ttk.LabelFrame(self.binary_frame_controls, text="Fusion")
+    self.fusion_frame.pack(pady=5, fill=tk.X)
+    
+    ttk.Label(self.fusion_frame, text="Reducer:").grid(row=0, column=0, sticky=tk.W, padx=5, pady=2)
+    self.fusion_reducer = tk.StringVar(value="weighted")
+    ttk.Combobox(
+        self.fusion_frame,
+        textvariable=self.fusion_reducer,
+        values=FUSION_REDUCERS,
+        state="readonly",
+        width=12
+    ).grid(row=0, column=1, sticky=tk.W, padx=5, pady=2)
+    
+    # Weights separated by commas, one per image (blank: equal weights)
+    ttk.Label(self.fusion_frame, text="Weights:").grid(row=1, column=0, sticky=tk.W, padx=5, pady=2)
+    self.fusion_weights = tk.StringVar(value="")
+    ttk.Entry(self.fusion_frame, textvariable=self.fusion_weights, width=15).grid(
+        row=1, column=1, sticky=tk.W, padx=5, pady=2
+    )
+    
+    ttk.Label(self.fusion_frame, text="Percentile:").grid(row=2, column=0, sticky=tk.W, padx=5, pady=2)
+    self.fusion_percentile = tk.StringVar(value="50")
+    ttk.Entry(self.fusion_frame, textvariable=self.fusion_percentile, width=15).grid(
+        row=2, column=1, sticky=tk.W, padx=5, pady=2
+    )
+    
+    # Fuse the loaded images again with the current settings
+    self.fuse_button = ttk.Button(
+        self.fusion_frame,
+        text="Fuse again",
+        command= lambda: fuse_image(self)
+    )
+    self.fuse_button.grid(row=3, column=0, columnspan=2, pady=5)
+    
     # Create a unified layer control frame - but don't pack it yet
     self.unified_layer_frame = ttk.LabelFrame(self.binary_frame_controls, text="Layer Controls")
     # We'll pack this after images are loaded
     
-    # Create individual layer control rows
+    # Create individual layer control rows (rebuilt when the number of images changes)
     self.layer_rows = []
-    for i, name in enumerate(self.layer_names):
-        # Create a frame for this layer's controls
-        layer_frame = ttk.Frame(self.unified_layer_frame)
-        layer_frame.pack(fill=tk.X, padx=5, pady=2)
-        
-        # Add visibility checkbutton
-        visibility_cb = ttk.Checkbutton(
-            layer_frame,
-            variable=self.layer_visibility[i],
-            command= lambda: update_display(self)
-        )
-        visibility_cb.pack(side=tk.LEFT, padx=(0, 5))
-        
-        # Add layer name label
-        layer_label = ttk.Label(layer_frame, text=name, width=15)
-        layer_label.pack(side=tk.LEFT, padx=5)
-        
-        # Add move up button
-        up_button = ttk.Button(
-            layer_frame, 
-            text="↑", 
-            width=2,
-            command=lambda idx=i: self.move_layer_up_by_index(idx)
-        )
-        up_button.pack(side=tk.LEFT, padx=2)
-        
-        # Add move down button
-        down_button = ttk.Button(
-            layer_frame, 
-            text="↓", 
-            width=2,
-            command=lambda idx=i: self.move_layer_down_by_index(idx)
-        )
-        down_button.pack(side=tk.LEFT, padx=2)
-        
-        # Store references to this layer's controls
-        self.layer_rows.append({
-            'frame': layer_frame,
-            'visibility': visibility_cb,
-            'label': layer_label,
-            'up_button': up_button,
-            'down_button': down_button
-        })
+    build_layer_rows(self)
 
     # Create save button frame - but don't pack it yet
     self.save_frame = ttk.Frame(self.binary_frame_controls)
@@ -0,0 +1,73 @@
+import tkinter as tk
+from tkinter import ttk
+from load_save import load_tiles, stitch_tiles
+from stitching import SCAN_ORDERS, STITCH_OVERLAP
+
+def build_tab(self):
+    # Create a frame for controls
+    self.build_frame_controls = ttk.Frame(self.build_frame)
+    self.build_frame_controls.pack(side=tk.LEFT, fill=tk.Y, padx=5, pady=5)
+
+    # Create a button to select the folder of tiles
+    self.load_tiles_button = ttk.Button(
+        self.build_frame_controls,
+        text="Load Tiles",
+        command= lambda: load_tiles(self)
+    )
+    self.load_tiles_button.pack(pady=5, padx=60)
+    
+    # Number of tiles loaded
+    self.tiles_label = ttk.Label(self.build_frame_controls, text="No tiles loaded")
+    self.tiles_label.pack(pady=(0, 5))
+    
+    # Grid of the tiles (see stitching.py)
+    self.grid_frame = ttk.LabelFrame(self.build_frame_controls, text="Tile grid")
+    self.grid_frame.pack(pady=5, fill=tk.X)
+    
+    # Columns are only needed when the tile names have no row and column
+    ttk.Label(self.grid_frame, text="Columns:").grid(row=0, column=0, sticky=tk.W, padx=5, pady=2)
+    self.grid_cols = tk.StringVar(value="")
+    ttk.Entry(self.grid_frame, textvariable=self.grid_cols, width=15).grid(
+        row=0, column=1, sticky=tk.W, padx=5, pady=2
+    )
+    
+    ttk.Label(self.grid_frame, text="Scan order:").grid(row=1, column=0, sticky=tk.W, padx=5, pady=2)
+    self.grid_order = tk.StringVar(value=SCAN_ORDERS[0])
+    ttk.Combobox(
+        self.grid_frame,
+        textvariable=self.grid_order,
+        values=SCAN_ORDERS,
+        state="readonly",
+        width=12
+    ).grid(row=1, column=1, sticky=tk.W, padx=5, pady=2)
+    
+    ttk.Label(self.grid_frame, text="Overlap (%):").grid(row=2, column=0, sticky=tk.W, padx=5, pady=2)
+    self.grid_overlap = tk.StringVar(value=f"{STITCH_OVERLAP * 100:g}")
+    ttk.Entry(self.grid_frame, textvariable=self.grid_overlap, width=15).grid(
+        row=2, column=1, sticky=tk.W, padx=5, pady=2
+    )
+    
+    # Create a button to stitch the tiles into a mosaic file
+    self.stitch_button = ttk.Button(
+        self.build_frame_controls,
+        text="Build Mosaic",
+        command= lambda: stitch_tiles(self),
+        state=tk.DISABLED  # Enabled once tiles are loaded
+    )
+    self.stitch_button.pack(pady=5)
+    
+    # Create a frame for image display
+    self.build_frame_images = ttk.Frame(self.build_frame)
+    self.build_frame_images.pack(side=tk.RIGHT, fill=tk.BOTH, expand=True)
+    
+    # Create a canvas for displaying the mosaic
+    self.build_canvas = tk.Canvas(self.build_frame_images)
+    self.build_canvas.pack(fill=tk.BOTH, expand=True)
+    
+    # Add a label to show when no mosaic is built
+    self.build_no_image_label = ttk.Label(
+        self.build_canvas,
+        text="No mosaic built. Click 'Load Tiles' to begin.",
+    )
+    
+    self.build_canvas.create_window(640, 360, window=self.build_no_image_label)
@@ -0,0 +1,270 @@
+import numpy as np
+
+
+class ContourTable:
+    """
+    Columnar (structure-of-arrays) store of the pores found in a mosaic.
+
+    All contour points live in one (P, 2) buffer of compact integer
+    coordinates. A ring is a parent or child contour, i.e. a range of that
+    buffer given by `ring_offsets`. Pore i owns the rings ring_start[i] to
+    ring_stop[i] - 1; the first one is its parent, the others its children.
+    Pores whose contours were not traced own no rings.
+
+    Per pore columns (one entry per row):
+        idx: pore id (position in the full table)
+        is_edge: True if the pore touches the image frame
+        area: area of the parent minus the area of its children
+        perimeter: perimeter of the parent plus the perimeter of its children
+        num_children: number of children (holes)
+        bbox: (x, y, w, h) bounding box of the parent
+        ring_start, ring_stop: range of rings of the pore
+
+    Indexing a table with a slice, a boolean mask or an array of positions
+    returns a table over the same points and rings buffers (only the per pore
+    columns are taken), so filtering never copies contour points.
+    """
+
+    COLUMNS = ("idx", "is_edge", "area", "perimeter", "num_children", "bbox", "ring_start", "ring_stop")
+
+    def __init__(self, points, ring_offsets, idx, is_edge, area, perimeter, num_children, bbox,
+                 ring_start, ring_stop):
+        self.points = points
+        self.ring_offsets = ring_offsets
+        self.idx = idx
+        self.is_edge = is_edge
+        self.area = area
+        self.perimeter = perimeter
+        self.num_children = num_children
+        self.bbox = bbox
+        self.ring_start = ring_start
+        self.ring_stop = ring_stop
+
+    @classmethod
+    def from_contours(cls, parents, children, is_edge=None, area=None, perimeter=None,
+                      num_children=None, bbox=None):
+        """
+        Build a table from findContours style contours.
+
+        Area, perimeter and bounding box are computed from the contours exactly
+        as cv2.contourArea, cv2.arcLength and cv2.boundingRect do, unless given.
+        A pore with parent None (or empty) has no contours: its area,
+        num_children and bbox must then be given.
+
+        Args:
+            parents: List of parent contours (or None), one per pore
+            children: List with the list of child contours of each pore
+            is_edge, area, perimeter, num_children, bbox: Optional column values
+        """
+        num = len(parents)
+        rings = []
+        ring_count = np.zeros(num, dtype=np.int64)
+        for i, (parent, child_contours) in enumerate(zip(parents, children)):
+            if parent is None or len(parent) == 0:
+                continue
+            rings.append(parent)
+            rings.extend(child_contours)
+            ring_count[i] = 1 + len(child_contours)
+
+        lengths = np.fromiter((len(r) for r in rings), dtype=np.int64, count=len(rings))
+        ring_offsets = np.zeros(len(rings) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=ring_offsets[1:])
+        points = _compact(np.concatenate(rings).reshape(-1, 2) if rings else np.zeros((0, 2), dtype=np.int32))
+
+        ring_stop = np.cumsum(ring_count)
+        ring_start = ring_stop - ring_count
+        traced = ring_count > 0
+
+        # Per ring geometry, summed per pore (parent + children)
+        ring_area, ring_perimeter, ring_mins, ring_maxs = _ring_geometry(points, ring_offsets)
+        owner = np.repeat(np.arange(num), ring_count)
+        is_child_ring = np.ones(len(rings), dtype=bool)
+        is_child_ring[ring_start[traced]] = False
+
+        # Parent value and sum of the children values, added in the same order as before
+        def parent_and_children(ring_values):
+            total = np.full(num, np.nan)
+            children_sum = np.bincount(owner, weights=ring_values * is_child_ring, minlength=num)
+            total[traced] = ring_values[ring_start[traced]]
+            return total, children_sum
+
+        if area is None:
+            parent_area, children_area = parent_and_children(ring_area)
+            area = parent_area - children_area
+        if perimeter is None:
+            parent_perimeter, children_perimeter = parent_and_children(ring_perimeter)
+            perimeter = parent_perimeter + children_perimeter
+        if num_children is None:
+            num_children = np.maximum(ring_count - 1, 0)
+        if bbox is None:
+            bbox = np.zeros((num, 4), dtype=np.int32)
+            bbox[traced, :2] = ring_mins[ring_start[traced]]
+            bbox[traced, 2:] = ring_maxs[ring_start[traced]] - ring_mins[ring_start[traced]] + 1
+        if is_edge is None:
+            is_edge = np.zeros(num, dtype=bool)
+
+        return cls(
+            points, ring_offsets,
+            idx=np.arange(num, dtype=np.int64),
+            is_edge=np.asarray(is_edge, dtype=bool),
+            area=np.asarray(area, dtype=np.float64),
+            perimeter=np.asarray(perimeter, dtype=np.float64),
+            num_children=np.asarray(num_children, dtype=np.int32),
+            bbox=np.asarray(bbox, dtype=np.int32).reshape(num, 4),
+            ring_start=ring_start,
+            ring_stop=ring_stop,
+        )
+
+    @classmethod
+    def empty(cls):
+        """A table without pores"""
+        return cls.from_contours([], [])
+
+    def __len__(self):
+        return len(self.idx)
+
+    def __getitem__(self, key):
+        """Rows selected by a slice, boolean mask or positions, sharing the points buffer"""
+        if isinstance(key, (int, np.integer)):
+            key = slice(key, key + 1 if key != -1 else None)
+        return ContourTable(
+            self.points, self.ring_offsets,
+            **{name: getattr(self, name)[key] for name in self.COLUMNS}
+        )
+
+    def _ring(self, r):
+        # Contours are handed out in the (N, 1, 2) int32 layout OpenCV expects
+        return self.points[self.ring_offsets[r]:self.ring_offsets[r + 1]].astype(np.int32).reshape(-1, 1, 2)
+
+    def parent(self, i):
+        """Parent contour of row i (None if it was not traced)"""
+        if self.ring_stop[i] == self.ring_start[i]:
+            return None
+        return self._ring(self.ring_start[i])
+
+    def children(self, i):
+        """List of child contours of row i"""
+        return [self._ring(r) for r in range(self.ring_start[i] + 1, self.ring_stop[i])]
+
+    def rings(self, i):
+        """Parent and child contours of row i"""
+        return [self._ring(r) for r in range(self.ring_start[i], self.ring_stop[i])]
+
+    def contours(self):
+        """All the contours (parents and children) of the table, e.g. for cv2.drawContours"""
+        return [self._ring(r) for i in range(len(self)) for r in range(self.ring_start[i], self.ring_stop[i])]
+
+    def pack(self):
+        """
+        Points and offsets of only the rows of the table, in row order.
+
+        Returns:
+            (points, ring_offsets, pore_rings): rings of row i are
+            pore_rings[i] to pore_rings[i + 1] - 1 of ring_offsets, which indexes points
+        """
+        rings = _ranges(self.ring_start, self.ring_stop)
+        ring_count = self.ring_stop - self.ring_start
+        pore_rings = np.zeros(len(self) + 1, dtype=np.int64)
+        np.cumsum(ring_count, out=pore_rings[1:])
+        if np.array_equal(rings, np.arange(len(self.ring_offsets) - 1)):
+            # Rows hold all the rings in order: no copy needed
+            return self.points, self.ring_offsets, pore_rings
+        starts, stops = self.ring_offsets[rings], self.ring_offsets[rings + 1]
+        ring_offsets = np.zeros(len(rings) + 1, dtype=np.int64)
+        np.cumsum(stops - starts, out=ring_offsets[1:])
+        return self.points[_ranges(starts, stops)], ring_offsets, pore_rings
+
+    def shifted(self, dx, dy):
+        """Copy of the table (packed, see pack) with contours and bboxes moved by (dx, dy)"""
+        points, ring_offsets, pore_rings = self.pack()
+        bbox = self.bbox.copy()
+        bbox[:, 0] += dx
+        bbox[:, 1] += dy
+        return ContourTable(
+            _compact(points.astype(np.int64) + (dx, dy)), ring_offsets,
+            idx=self.idx, is_edge=self.is_edge, area=self.area, perimeter=self.perimeter,
+            num_children=self.num_children, bbox=bbox, ring_start=pore_rings[:-1], ring_stop=pore_rings[1:],
+        )
+
+    @classmethod
+    def concatenate(cls, tables):
+        """One table with the rows of several tables, in order (the points are copied)"""
+        packed = [table.pack() for table in tables]
+        ring_offsets = [np.zeros(1, dtype=np.int64)]
+        pore_rings = [np.zeros(1, dtype=np.int64)]
+        # Running totals of points and rings (a table can have none)
+        point_total = ring_total = 0
+        for points, offsets, rings in packed:
+            ring_offsets.append(offsets[1:] + point_total)
+            pore_rings.append(rings[1:] + ring_total)
+            point_total += int(offsets[-1])
+            ring_total += int(rings[-1])
+        points = np.concatenate([p.astype(np.int64) for p, _, _ in packed]).reshape(-1, 2)
+        pore_rings = np.concatenate(pore_rings)
+        columns = {name: np.concatenate([getattr(t, name) for t in tables]) for name in cls.COLUMNS[:-2]}
+        return cls(_compact(points), np.concatenate(ring_offsets), **columns,
+                   ring_start=pore_rings[:-1], ring_stop=pore_rings[1:])
+
+    def iter_rows(self):
+        """Yield [idx, is_edge, parent, children, area, perimeter] per pore"""
+        for i in range(len(self)):
+            yield [
+                int(self.idx[i]),
+                bool(self.is_edge[i]),
+                self.parent(i),
+                self.children(i),
+                float(self.area[i]),
+                float(self.perimeter[i]),
+            ]
+
+
+def _ranges(starts, stops):
+    """Concatenation of the ranges starts[i]:stops[i], without a Python loop"""
+    lengths = stops - starts
+    total = int(lengths.sum())
+    if total == 0:
+        return np.zeros(0, dtype=np.int64)
+    # Each range continues from its own start: add the jump between ranges
+    steps = np.ones(total, dtype=np.int64)
+    firsts = np.cumsum(lengths) - lengths
+    nonempty = lengths > 0
+    steps[firsts[nonempty]] = starts[nonempty] - np.concatenate(([0], (stops[nonempty] - 1)[:-1]))
+    steps[0] = starts[nonempty][0]
+    return np.cumsum(steps)
+
+
+def _compact(points):
+    """Store coordinates as uint16 when the mosaic allows it (< 65536 px per side)"""
+    if len(points) and points.min() >= 0 and points.max() <= np.iinfo(np.uint16).max:
+        return points.astype(np.uint16)
+    return points.astype(np.int32)
+
+
+def _ring_geometry(points, ring_offsets):
+    """
+    Area, perimeter and bounding coordinates of every ring in a few vectorized passes.
+
+    Area uses the same shoelace formula as cv2.contourArea (exact in integers)
+    and perimeter the same float32 segment lengths, summed in order, as
+    cv2.arcLength, so both match OpenCV exactly.
+    """
+    num_rings = len(ring_offsets) - 1
+    if num_rings == 0:
+        empty = np.zeros((0, 2), dtype=np.int64)
+        return np.zeros(0), np.zeros(0), empty, empty
+    starts, stops = ring_offsets[:-1], ring_offsets[1:]
+
+    # Index of the previous point of each point in its (closed) ring
+    prev = np.arange(len(points), dtype=np.int64) - 1
+    prev[starts] = stops - 1
+
+    p = points.astype(np.int64)
+    cross = p[prev, 0] * p[:, 1] - p[prev, 1] * p[:, 0]
+    area = np.abs(np.add.reduceat(cross, starts)) / 2.0
+
+    pf = points.astype(np.float32)
+    d = pf - pf[prev]
+    seg = np.sqrt(d[:, 0] * d[:, 0] + d[:, 1] * d[:, 1]).astype(np.float64)
+    perimeter = np.add.reduceat(seg, starts)
+
+    return area, perimeter, np.minimum.reduceat(p, starts, axis=0), np.maximum.reduceat(p, starts, axis=0)
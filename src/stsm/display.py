@@ -1,6 +1,44 @@
 from PIL import Image, ImageTk
 import tkinter as tk
 import cv2
+import numpy as np
+
+
+def fitted_photo_image(cache, key, img, size):
+    """
+    PhotoImage of an image resized to the canvas, cached per layer.
+
+    The entry of a key is reused while its image object and display size are
+    unchanged, so toggling or reordering layers does not resample anything;
+    a new image or a canvas resize rebuilds it. Downsampling uses
+    cv2.INTER_AREA (area averaging), which is much faster than LANCZOS on
+    large mosaics and keeps thin pores visible.
+
+    Args:
+        cache: Dict of key -> (image, size, PhotoImage)
+        key: Layer key (e.g. the layer index)
+        img: Grayscale or BGR image, or a layer with a render(size) method
+        size: Display size (width, height)
+
+    Returns:
+        ImageTk.PhotoImage
+    """
+    entry = cache.get(key)
+    if entry is not None and entry[0] is img and entry[1] == size:
+        return entry[2]
+
+    if isinstance(img, np.ndarray):
+        interpolation = cv2.INTER_AREA if size[0] < img.shape[1] else cv2.INTER_LINEAR
+        fitted = cv2.resize(img, size, interpolation=interpolation)
+    else:
+        # Lazy layer (overlays.ContourOverlay): rasterized at display size
+        fitted = img.render(size)
+    # Color conversion after the resize, on the display size image only
+    if fitted.ndim == 3:
+        fitted = cv2.cvtColor(fitted, cv2.COLOR_BGR2RGB)
+    tk_img = ImageTk.PhotoImage(Image.fromarray(fitted))
+    cache[key] = (img, size, tk_img)
+    return tk_img
 
 def update_display(self):
     if not self.images:
@@ -29,19 +67,14 @@ def update_display(self):
     scale = min(scale_x, scale_y)
     
     # Calculate new dimensions
-    new_width = int(img_width * scale)
-    new_height = int(img_height * scale)
-    
-    # Convert OpenCV images to PIL format and resize
-    self.tk_images = []
-    for img in self.images:
-        # Convert to PIL Image
-        pil_img = Image.fromarray(img)
-        # Resize to fit canvas
-        pil_img = pil_img.resize((new_width, new_height), Image.LANCZOS)
-        # Convert to PhotoImage
-        tk_img = ImageTk.PhotoImage(pil_img)
-        self.tk_images.append(tk_img)
+    new_width = max(1, int(img_width * scale))
+    new_height = max(1, int(img_height * scale))
+    
+    # Fitted images of the layers (cached: only rebuilt on new images or canvas size)
+    self.tk_images = [
+        fitted_photo_image(self.display_cache, i, img, (new_width, new_height))
+        for i, img in enumerate(self.images)
+    ]
     
     # Calculate position to center the image
     x_pos = (canvas_width - new_width) // 2
@@ -81,25 +114,19 @@ def update_proc_display(self):
     # If in ROI selection mode, display the original image for ROI selection
     if self.roi_mode and self.roi_image is not None:
         # Calculate the scale factor to fit image in the canvas
-        img_height, img_width = self.roi_image.shape[:2]
+        # (roi_image is a downsampled preview: the scale refers to the original image)
+        img_height, img_width = self.original_image.shape[:2]
         scale_x = canvas_width / img_width
         scale_y = canvas_height / img_height
         scale = min(scale_x, scale_y)
         self.roi_scale = scale
         
         # Calculate new dimensions
-        new_width = int(img_width * scale)
-        new_height = int(img_height * scale)
+        new_width = max(1, int(img_width * scale))
+        new_height = max(1, int(img_height * scale))
         
-        # Convert to PIL Image
-        rgb_image = cv2.cvtColor(self.roi_image, cv2.COLOR_BGR2RGB)
-        pil_img = Image.fromarray(rgb_image)
-        
-        # Resize to fit canvas
-        pil_img = pil_img.resize((new_width, new_height), Image.LANCZOS)
-        
-        # Convert to PhotoImage
-        tk_img = ImageTk.PhotoImage(pil_img)
+        # Fitted preview (cached until the preview or the canvas size changes)
+        tk_img = fitted_photo_image(self.proc_display_cache, "roi", self.roi_image, (new_width, new_height))
         self.roi_tk_image = tk_img  # Store reference to prevent garbage collection
         
         # Calculate position to center the image
@@ -130,24 +157,14 @@ def update_proc_display(self):
         scale = min(scale_x, scale_y)
         
         # Calculate new dimensions
-        new_width = int(img_width * scale)
-        new_height = int(img_height * scale)
+        new_width = max(1, int(img_width * scale))
+        new_height = max(1, int(img_height * scale))
         
-        # Convert OpenCV images to PIL format and resize
-        self.proc_tk_images = []
-        for img in self.proc_images:
-            # Convert to PIL Image (handle both grayscale and color images)
-            if len(img.shape) == 2:  # Grayscale
-                pil_img = Image.fromarray(img)
-            else:  # Color (BGR)
-                pil_img = Image.fromarray(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
-            
-            # Resize to fit canvas
-            pil_img = pil_img.resize((new_width, new_height), Image.LANCZOS)
-            
-            # Convert to PhotoImage
-            tk_img = ImageTk.PhotoImage(pil_img)
-            self.proc_tk_images.append(tk_img)
+        # Fitted images of the layers (grayscale or BGR; cached per layer and canvas size)
+        self.proc_tk_images = [
+            fitted_photo_image(self.proc_display_cache, i, img, (new_width, new_height))
+            for i, img in enumerate(self.proc_images)
+        ]
         
         # Calculate position to center the image
         x_pos = (canvas_width - new_width) // 2
@@ -162,3 +179,40 @@ def update_proc_display(self):
                     anchor=tk.NW,
                     image=self.proc_tk_images[layer_idx]
                 )
+
+def update_build_display(self):
+    """Update the display in the build tab: preview of the stitched mosaic"""
+    if self.build_preview is None:
+        return
+        
+    # Hide the "no mosaic" label
+    self.build_no_image_label.place_forget()
+    
+    # Clear the canvas
+    self.build_canvas.delete("all")
+    
+    # Get canvas dimensions
+    canvas_width = self.build_canvas.winfo_width()
+    canvas_height = self.build_canvas.winfo_height()
+    
+    # If canvas size is not yet determined, use default values
+    if canvas_width <= 1:
+        canvas_width = 800
+    if canvas_height <= 1:
+        canvas_height = 600
+    
+    # Calculate the scale factor to fit the mosaic in the canvas
+    img_height, img_width = self.build_preview.shape[:2]
+    scale = min(canvas_width / img_width, canvas_height / img_height)
+    new_width = max(1, int(img_width * scale))
+    new_height = max(1, int(img_height * scale))
+    
+    # Fitted preview (cached until the mosaic or the canvas size changes)
+    self.build_tk_image = fitted_photo_image(
+        self.build_display_cache, "mosaic", self.build_preview, (new_width, new_height)
+    )
+    
+    # Display the mosaic centered
+    x_pos = (canvas_width - new_width) // 2
+    y_pos = (canvas_height - new_height) // 2
+    self.build_canvas.create_image(x_pos, y_pos, anchor=tk.NW, image=self.build_tk_image)
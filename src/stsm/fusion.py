@@ -0,0 +1,307 @@
+"""
+Fusion of the polarized images of a thin section into a binary mosaic.
+
+The Binary tab fuses the images taken at N polarizer angles pixel by pixel
+(see fuse_images and FUSION_REDUCERS), blurs the result with an 11x11
+Gaussian and thresholds it with Otsu's method. Two images with equal
+weights give the historical average (cv2.divide by 2 and cv2.add).
+binarize_images does it on whole arrays. binarize_tiled gives the same
+binary image (bit for bit) for images larger than memory:
+
+    1. tiles are read from the image sources with a halo of BLUR_HALO pixels
+       (what the blur of the tile core needs), fused and blurred, and the
+       core is written to the output .npy file; the histogram of every tile
+       is accumulated;
+    2. Otsu's threshold is computed from the total histogram, exactly as
+       OpenCV computes it from the whole image (see otsu_threshold);
+    3. the blurred image is thresholded in place, tile by tile.
+
+Tiles are processed in parallel by a thread pool (OpenCV releases the GIL),
+and only a few tiles per thread are in memory: the images of a tile are
+read one at a time into an accumulator, so more angles cost reading, not
+memory.
+
+Usage:
+    python fusion.py IMAGE_1 IMAGE_2 [IMAGE_3 ...] -o BINARY.npy [--reducer weighted]
+                     [--weights W1 W2 ...] [--percentile 50] [--tile-size 2048] [-w WORKERS]
+"""
+import argparse
+import math as m
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+from image_source import open_image_source
+from instrumentation import stage
+
+# Gaussian blur applied to the fused image, and the halo it needs around a tile
+BLUR_KSIZE = (11, 11)
+BLUR_HALO = BLUR_KSIZE[0] // 2
+
+# Side of the tiles of binarize_tiled (pixels)
+FUSION_TILE_SIZE = 2048
+
+# Above this size (pixels) the Binary tab fuses the images in tiles, to disk
+FUSION_TILED_MIN_PIXELS = 8192 * 8192
+
+
+# Per-pixel reducers of the fused images:
+#   weighted    sum of the images times their weights (normalized to sum 1),
+#               each weighted image rounded before the sum, as cv2.divide
+#               and cv2.add did for two images with equal weights
+#   mean        rounded mean
+#   max         maximum
+#   percentile  percentile of the pixel values (linear interpolation), rounded
+FUSION_REDUCERS = ("weighted", "mean", "max", "percentile")
+
+# Images fused at most (the accumulator holds 16 bit sums)
+MAX_FUSED_IMAGES = 257
+
+# Rows of the bands the percentile reducer sorts at once
+PERCENTILE_BAND_ROWS = 256
+
+
+def check_fusion(count, reducer="weighted", weights=None, percentile=50):
+    """
+    Validate the fusion settings of count images.
+
+    Raises:
+        ValueError: With a message for the user if the settings are invalid
+    """
+    if reducer not in FUSION_REDUCERS:
+        raise ValueError(f"Unknown fusion reducer '{reducer}' (one of {', '.join(FUSION_REDUCERS)})")
+    if not 1 <= count <= MAX_FUSED_IMAGES:
+        raise ValueError(f"Between 1 and {MAX_FUSED_IMAGES} images can be fused, not {count}")
+    if reducer == "weighted" and weights is not None:
+        if len(weights) != count:
+            raise ValueError(f"{len(weights)} weights given for {count} images")
+        if min(weights) < 0 or sum(weights) <= 0:
+            raise ValueError("Weights must be positive or zero, and not all zero")
+    if reducer == "percentile" and not 0 <= percentile <= 100:
+        raise ValueError("The percentile must be between 0 and 100")
+
+
+def _percentile_image(images, percentile):
+    # Percentile of the pixel values, band by band: only a band of every
+    # image is stacked at once
+    height, width = images[0].shape[:2]
+    out = np.empty((height, width), dtype=np.uint8)
+    pos = percentile / 100 * (len(images) - 1)
+    lo, hi = int(m.floor(pos)), int(m.ceil(pos))
+    for y0 in range(0, height, PERCENTILE_BAND_ROWS):
+        stack = np.stack([image[y0:y0 + PERCENTILE_BAND_ROWS] for image in images])
+        stack.partition(sorted({lo, hi}), axis=0)
+        if lo == hi:
+            out[y0:y0 + len(stack[0])] = stack[lo]
+        else:
+            low = stack[lo].astype(np.float32)
+            out[y0:y0 + len(stack[0])] = np.rint(low + (pos - lo) * (stack[hi] - low))
+    return out
+
+
+def fuse_images(images, reducer="weighted", weights=None, percentile=50):
+    """
+    Fuse the polarized images pixel by pixel.
+
+    The images are consumed one at a time into an accumulator (the
+    percentile needs all of them, and sorts them band by band), so images
+    can be a generator reading them.
+
+    Args:
+        images: The grayscale images (same size)
+        reducer: One of FUSION_REDUCERS
+        weights: Weights of the "weighted" reducer, one per image (default: equal)
+        percentile: Percentile (0-100) of the "percentile" reducer
+
+    Returns:
+        Fused image (uint8)
+    """
+    if reducer == "percentile":
+        return _percentile_image(list(images), percentile)
+    if reducer == "weighted":
+        if weights is None:
+            images = list(images)
+            weights = [1.0] * len(images)
+        weights = np.asarray(weights, dtype=np.float64) / sum(weights)
+
+    acc = None
+    count = 0
+    for image in images:
+        if reducer == "weighted":
+            image = cv2.convertScaleAbs(image, alpha=weights[count])
+        if acc is None:
+            acc = image.copy() if reducer == "max" else image.astype(np.uint16)
+        elif reducer == "max":
+            cv2.max(acc, image, dst=acc)
+        else:
+            cv2.add(acc, image, dst=acc, dtype=cv2.CV_16U)
+        count += 1
+    if acc is None:
+        raise ValueError("No images to fuse")
+
+    if reducer == "max":
+        return acc
+    if reducer == "weighted":
+        return np.minimum(acc, 255).astype(np.uint8)
+    return cv2.convertScaleAbs(acc, alpha=1.0 / count)
+
+
+def fuse_and_blur(images, reducer="weighted", weights=None, percentile=50):
+    """Fused image (see fuse_images) blurred with the BLUR_KSIZE Gaussian"""
+    return cv2.GaussianBlur(fuse_images(images, reducer, weights, percentile), BLUR_KSIZE, 0)
+
+
+def binarize_images(images, reducer="weighted", weights=None, percentile=50):
+    """
+    Binary mosaic of the polarized images held in memory.
+
+    Args:
+        images: The grayscale images (same size)
+        reducer, weights, percentile: Fusion settings (see fuse_images)
+
+    Returns:
+        Binary image (0/255): the blurred fused image thresholded with Otsu's method
+    """
+    check_fusion(len(images), reducer, weights, percentile)
+    _, binary = cv2.threshold(fuse_and_blur(images, reducer, weights, percentile), 0, 255,
+                              cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    return binary
+
+
+def otsu_threshold(hist):
+    """
+    Otsu's threshold of an 8-bit image from its histogram.
+
+    Same arithmetic, in the same order, as OpenCV's getThreshVal_Otsu_8u, so
+    the threshold is the one cv2.threshold(..., THRESH_OTSU) finds on the image.
+
+    Args:
+        hist: 256 bin counts
+
+    Returns:
+        Threshold (pixels above it are foreground)
+    """
+    hist = [int(v) for v in hist]
+    scale = 1.0 / sum(hist)
+    mu = 0.0
+    for i, count in enumerate(hist):
+        mu += i * float(count)
+    mu *= scale
+
+    eps = float(np.finfo(np.float32).eps)
+    mu1 = q1 = 0.0
+    max_sigma = max_val = 0.0
+    for i, count in enumerate(hist):
+        p_i = count * scale
+        mu1 *= q1
+        q1 += p_i
+        q2 = 1.0 - q1
+        if min(q1, q2) < eps or max(q1, q2) > 1.0 - eps:
+            continue
+        mu1 = (mu1 + i * p_i) / q1
+        mu2 = (mu - q1 * mu1) / q2
+        sigma = q1 * q2 * (mu1 - mu2) * (mu1 - mu2)
+        if sigma > max_sigma:
+            max_sigma = sigma
+            max_val = i
+    return max_val
+
+
+def tile_grid(height, width, tile_size=FUSION_TILE_SIZE):
+    """Tiles (x0, y0, x1, y1) covering the image"""
+    return [
+        (x0, y0, min(x0 + tile_size, width), min(y0 + tile_size, height))
+        for y0 in range(0, height, tile_size)
+        for x0 in range(0, width, tile_size)
+    ]
+
+
+def binarize_tiled(sources, out_path, tile_size=FUSION_TILE_SIZE, workers=None, reducer="weighted", weights=None,
+                   percentile=50):
+    """
+    Binary mosaic of polarized images read tile by tile, written to a .npy file.
+
+    The result is the one of binarize_images on the whole images (see the
+    module docstring).
+
+    Args:
+        sources: The grayscale images (ImageSources or arrays, same size)
+        out_path: Output .npy file (read it back with open_image_source)
+        tile_size: Side of the tiles
+        workers: Number of threads (default: all cores)
+        reducer, weights, percentile: Fusion settings (see fuse_images)
+
+    Returns:
+        Otsu's threshold used
+    """
+    height, width = sources[0].shape[:2]
+    if any(source.shape[:2] != (height, width) for source in sources):
+        raise ValueError("The polarized images must have the same size")
+    check_fusion(len(sources), reducer, weights, percentile)
+    workers = workers or os.cpu_count() or 1
+    tiles = tile_grid(height, width, tile_size)
+    out = np.lib.format.open_memmap(out_path, mode="w+", dtype=np.uint8, shape=(height, width))
+
+    def blur_tile(tile):
+        # Fuse and blur the tile with its halo, keep the core
+        x0, y0, x1, y1 = tile
+        hx0, hy0 = max(0, x0 - BLUR_HALO), max(0, y0 - BLUR_HALO)
+        hx1, hy1 = min(width, x1 + BLUR_HALO), min(height, y1 + BLUR_HALO)
+        blurred = fuse_and_blur((np.ascontiguousarray(source[hy0:hy1, hx0:hx1]) for source in sources),
+                                reducer, weights or [1.0] * len(sources), percentile)
+        core = blurred[y0 - hy0:y1 - hy0, x0 - hx0:x1 - hx0]
+        out[y0:y1, x0:x1] = core
+        return np.bincount(core.ravel(), minlength=256)
+
+    def threshold_tile(tile, thresh):
+        x0, y0, x1, y1 = tile
+        out[y0:y1, x0:x1] = cv2.threshold(np.ascontiguousarray(out[y0:y1, x0:x1]), thresh, 255,
+                                          cv2.THRESH_BINARY)[1]
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        with stage("fuse_blur", len(tiles)):
+            hist = np.zeros(256, dtype=np.int64)
+            for tile_hist in pool.map(blur_tile, tiles):
+                hist += tile_hist
+        thresh = otsu_threshold(hist)
+        with stage("threshold", len(tiles)):
+            for _ in pool.map(lambda tile: threshold_tile(tile, thresh), tiles):
+                pass
+    out.flush()
+    del out
+    return thresh
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fuse polarized images into a binary mosaic, in tiles")
+    parser.add_argument("images", nargs="+", help="The polarized images, one per angle (same size)")
+    parser.add_argument("-o", "--output", required=True, help="Output binary mosaic (.npy)")
+    parser.add_argument("--reducer", choices=FUSION_REDUCERS, default="weighted", help="Per-pixel fusion")
+    parser.add_argument("--weights", type=float, nargs="+", default=None,
+                        help="Weights of the weighted fusion, one per image (default: equal)")
+    parser.add_argument("--percentile", type=float, default=50, help="Percentile of the percentile fusion")
+    parser.add_argument("--tile-size", type=int, default=FUSION_TILE_SIZE, help="Side of the tiles")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="Threads (default: all cores)")
+    args = parser.parse_args(argv)
+    try:
+        check_fusion(len(args.images), args.reducer, args.weights, args.percentile)
+    except ValueError as e:
+        parser.error(str(e))
+
+    start = time.perf_counter()
+    sources = [open_image_source(path, gray=True) for path in args.images]
+    try:
+        thresh = binarize_tiled(sources, args.output, args.tile_size, args.workers, args.reducer, args.weights,
+                                args.percentile)
+    finally:
+        for source in sources:
+            source.close()
+    print(f"{args.output}: {sources[0].shape[1]}x{sources[0].shape[0]} px, Otsu threshold {thresh}, "
+          f"{time.perf_counter() - start:.1f} s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
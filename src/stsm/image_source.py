@@ -0,0 +1,227 @@
+"""
+Image sources serving rectangles of large mosaics on demand.
+
+A source looks like a read-only 2D image: it has .shape and .dtype and
+source[y0:y1, x0:x1] returns the NumPy array of that rectangle, read from disk
+only then. Backends:
+
+    .npy                  memory-mapped with np.load(mmap_mode="r")
+    .raw                  memory-mapped with np.memmap; the size is given by a
+                          <file>.json sidecar: {"width": W, "height": H,
+                          "channels": 1, "dtype": "uint8"}
+    .tif/.tiff            tiled TIFFs are read tile by tile and uncompressed
+                          TIFFs are memory-mapped (needs the optional
+                          tifffile package)
+    anything else         decoded whole with cv2.imread (as before)
+
+Color images are served as BGR, as cv2.imread does, or converted to
+grayscale tile by tile with gray=True.
+"""
+import json
+import os
+import threading
+from collections import OrderedDict
+import cv2
+import numpy as np
+
+try:
+    import tifffile
+except ImportError:  # Optional: TIFFs are then decoded whole by OpenCV
+    tifffile = None
+
+# Decoded TIFF tiles kept in memory per source
+TILE_CACHE_SIZE = 256
+
+# Rows read at once when a whole source is scanned (e.g. for a thumbnail)
+BAND_ROWS = 1024
+
+
+class ImageSource:
+    """
+    Base class of the image sources: subclasses implement _read(y0, y1, x0, x1),
+    returning the rectangle in native channel order (BGR or grayscale).
+    """
+
+    def __init__(self, shape, dtype, gray=False):
+        self.native_shape = tuple(shape)
+        self.gray = gray and len(shape) == 3
+        self.shape = self.native_shape[:2] if self.gray else self.native_shape
+        self.dtype = np.dtype(dtype)
+        self.ndim = len(self.shape)
+
+    def read(self, x0, y0, x1, y1):
+        """Pixels of the rectangle [x0, x1) x [y0, y1) (clipped to the image) as a new array"""
+        height, width = self.shape[:2]
+        x0, x1 = max(0, int(x0)), min(width, int(x1))
+        y0, y1 = max(0, int(y0)), min(height, int(y1))
+        if x1 <= x0 or y1 <= y0:
+            return np.zeros((0, 0) + self.shape[2:], dtype=self.dtype)
+        region = self._read(y0, y1, x0, x1)
+        if self.gray:
+            region = cv2.cvtColor(np.ascontiguousarray(region), cv2.COLOR_BGR2GRAY)
+        return np.array(region)
+
+    def __getitem__(self, key):
+        """source[y0:y1, x0:x1] (unit steps only) -> array"""
+        if not isinstance(key, tuple):
+            key = (key, slice(None))
+        rows, cols = key[0], key[1]
+        if not (isinstance(rows, slice) and isinstance(cols, slice)) or rows.step not in (None, 1) \
+                or cols.step not in (None, 1):
+            raise IndexError("Image sources only support [y0:y1, x0:x1] slicing")
+        y0, y1, _ = rows.indices(self.shape[0])
+        x0, x1, _ = cols.indices(self.shape[1])
+        return self.read(x0, y0, x1, y1)
+
+    def bands(self, band_rows=BAND_ROWS):
+        """Yield (y0, rows) over the whole image, band_rows rows at a time"""
+        for y0 in range(0, self.shape[0], band_rows):
+            yield y0, self.read(0, y0, self.shape[1], y0 + band_rows)
+
+    def downsample(self, factor):
+        """
+        The image reduced `factor` times with area averaging (cv2.INTER_AREA),
+        read band by band so only a band of full resolution rows is in memory.
+        """
+        height, width = self.shape[:2]
+        out_w, out_h = -(-width // factor), -(-height // factor)
+        out = np.zeros((out_h, out_w) + self.shape[2:], dtype=self.dtype)
+        band_rows = max(1, BAND_ROWS // factor) * factor
+        for y0, band in self.bands(band_rows):
+            rows = -(-band.shape[0] // factor)
+            out[y0 // factor:y0 // factor + rows] = cv2.resize(band, (out_w, rows), interpolation=cv2.INTER_AREA) \
+                .reshape((rows, out_w) + self.shape[2:])
+        return out
+
+    def thumbnail(self, max_side):
+        """Downsampled copy whose largest side is at most max_side, and its factor"""
+        factor = max(1, -(-max(self.shape[:2]) // max_side))
+        return self.downsample(factor), factor
+
+    def close(self):
+        pass
+
+
+class ArraySource(ImageSource):
+    """Source over an array already in memory (or a memory map)"""
+
+    def __init__(self, array, gray=False):
+        super().__init__(array.shape, array.dtype, gray)
+        self.array = array
+
+    def _read(self, y0, y1, x0, x1):
+        return self.array[y0:y1, x0:x1]
+
+
+class TiledTiffSource(ImageSource):
+    """
+    Tiled TIFF read tile by tile with tifffile; decoded tiles are cached (LRU).
+
+    tifffile returns color as RGB, which is swapped to BGR here.
+    """
+
+    def __init__(self, tif, gray=False):
+        page = tif.pages[0]
+        super().__init__(page.shape, page.dtype, gray)
+        self.tif = tif
+        self.page = page
+        self.tile_h, self.tile_w = page.tilelength, page.tilewidth
+        self.tiles_across = -(-page.imagewidth // self.tile_w)
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _tile(self, ty, tx):
+        key = (ty, tx)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+            index = ty * self.tiles_across + tx
+            fh = self.tif.filehandle
+            fh.seek(self.page.dataoffsets[index])
+            data = fh.read(self.page.databytecounts[index])
+            tables = getattr(self.page, "jpegtables", None)
+            segment, _, _ = self.page.decode(data, index, jpegtables=tables)
+            # Segments are (planes, depth, length, width, samples)
+            tile = np.asarray(segment)[0, 0]
+            tile = tile[..., 0] if tile.shape[-1] == 1 else tile[..., 2::-1]
+            self._cache[key] = tile
+            while len(self._cache) > TILE_CACHE_SIZE:
+                self._cache.popitem(last=False)
+            return tile
+
+    def _read(self, y0, y1, x0, x1):
+        out = np.zeros((y1 - y0, x1 - x0) + self.native_shape[2:], dtype=self.dtype)
+        for ty in range(y0 // self.tile_h, (y1 - 1) // self.tile_h + 1):
+            for tx in range(x0 // self.tile_w, (x1 - 1) // self.tile_w + 1):
+                tile = self._tile(ty, tx)
+                ty0, tx0 = ty * self.tile_h, tx * self.tile_w
+                a0, a1 = max(y0, ty0), min(y1, ty0 + self.tile_h)
+                b0, b1 = max(x0, tx0), min(x1, tx0 + self.tile_w)
+                out[a0 - y0:a1 - y0, b0 - x0:b1 - x0] = tile[a0 - ty0:a1 - ty0, b0 - tx0:b1 - tx0]
+        return out
+
+    def close(self):
+        self.tif.close()
+
+
+def _open_tiff(path, gray):
+    # Tiled or memory-mappable TIFFs, None when it has to be decoded whole
+    if tifffile is None:
+        return None
+    try:
+        tif = tifffile.TiffFile(path)
+    except Exception:
+        return None
+    page = tif.pages[0]
+    if page.is_tiled and len(page.shape) in (2, 3) and getattr(page, "imagedepth", 1) == 1 \
+            and page.planarconfig != 2 and (len(page.shape) == 2 or page.shape[2] == 3):
+        return TiledTiffSource(tif, gray)
+    tif.close()
+    try:
+        array = tifffile.memmap(path, mode="r")
+    except Exception:
+        return None  # Compressed strips
+    if array.ndim == 3:
+        return None  # RGB memory maps would need a copy to become BGR anyway
+    return ArraySource(array, gray)
+
+
+def open_image_source(path, gray=False):
+    """
+    Open a mosaic as an ImageSource (see the module docstring for the formats).
+
+    Args:
+        path: Image file
+        gray: Serve grayscale pixels (color is converted per read)
+
+    Raises:
+        IOError: If the image cannot be read
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".npy":
+        return ArraySource(np.load(path, mmap_mode="r"), gray)
+    if ext == ".raw":
+        with open(path + ".json") as f:
+            meta = json.load(f)
+        channels = int(meta.get("channels", 1))
+        shape = (int(meta["height"]), int(meta["width"])) + ((channels, ) if channels > 1 else ())
+        return ArraySource(np.memmap(path, dtype=meta.get("dtype", "uint8"), mode="r", shape=shape), gray)
+    if ext in (".tif", ".tiff"):
+        source = _open_tiff(path, gray)
+        if source is not None:
+            return source
+
+    if not gray:
+        image = cv2.imread(path, cv2.IMREAD_COLOR)
+    else:
+        # Keep 8-bit images as stored, so the gray values are those of
+        # cvtColor on the BGR image, without holding the BGR copy
+        image = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+        if image is not None and (image.dtype != np.uint8 or image.ndim == 3 and image.shape[2] not in (3, 4)):
+            image = cv2.imread(path, cv2.IMREAD_COLOR)
+        if image is not None and image.ndim == 3:
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY if image.shape[2] == 3 else cv2.COLOR_BGRA2GRAY)
+    if image is None:
+        raise IOError(f"Failed to load image '{path}'")
+    return ArraySource(image)
@@ -0,0 +1,330 @@
+"""
+Per-stage timing and memory instrumentation of the pipeline.
+
+A run (one mosaic: loading, processing and saving) records every stage
+entered while it is active:
+
+    with stage("find_contours") as s:
+        parents, children = find_contour_groups(image)
+        s.items = len(parents)
+
+or with the @timed("name") decorator. Each stage gets its wall time, CPU
+time (of the whole process, so threads and OpenCV count), item count and,
+when the run traces memory, the peak memory traced by tracemalloc while it
+ran and the memory it still held when it ended (NumPy and Python
+allocations; OpenCV's own buffers are not traced). Stages nest: a stage
+entered inside another one is recorded as "outer/inner".
+
+Without an active run, stage() does nothing but yield a throwaway record,
+so instrumented functions cost nothing extra when called from elsewhere
+(e.g. the benchmarks). The run is global to the process: the GUI starts one
+when a mosaic is loaded and the batch engine one per mosaic.
+
+Tracing memory slows down Python code, so it is off unless asked for (or
+STSM_TRACE_MEMORY=1). A run can also be profiled with cProfile (or
+STSM_PROFILE=1); the profile covers the thread that started the run and the
+threads inside profile_thread (the GUI's job worker, see jobs.py), and is
+saved next to the report, to be read with pstats or snakeviz.
+
+Stages can run on other threads than the one that started the run (the GUI
+processes and saves on its job worker). Their times are their own, but the
+memory peaks are process-wide: tracemalloc has one peak for the whole
+process, so allocations of other threads (e.g. the Tk main loop) made while
+a stage runs count in its peak_mb. The batch engine, which runs one mosaic
+at a time on its main thread, gives the cleanest peaks.
+"""
+import cProfile
+import csv
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from functools import wraps
+import cv2
+import numpy as np
+
+# Columns of the CSV run report, in order
+REPORT_COLUMNS = ("stage", "depth", "start", "wall_seconds", "cpu_seconds", "peak_mb", "held_mb", "items",
+                  "error")
+
+# Active run of the process (see start_run)
+_run = None
+
+# Functions called with the name of every stage entered (see add_stage_listener)
+_listeners = []
+
+
+class StageRecord:
+    """Measures of one stage (items can be set while the stage runs)"""
+
+    def __init__(self, name, depth, items=None):
+        self.name = name
+        self.depth = depth
+        self.items = items
+        self.start = 0.0
+        self.wall_seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.peak_bytes = None
+        self.held_bytes = None
+        self.error = ""
+
+    def as_row(self):
+        """Row of the run report"""
+        return {
+            "stage": self.name,
+            "depth": self.depth,
+            "start": round(self.start, 6),
+            "wall_seconds": round(self.wall_seconds, 6),
+            "cpu_seconds": round(self.cpu_seconds, 6),
+            "peak_mb": None if self.peak_bytes is None else round(self.peak_bytes / 1024 ** 2, 3),
+            "held_mb": None if self.held_bytes is None else round(self.held_bytes / 1024 ** 2, 3),
+            "items": self.items,
+            "error": self.error,
+        }
+
+
+class Run:
+    """
+    Stages recorded for one mosaic.
+
+    Args:
+        name: Name of the run (e.g. the mosaic file)
+        trace_memory: Trace allocations with tracemalloc
+        profile: Profile the run with cProfile
+    """
+
+    def __init__(self, name, trace_memory=False, profile=False):
+        self.name = name
+        self.trace_memory = trace_memory
+        self.started = time.time()
+        self.stages = []
+        self._origin = time.perf_counter()
+        self._lock = threading.Lock()
+        # Open stages of each thread, innermost last
+        self._local = threading.local()
+        # Peak traced memory reached inside each open stage (by id), see stage
+        self._peaks = {}
+        self._started_tracing = False
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        self.profiler = cProfile.Profile() if profile else None
+        self._profiling = profile
+        # Profiles of the other threads (see profile_thread)
+        self._thread_profilers = []
+        if profile:
+            self.profiler.enable()
+
+    def _stack(self):
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    @contextmanager
+    def stage(self, name, items=None):
+        """Record the code run inside the block as a stage (see module docstring)"""
+        stack = self._stack()
+        if stack:
+            name = stack[-1].name + "/" + name
+        record = StageRecord(name, len(stack), items)
+        with self._lock:
+            self.stages.append(record)
+        stack.append(record)
+
+        tracing = self.trace_memory and tracemalloc.is_tracing()
+        if tracing:
+            current, peak = tracemalloc.get_traced_memory()
+            # The peak is global: keep the one reached so far by the outer
+            # stages, then measure this stage from here
+            for outer in stack[:-1]:
+                self._peaks[id(outer)] = max(self._peaks.get(id(outer), 0), peak)
+            tracemalloc.reset_peak()
+            start_memory = current
+        record.start = time.perf_counter() - self._origin
+        cpu_start = time.process_time()
+        try:
+            yield record
+        except BaseException as e:
+            record.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            record.wall_seconds = time.perf_counter() - self._origin - record.start
+            record.cpu_seconds = time.process_time() - cpu_start
+            if tracing:
+                current, peak = tracemalloc.get_traced_memory()
+                peak = max(peak, self._peaks.pop(id(record), 0))
+                record.peak_bytes = peak
+                record.held_bytes = current - start_memory
+                # Inner peaks count for the outer stages too
+                for outer in stack[:-1]:
+                    self._peaks[id(outer)] = max(self._peaks.get(id(outer), 0), peak)
+            stack.pop()
+
+    @contextmanager
+    def profile_thread(self):
+        """Profile the block, run on another thread than the one that started the run"""
+        # Before Python 3.12 a profiler only sees the thread that enabled it;
+        # since then the run's profiler sees every thread already
+        if not self._profiling or sys.version_info >= (3, 12):
+            yield
+            return
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            with self._lock:
+                self._thread_profilers.append(profiler)
+
+    def stop(self):
+        """Stop tracing memory and profiling"""
+        if self._profiling:
+            self.profiler.disable()
+            self._profiling = False
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def report(self):
+        """Run report: run metadata and one row per stage, in start order"""
+        return {
+            "run": {
+                "name": self.name,
+                "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+                "trace_memory": self.trace_memory,
+                "python": sys.version.split()[0],
+                "numpy": np.__version__,
+                "opencv": cv2.__version__,
+                "cpus": os.cpu_count(),
+            },
+            "stages": [record.as_row() for record in sorted(self.stages, key=lambda r: r.start)],
+        }
+
+    def write_report(self, path):
+        """
+        Write the report as <path>.json and <path>.csv (and the profile as <path>.prof).
+
+        Args:
+            path: Output path without extension
+
+        Returns:
+            List of files written
+        """
+        report = self.report()
+        files = [path + ".json", path + ".csv"]
+        with open(files[0], "w") as f:
+            json.dump(report, f, indent=2)
+        with open(files[1], "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=REPORT_COLUMNS)
+            writer.writeheader()
+            writer.writerows(report["stages"])
+        if self.profiler is not None:
+            # Profiling goes on afterwards if the run is still active
+            if self._profiling:
+                self.profiler.disable()
+            # One profile with the stats of every profiled thread
+            stats = pstats.Stats(self.profiler)
+            with self._lock:
+                for profiler in self._thread_profilers:
+                    stats.add(profiler)
+            stats.dump_stats(path + ".prof")
+            files.append(path + ".prof")
+            if self._profiling:
+                self.profiler.enable()
+        return files
+
+
+def _env_flag(name):
+    return os.environ.get(name, "").strip().lower() in ("1", "true", "yes", "on")
+
+
+def start_run(name, trace_memory=None, profile=None):
+    """
+    Start recording the stages of a run, ending the previous one.
+
+    Args:
+        name: Name of the run (e.g. the mosaic file)
+        trace_memory: Trace allocations (default: STSM_TRACE_MEMORY)
+        profile: Profile with cProfile (default: STSM_PROFILE)
+
+    Returns:
+        The new Run
+    """
+    global _run
+    end_run()
+    _run = Run(
+        name,
+        _env_flag("STSM_TRACE_MEMORY") if trace_memory is None else trace_memory,
+        _env_flag("STSM_PROFILE") if profile is None else profile,
+    )
+    return _run
+
+
+def current_run():
+    """The active Run, or None"""
+    return _run
+
+
+def end_run():
+    """Stop the active run (if any) and return it"""
+    global _run
+    run, _run = _run, None
+    if run is not None:
+        run.stop()
+    return run
+
+
+def add_stage_listener(listener):
+    """
+    Call listener(name) whenever a stage is entered, with or without a run,
+    on the thread entering it (e.g. to report progress, see jobs.py). An
+    exception raised by the listener aborts the stage before it starts.
+    """
+    _listeners.append(listener)
+
+
+def remove_stage_listener(listener):
+    """Stop calling a listener added by add_stage_listener"""
+    _listeners.remove(listener)
+
+
+@contextmanager
+def profile_thread():
+    """Profile the block with the active run, from another thread (a no-op without run or profiling)"""
+    run = _run
+    if run is None:
+        yield
+        return
+    with run.profile_thread():
+        yield
+
+
+@contextmanager
+def stage(name, items=None):
+    """Record a stage of the active run (a no-op without one), see Run.stage"""
+    for listener in list(_listeners):
+        listener(name)
+    run = _run
+    if run is None:
+        yield StageRecord(name, 0, items)
+        return
+    with run.stage(name, items) as record:
+        yield record
+
+
+def timed(name=None):
+    """Decorator recording every call of a function as a stage (named after the function by default)"""
+    def decorator(fn):
+        stage_name = name or fn.__name__
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage(stage_name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,201 @@
+"""
+Background jobs of the GUI.
+
+Long tasks (processing a mosaic, saving its data) run on a worker thread,
+so the Tk main loop keeps the window responsive. The worker never touches
+Tk: the stages it enters (instrumentation.stage) are reported as progress
+and the messages for the user (show_message) are queued; the main loop
+polls the queue every JOB_POLL_MS with root.after, updates the status
+label, shows the messages and finally hands the result to on_done.
+
+A job is cancelled between stages: the next stage the worker enters raises
+JobCancelled, and on_done is not called. Jobs that only store their results
+in on_done (see roi.process_selected_roi) leave the previous results
+untouched when cancelled.
+
+One job runs at a time; its controls are disabled while it runs and get
+their previous state back when it ends.
+"""
+import queue
+import threading
+import tkinter as tk
+import tkinter.messagebox as messagebox
+from concurrent.futures import ThreadPoolExecutor
+from instrumentation import add_stage_listener, profile_thread
+
+# Interval (ms) between two polls of the queue of a job
+JOB_POLL_MS = 100
+
+# Worker of the jobs (one job at a time)
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="stsm-job")
+
+# Job of the worker thread while it runs one
+_local = threading.local()
+
+# Job running, if any
+_active = None
+
+
+class JobCancelled(BaseException):
+    """
+    Raised in the worker when its job is cancelled (a BaseException, as
+    KeyboardInterrupt, so the `except Exception` of the savers let it through)
+    """
+
+
+class Job:
+    """
+    A task run on the worker thread, reported to the Tk main loop.
+
+    Args:
+        root: Tk root (for root.after)
+        name: Name shown in the status ("Processing: contours")
+        work: Function work(job) run on the worker; its return value goes to on_done
+        on_done: Function on_done(result) run on the main loop when work returns
+        on_end: Function on_end() run on the main loop when the job ends, however
+            it ends (done, cancelled or failed), after the controls are restored
+        controls: Widgets disabled while the job runs
+        status: StringVar showing the progress
+        cancel_button: Button enabled while the job runs (its command should call cancel)
+    """
+
+    def __init__(self, root, name, work, on_done=None, controls=(), status=None, cancel_button=None, on_end=None):
+        self.root = root
+        self.name = name
+        self.work = work
+        self.on_done = on_done
+        self.on_end = on_end
+        self.controls = list(controls)
+        self.status = status
+        self.cancel_button = cancel_button
+        self.queue = queue.Queue()
+        self._cancelled = threading.Event()
+        self._states = []
+
+    def start(self):
+        """Disable the controls and submit the job to the worker"""
+        global _active
+        _active = self
+        self._states = [str(widget.cget("state")) or tk.NORMAL for widget in self.controls]
+        for widget in self.controls:
+            widget.config(state=tk.DISABLED)
+        if self.cancel_button is not None:
+            self.cancel_button.config(state=tk.NORMAL)
+        self._set_status(f"{self.name}...")
+        _executor.submit(self._run)
+        self.root.after(JOB_POLL_MS, self._poll)
+
+    def cancel(self):
+        """Ask the job to stop at its next stage"""
+        self._cancelled.set()
+        self._set_status(f"{self.name}: cancelling...")
+
+    def check(self):
+        """Raise JobCancelled if the job was cancelled (called by the worker between stages)"""
+        if self._cancelled.is_set():
+            raise JobCancelled()
+
+    def _run(self):
+        # On the worker thread: never touch Tk here
+        _local.job = self
+        try:
+            self.check()
+            # Part of the run's profile, when profiling (see instrumentation.py)
+            with profile_thread():
+                result = self.work(self)
+            self.queue.put(("done", result))
+        except JobCancelled:
+            self.queue.put(("cancelled", None))
+        except Exception as e:
+            self.queue.put(("error", e))
+        finally:
+            _local.job = None
+
+    def _poll(self):
+        # On the main loop: handle what the worker queued since the last poll
+        while True:
+            try:
+                kind, *payload = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if kind == "progress":
+                if not self._cancelled.is_set():
+                    self._set_status(f"{self.name}: {payload[0]}")
+            elif kind == "message":
+                getattr(messagebox, "show" + payload[0])(payload[1], payload[2])
+            else:
+                self._finish(kind, payload[0])
+                return
+        self.root.after(JOB_POLL_MS, self._poll)
+
+    def _finish(self, kind, value):
+        global _active
+        _active = None
+        for widget, state in zip(self.controls, self._states):
+            widget.config(state=state)
+        if self.cancel_button is not None:
+            self.cancel_button.config(state=tk.DISABLED)
+        if kind == "done":
+            self._set_status("")
+            if self.on_done is not None:
+                self.on_done(value)
+        elif kind == "cancelled":
+            self._set_status(f"{self.name}: cancelled")
+        else:
+            self._set_status(f"{self.name}: failed")
+            messagebox.showerror("Error", f"{self.name} failed: {value}")
+        if self.on_end is not None:
+            self.on_end()
+
+    def _set_status(self, text):
+        if self.status is not None:
+            self.status.set(text)
+
+
+def start_job(root, name, work, on_done=None, controls=(), status=None, cancel_button=None, on_end=None):
+    """
+    Run work(job) in the background (see Job).
+
+    Returns:
+        The Job, or None if another job is running (the user is warned)
+    """
+    if _active is not None:
+        messagebox.showwarning("Warning", f"Please wait: {_active.name.lower()} is still running.")
+        return None
+    job = Job(root, name, work, on_done, controls, status, cancel_button, on_end)
+    job.start()
+    return job
+
+
+def job_running():
+    """True while a job runs"""
+    return _active is not None
+
+
+def cancel_job():
+    """Cancel the running job, if any"""
+    if _active is not None:
+        _active.cancel()
+
+
+def show_message(kind, title, text):
+    """
+    messagebox.show<kind>(title, text), queued to the main loop when called
+    from a job (kind: "info", "warning" or "error").
+    """
+    job = getattr(_local, "job", None)
+    if job is not None:
+        job.queue.put(("message", kind, title, text))
+    else:
+        getattr(messagebox, "show" + kind)(title, text)
+
+
+def _on_stage(name):
+    # Stages entered by a job: cancellation point and progress report
+    job = getattr(_local, "job", None)
+    if job is not None:
+        job.check()
+        job.queue.put(("progress", name))
+
+
+add_stage_listener(_on_stage)
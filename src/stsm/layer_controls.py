@@ -1,4 +1,5 @@
 import tkinter as tk
+from tkinter import ttk
 from display import update_display, update_proc_display
 
 def show_layer_controls(self):
@@ -40,6 +41,44 @@ def hide_proc_layer_controls(self):
         self.proc_save_frame.pack_forget()
         self.proc_controls_visible = False
 
+def build_layer_rows(self):
+    """Create one layer control row per layer of the Binary tab (self.layer_names)"""
+    for row in self.layer_rows:
+        row['frame'].destroy()
+    self.layer_rows = []
+    for i, name in enumerate(self.layer_names):
+        # Create a frame for this layer's controls
+        layer_frame = ttk.Frame(self.unified_layer_frame)
+        layer_frame.pack(fill=tk.X, padx=5, pady=2)
+        
+        # Add visibility checkbutton
+        visibility_cb = ttk.Checkbutton(
+            layer_frame,
+            variable=self.layer_visibility[i],
+            command= lambda: update_display(self)
+        )
+        visibility_cb.pack(side=tk.LEFT, padx=(0, 5))
+        
+        # Add layer name label
+        layer_label = ttk.Label(layer_frame, text=name, width=15)
+        layer_label.pack(side=tk.LEFT, padx=5)
+        
+        # Add move up and down buttons (commands are set by update_layer_rows)
+        up_button = ttk.Button(layer_frame, text="↑", width=2)
+        up_button.pack(side=tk.LEFT, padx=2)
+        down_button = ttk.Button(layer_frame, text="↓", width=2)
+        down_button.pack(side=tk.LEFT, padx=2)
+        
+        # Store references to this layer's controls
+        self.layer_rows.append({
+            'frame': layer_frame,
+            'visibility': visibility_cb,
+            'label': layer_label,
+            'up_button': up_button,
+            'down_button': down_button
+        })
+    update_layer_rows(self)
+
 def update_layer_rows(self):
     """Update the layer rows to reflect the current layer order"""
     # Reorder the layer rows based on the current layer_order
@@ -4,66 +4,235 @@ import tkinter.filedialog as fd
 import tkinter.simpledialog as sd
 import tkinter.messagebox as messagebox
 import os
-from layer_controls import show_layer_controls, hide_layer_controls, hide_proc_layer_controls
-from display import update_display, update_proc_display
-from roi import start_roi, update_roi, end_roi_drag, confirm_roi, process_selected_roi, set_confirm_roi_button_visible
-import openpyxl as opxl
-import h5py
+import shutil
+import tempfile
+from layer_controls import show_layer_controls, hide_layer_controls, hide_proc_layer_controls, build_layer_rows
+from display import update_display, update_proc_display, update_build_display
+from roi import (start_roi, update_roi, end_roi_drag, confirm_roi, process_selected_roi, processing_controls,
+                 set_confirm_roi_button_visible)
+from image_source import open_image_source
+from fusion import FUSION_TILED_MIN_PIXELS, binarize_images, binarize_tiled, check_fusion
+from overlays import PreviewLayer
+from stitching import build_mosaic, list_tiles
+from processed_region import mosaic_key
+from pore_io import (mosaic_output_path, write_binary_image, append_gpd_stats,
+                    write_contours_hdf5, write_segmented_pore_data)
+from pore_table import pore_table_available, pore_table_path, write_pore_table
+from instrumentation import stage, start_run, current_run
+from jobs import start_job, show_message
+
+# Largest side (pixels) of the mosaic preview shown for ROI selection
+ROI_PREVIEW_SIDE = 2048
+
+
+def load_tiles(self):
+    """Select the folder of tiles of the mosaic to build (see stitching.py)"""
+    folder = fd.askdirectory(title="Select the Folder of Tiles")
+    if not folder:
+        return
+    
+    self.tile_paths = list_tiles(folder)
+    if len(self.tile_paths) < 2:
+        self.tile_paths = []
+        self.tiles_label.config(text="No tiles loaded")
+        self.stitch_button.config(state=tk.DISABLED)
+        messagebox.showwarning("Warning", "The folder has less than two tile images.")
+        return
+    self.tiles_label.config(text=f"{len(self.tile_paths)} tiles in '{os.path.basename(folder)}'")
+    self.stitch_button.config(state=tk.NORMAL)
+
+
+def stitch_tiles(self):
+    """Stitch the loaded tiles into a mosaic file and show its preview"""
+    if not self.tile_paths:
+        messagebox.showwarning("Warning", "Please load the tiles first.")
+        return
+    try:
+        cols = int(self.grid_cols.get()) if self.grid_cols.get().strip() else None
+        overlap = float(self.grid_overlap.get()) / 100
+    except ValueError:
+        messagebox.showerror("Error", "Columns and overlap must be numbers.")
+        return
+    
+    # Open file dialog to select the mosaic file (tiled TIFF needs tifffile)
+    file_path = fd.asksaveasfilename(
+        title="Save Mosaic",
+        defaultextension=".npy",
+        filetypes=[("NumPy files", "*.npy"), ("TIFF files", "*.tif *.tiff")]
+    )
+    if not file_path:
+        return  # User cancelled
+    
+    try:
+        result = build_mosaic(self.tile_paths, file_path, cols, self.grid_order.get(), overlap)
+    except Exception as e:
+        messagebox.showerror("Error", f"Failed to build the mosaic: {str(e)}")
+        return
+    
+    # Preview of the mosaic, read from the file
+    if self.build_preview is not None:
+        self.build_preview.source.close()
+    self.build_preview = PreviewLayer(open_image_source(file_path))
+    self.build_display_cache.clear()
+    update_build_display(self)
+    
+    height, width = result["shape"][:2]
+    messagebox.showinfo(
+        "Success",
+        f"Mosaic of {width}x{height} px saved to '{os.path.basename(file_path)}' "
+        f"({result['registered']} of {result['pairs']} tile overlaps registered)"
+    )
+
+
+def release_binary_images(self):
+    """Close the sources of the Binary tab layers and delete the temporary binary mosaic"""
+    for layer in self.images:
+        if isinstance(layer, PreviewLayer):
+            layer.source.close()
+    self.images = []
+    if self.binary_path is not None:
+        try:
+            os.remove(self.binary_path)
+        except OSError:
+            pass  # Still mapped (e.g. on Windows) or already gone
+        self.binary_path = None
+
+
+def fusion_settings(self):
+    """
+    Fusion settings of the Binary tab: (reducer, weights, percentile).
+
+    Raises:
+        ValueError: If the weights or the percentile are not numbers
+    """
+    reducer = self.fusion_reducer.get()
+    text = self.fusion_weights.get().replace(";", ",").strip()
+    try:
+        weights = [float(w) for w in text.split(",") if w.strip()] if text else None
+    except ValueError:
+        raise ValueError(f"Invalid weights '{text}': numbers separated by commas expected")
+    try:
+        percentile = float(self.fusion_percentile.get())
+    except ValueError:
+        raise ValueError(f"Invalid percentile '{self.fusion_percentile.get()}'")
+    return reducer, weights, percentile
+
+
+def fuse_image(self):
+    """
+    Fuse the polarized images of the Binary tab (all the layers but the last
+    one) into the binary mosaic (the last layer), with the current settings.
+
+    Images held in memory are fused whole; images shown as previews are
+    fused in tiles to a temporary .npy file (see fusion.binarize_tiled).
+
+    Returns:
+        True if the binary mosaic was made
+    """
+    inputs = self.images[:-1]
+    if len(inputs) < 2:
+        messagebox.showwarning("Warning", "Please load at least two images.")
+        return False
+    try:
+        reducer, weights, percentile = fusion_settings(self)
+        check_fusion(len(inputs), reducer, weights, percentile)
+    except ValueError as e:
+        messagebox.showerror("Error", str(e))
+        return False
+    
+    if not isinstance(inputs[0], PreviewLayer):
+        self.images[-1] = binarize_images(inputs, reducer, weights, percentile)
+    else:
+        # Fuse to a new temporary file, then drop the previous one
+        fd_binary, binary_path = tempfile.mkstemp(prefix="stsm_binary_", suffix=".npy")
+        os.close(fd_binary)
+        try:
+            binarize_tiled([layer.source for layer in inputs], binary_path, reducer=reducer, weights=weights,
+                           percentile=percentile)
+        except Exception as e:
+            os.remove(binary_path)
+            messagebox.showerror("Error", f"Failed to fuse the images: {str(e)}")
+            return False
+        if isinstance(self.images[-1], PreviewLayer):
+            self.images[-1].source.close()
+        self.images[-1] = PreviewLayer(open_image_source(binary_path))
+        if self.binary_path is not None:
+            try:
+                os.remove(self.binary_path)
+            except OSError:
+                pass
+        self.binary_path = binary_path
+    
+    if self.controls_visible:
+        update_display(self)
+    return True
 
 
 def load_image(self):
     # Clear previous images
-    self.images = []
+    release_binary_images(self)
     self.tk_images = []
+    self.display_cache.clear()
     
     # Hide controls if they were previously shown
     hide_layer_controls(self)
     
-    # Open file dialog to select images
+    # Open file dialog to select the images, one per polarizer angle
     file_paths = fd.askopenfilenames(
-        title="Select Two Images",
-        filetypes=[("Image files", "*.jpg *.jpeg *.png *.tif *.tiff")]
+        title="Select the Images (one per polarizer angle)",
+        filetypes=[("Image files", "*.jpg *.jpeg *.png *.tif *.tiff *.npy")]
     )
     
     if len(file_paths) < 2:
         messagebox.showwarning("Warning", "Please select at least two images.")
         return
         
-    # Load the first two selected images using OpenCV
-    for i, file in enumerate(file_paths[:2]):
-        image = cv2.imread(file)
-        if image is not None:
-            # Convert to grayscale
-            gray_image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-            self.images.append(gray_image)
-            self.layer_names[i] = os.path.basename(file)  # Use the file name as the layer name
-        else:
+    # Open the selected images as grayscale sources (tiled TIFF and .npy
+    # files are not loaded, see image_source.py)
+    sources = []
+    for i, file in enumerate(file_paths):
+        try:
+            sources.append(open_image_source(file, gray=True))
+        except (IOError, OSError, ValueError):
+            for source in sources:
+                source.close()
             messagebox.showerror("Error", f"Failed to load image {i+1}.")
             return
+    if any(source.shape != sources[0].shape for source in sources):
+        for source in sources:
+            source.close()
+        messagebox.showerror("Error", "The images must have the same size.")
+        return
     
-    # Process the images to create the combined result
-    if len(self.images) == 2:
-        # Add the two images with equal weight (0.5 each)
-        combined = cv2.add(
-            cv2.divide(self.images[0], 2),
-            cv2.divide(self.images[1], 2)
-        )
-        # Apply Gaussian blur
-        combined = cv2.GaussianBlur(combined, (11, 11), 0)
-        # Apply Otsu's thresholding
-        _, combined = cv2.threshold(
-            combined, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU
-        )
-        self.images.append(combined)
-        
-        # Reset layer order to default
-        self.layer_order = [2, 0, 1]
-        
-        # Show the layer controls now that we have images
-        show_layer_controls(self)
-        
-        # Update the display
-        update_display(self)
+    # Images too large to hold are displayed as previews and fused in tiles
+    height, width = sources[0].shape
+    if height * width < FUSION_TILED_MIN_PIXELS:
+        self.images = [source[:, :] for source in sources]
+        for source in sources:
+            source.close()
+    else:
+        self.images = [PreviewLayer(source) for source in sources]
+    self.images.append(None)
+    
+    # Process the images to create the combined result: fusion, Gaussian
+    # blur and Otsu's thresholding (see fusion.py)
+    if not fuse_image(self):
+        release_binary_images(self)
+        return
+    
+    # One layer per image (the file name as the layer name) and the binary
+    # mosaic, with the default order: binary mosaic first
+    self.layer_names = [os.path.basename(file) for file in file_paths] + ["Binary mosaic"]
+    if len(self.layer_visibility) != len(self.layer_names):
+        self.layer_visibility = [tk.BooleanVar(value=True) for _ in self.layer_names]
+    self.layer_order = [len(sources)] + list(range(len(sources)))
+    build_layer_rows(self)
+    
+    # Show the layer controls now that we have images
+    show_layer_controls(self)
+    
+    # Update the display
+    update_display(self)
 
 def load_mosaic(self):
     """Load a mosaic image and either select a ROI or process full image."""
@@ -75,6 +244,7 @@ def load_mosaic(self):
     # Clear previous images
     self.proc_images = []
     self.proc_tk_images = []
+    self.proc_display_cache.clear()
     
     # Hide controls if they were previously shown
     hide_proc_layer_controls(self)
@@ -82,21 +252,28 @@ def load_mosaic(self):
     # Open file dialog to select image
     file_path = fd.askopenfilename(
         title="Select a Mosaic",
-        filetypes=[("Image files", "*.jpg *.jpeg *.bmp *.png *.tif *.tiff")]
+        filetypes=[("Image files", "*.jpg *.jpeg *.bmp *.png *.tif *.tiff *.npy")]
     )
     
     if not file_path:
         return  # User cancelled
         
-    # Load the selected image using OpenCV
-    image = cv2.imread(file_path)
-    if image is None:
+    # Open the selected image as a source read on demand (tiled TIFF, .npy
+    # and .raw mosaics are never decoded whole)
+    # Stages of this mosaic are recorded until the next one is loaded (see
+    # instrumentation.py); the report is written with the saved data
+    start_run(os.path.basename(file_path))
+    try:
+        with stage("load_mosaic"):
+            source = open_image_source(file_path, gray=True)
+    except Exception:
         messagebox.showerror("Error", "Failed to load image.")
         return
         
-    # Store the original image and prepare ROI image
-    self.original_image = image.copy()
-    self.roi_image = image
+    # Store the original image
+    self.original_image = source
+    self.mosaic_key = mosaic_key(file_path)
+    self.roi_image = None
 
     # Hide Confirm ROI initially
     set_confirm_roi_button_visible(self, False)
@@ -108,8 +285,10 @@ def load_mosaic(self):
     )
 
     if wants_roi:
-        # Enter ROI selection mode
+        # Enter ROI selection mode, on a downsampled preview of the mosaic
         self.roi_mode = True
+        with stage("roi_preview"):
+            self.roi_image, _ = source.thumbnail(ROI_PREVIEW_SIDE)
 
         # Bind mouse events for ROI selection
         self.proc_canvas.bind("<ButtonPress-1>", lambda event: start_roi(self, event))
@@ -135,12 +314,15 @@ def load_mosaic(self):
         self.roi_mode = False
         set_confirm_roi_button_visible(self, False)
 
-        h, w = self.original_image.shape[:2]
-        process_selected_roi(self, 0, 0, w, h)
-
     # Enable the Global Pore Stats button (allowed after load)
+    self.stats_saved = False
     self.save_mosaic_stats_data_button.config(state=tk.NORMAL)
 
+    if not wants_roi:
+        # Process the entire image, in the background
+        h, w = self.original_image.shape[:2]
+        process_selected_roi(self, 0, 0, w, h)
+
 def save_image(self):
     """Save the combined result as a TIFF file"""
     if not self.images or len(self.images) < 3:
@@ -151,15 +333,22 @@ def save_image(self):
     file_path = fd.asksaveasfilename(
         title="Save Binary mosaic",
         defaultextension=".tiff",
-        filetypes=[("TIFF files", "*.tiff"), ("All files", "*.*")]
+        filetypes=[("TIFF files", "*.tiff"), ("NumPy files", "*.npy"), ("All files", "*.*")]
     )
     
     if not file_path:
         return  # User cancelled
         
     try:
-        # Save the combined result image (original resolution)
-        cv2.imwrite(file_path, self.images[2])
+        binary = self.images[-1]
+        if not isinstance(binary, PreviewLayer):
+            # Save the combined result image (original resolution)
+            cv2.imwrite(file_path, binary)
+        elif file_path.lower().endswith(".npy"):
+            # Fused to disk: copy the .npy file, never loaded
+            shutil.copyfile(self.binary_path, file_path)
+        else:
+            write_binary_image(file_path, binary.source[:, :])
         messagebox.showinfo("Success", f"Binary mosaic saved to '{os.path.basename(file_path)}'")
     except Exception as e:
         messagebox.showerror("Error", f"Failed to save image: {str(e)}")
@@ -181,8 +370,8 @@ def save_proc_image(self, index):
         return  # User cancelled
         
     try:
-        # Save the specified image (original resolution)
-        cv2.imwrite(file_path, self.proc_images[index])
+        # Save the specified layer, drawn now at original resolution
+        cv2.imwrite(file_path, self.proc_images[index].materialize())
         messagebox.showinfo("Success", f"{self.proc_layer_names[index]} saved to '{os.path.basename(file_path)}'")
     except Exception as e:
         messagebox.showerror("Error", f"Failed to save image: {str(e)}")
@@ -205,216 +394,135 @@ def save_mosaic_stats_data(self):
         messagebox.showwarning("Warning", "No mosaic name provided.")
         return  # User cancelled
 
-    save_original_binary(self, file_path, mosaic_name)
-    save_gpd_stats(self, file_path, mosaic_name)
-    save_enhanced_contours_hdf5(self, file_path, mosaic_name)
-    save_segmented_pore_data(self, file_path, mosaic_name)
+    # Never mix the outputs of two saves (e.g. one cancelled halfway)
+    if os.path.exists(os.path.join(file_path, mosaic_name)):
+        messagebox.showwarning("Warning", f"The folder '{mosaic_name}' already exists in "
+                                          f"'{os.path.basename(file_path)}': choose another mosaic name or folder.")
+        return
+
+    def work(job):
+        # On the background worker (see jobs.py): the savers report to the
+        # user with show_message
+        save_original_binary(self, file_path, mosaic_name)
+        save_gpd_stats(self, file_path, mosaic_name)
+        save_enhanced_contours_hdf5(self, file_path, mosaic_name)
+        save_segmented_pore_data(self, file_path, mosaic_name)
+        # The columnar table of every pore needs the optional pyarrow package
+        if pore_table_available():
+            save_pore_table(self, file_path, mosaic_name)
+        save_run_report(file_path, mosaic_name)
+
+    def on_end():
+        # Done or cancelled: once the stats row is appended, the button stays
+        # disabled (the stats are appended once)
+        if self.stats_saved:
+            self.save_mosaic_stats_data_button.config(state=tk.DISABLED)
+
+    start_job(self.root, "Saving", work, None, processing_controls(self), self.proc_status_var,
+              self.cancel_job_button, on_end)
 
 
 def save_original_binary(self, file_path, mosaic_name):
     """Save the original binary image without contours"""
     if not hasattr(self, 'original_binary') or self.original_binary is None:
-        messagebox.showwarning("Warning", "No original binary image available.")
+        show_message("warning", "Warning", "No original binary image available.")
         return
     
     # Builds the path to save the binary file
-    binary_file_path = os.path.join(file_path, mosaic_name, mosaic_name + ".tiff")
-    # Creates the directory if does not exist
-    os.makedirs(os.path.dirname(binary_file_path), exist_ok=True) 
+    binary_file_path = mosaic_output_path(file_path, mosaic_name, ".tiff")
 
     try:
         # Save the original binary image
-        cv2.imwrite(binary_file_path, self.original_binary)
-        messagebox.showinfo("Success", f"Original binary image saved to '{os.path.basename(binary_file_path)}'")
+        with stage("save_binary"):
+            write_binary_image(binary_file_path, self.original_binary)
+        show_message("info", "Success", f"Original binary image saved to '{os.path.basename(binary_file_path)}'")
     except Exception as e:
-        messagebox.showerror("Error", f"Failed to save image: {str(e)}")
+        show_message("error", "Error", f"Failed to save image: {str(e)}")
 
 
 def save_gpd_stats(self, file_path, mosaic_name):
-    """Save the global pore statistics to a file"""
+    """Save the global pore statistics to a file (sets self.stats_saved once saved)"""
     if not hasattr(self, 'summary') or self.summary is None:
-        messagebox.showwarning("Warning", "No global pore statistics available.")
+        show_message("warning", "Warning", "No global pore statistics available.")
         return
        
     try:
         # Save the summary to a Excel file using openpyxl
-        if not os.path.exists(file_path + "/Global_Pore_Stats.xlsx"):
-            # If file does not exist, create a new workbook and worksheet
-            wb = opxl.Workbook()
-            ws = wb.active
-            ws.title = "Global Pore Stats"
-            
-            # Write headers
-            headers = ["Mosaic Name",
-                "Number of parent contours",
-                "Number of child contours",
-                "Porosity",
-                "Number of parent contours <= 50μm",
-                "Number of child contours\n(parent <= 50μm)",
-                "Percentage of pores <= 50μm",
-                "Number of parent contours > 50μm",
-                "Number of child contours\n(parent > 50μm)",
-                "Percentage of pores > 50μm"
-            ]
-            ws.append(headers)
-        else:
-            # If file exists, load the existing workbook and worksheet
-            wb = opxl.load_workbook(file_path + "/Global_Pore_Stats.xlsx")
-            ws = wb.active
-        
-        self.summary = (mosaic_name, ) + self.summary
-
-        # Append the summary to the worksheet
-        ws.append(self.summary)
-        wb.save(file_path + "/Global_Pore_Stats.xlsx")
-        wb.close()
+        with stage("save_gpd_stats"):
+            append_gpd_stats(file_path, (mosaic_name, ) + tuple(self.summary))
+        self.stats_saved = True
 
-        # Disable the Global Pore Stats button
-        self.save_mosaic_stats_data_button.config(state=tk.DISABLED)
-            
-        messagebox.showinfo("Success", f"Global pore statistics saved to '{os.path.basename(file_path) + '/Global_Pore_Stats.xlsx'}'")
+        show_message("info", "Success", f"Global pore statistics saved to '{os.path.basename(file_path) + '/Global_Pore_Stats.xlsx'}'")
     except Exception as e:
-        messagebox.showerror("Error", f"Failed to save statistics: {str(e)}")
+        show_message("error", "Error", f"Failed to save statistics: {str(e)}")
 
 def save_enhanced_contours_hdf5(self, file_path, mosaic_name):
-    """
-    Save contours with edge information to HDF5 file.
-    
-    Args:
-        contour_data: List of [index, is_edge, parent, [children], area, perimeter]
-        filename: Output HDF5 filename
-    """
     """Save the processed contours to a file"""
     if not hasattr(self, 'processed_contours') or self.processed_contours is None:
-        messagebox.showwarning("Warning", "No processed contours available.")
+        show_message("warning", "Warning", "No processed contours available.")
         return
     
     # Builds the path to save the h5 file
-    filename = os.path.join(file_path, mosaic_name, mosaic_name + ".h5")
-    # Creates the directory if does not exist
-    os.makedirs(os.path.dirname(filename), exist_ok=True) 
-
-    contour_data = self.processed_contours
+    filename = mosaic_output_path(file_path, mosaic_name, ".h5")
 
     try:
-        with h5py.File(filename, 'w') as f:
-            # Create a group for all contours
-            contours_group = f.create_group("contours")
-            
-            # Store metadata about the dataset
-            f.attrs['num_contours'] = len(contour_data)
-                    
-            # Create groups for edge and interior contours for easy filtering
-            edge_group = f.create_group("edge_contours")
-            interior_group = f.create_group("interior_contours")
-            
-            # Create a group for each contour with its index as the name for direct access
-            for idx, is_edge, parent, children, area, perimeter in contour_data:
-                # Use the index as the group name for direct access
-                contour_group = contours_group.create_group(f"{idx}")
-                
-                # Store the index and edge flag as attributes
-                contour_group.attrs['index'] = idx
-                contour_group.attrs['is_edge'] = is_edge
-                contour_group.attrs['area'] = area
-                contour_group.attrs['perimeter'] = perimeter
-                
-                # Save parent contour
-                parent_dataset = contour_group.create_dataset('parent', data=parent)
-                
-                # Save metadata about children
-                contour_group.attrs['num_children'] = len(children)
-                
-                # Create a group for children
-                if children:
-                    children_group = contour_group.create_group('children')
-                    for j, child in enumerate(children):
-                        child_dataset = children_group.create_dataset(f"{j}", data=child)
-                
-                # Add reference to edge or interior group
-                if is_edge:
-                    edge_group[f"{idx}"] = contour_group.ref
-                else:
-                    interior_group[f"{idx}"] = contour_group.ref
-        messagebox.showinfo("Success", f"Processed contours saved to '{os.path.basename(filename)}'")
+        with stage("save_hdf5", len(self.processed_contours)):
+            write_contours_hdf5(filename, self.processed_contours)
+        show_message("info", "Success", f"Processed contours saved to '{os.path.basename(filename)}'")
     except Exception as e:
-        messagebox.showerror("Error", f"Failed to save processed contours: {str(e)}")
+        show_message("error", "Error", f"Failed to save processed contours: {str(e)}")
 
 def save_segmented_pore_data(self, file_path, mosaic_name):
     """Save the segmented pores to xlsx fils"""
     if not hasattr(self, 'processed_cont_great_50_sz') or self.processed_cont_great_50_sz is None:
-        messagebox.showwarning("Warning", "No segmented pores available.")
+        show_message("warning", "Warning", "No segmented pores available.")
         return
         
     try:     
         # Segmented pores are saved according to the defined shape-size combinations.
-        for shape in self.shapes:
-            
-            # Builds the path to save the h5 file
-            filename = os.path.join(file_path, mosaic_name, mosaic_name + "_" + shape["name"] + ".xlsx")
-            
-            # Save the summary to a Excel file using openpyxl
-            if not os.path.exists(filename):
-                # If file does not exist, create a new workbook and worksheet
-                wb = opxl.Workbook()
-                wb.remove(wb.active)
-            else:
-                messagebox.showwarning("Warning", "File with segmented pore info already exist.")
-                return
-        
-            for i, size in enumerate(self.sizes):
-                # Skip invalid shape-size combinations
-                if (
-                    (shape["name"] != "elongated" and size["name"] in ["edS", "edM", "edL", "edXL"]) or
-                    (shape["name"] != "circ" and size["name"] in ["emdS", "emdM", "emdL", "emdXL"]) or
-                    ((shape["name"] not in ["circ", "MLcirc"]) and size["name"] in ["rmsS", "rmsM", "rmsL", "rmsXL"])
-                ):
-                    
-                    ws = wb.create_sheet(size["name"], i)
-                                        
-                    # Write headers
-                    headers = [
-                        "Pore id",
-                        "is_edge",
-                        "Area",
-                        "Perimeter",
-                        "Shape",
-                        "Convex Shape",
-                        "Pore elongation",
-                        "Irregular",
-                        "Slightly irregulars",
-                        "Slightly regulars",
-                        "Regulars",
-                        "Equivalent diameter" if size["name"] in ["edS", "edM", "edL", "edXL"] else
-                        "Ellipse minor diameter" if size["name"] in ["emdS", "emdM", "emdL", "emdXL"] else
-                        "Rectangle minor side",
-                        None if size["name"] in ["edS", "edM", "edL", "edXL"] else
-                        "Ellipse major diameter" if size["name"] in ["emdS", "emdM", "emdL", "emdXL"] else
-                        "Rectangle major side",  
-                        "Angle" if shape["name"] == "elongated" else None,  # Ellipse angle
-                    ]
-                    ws.append(headers)
-                
-
-                    try:
-                        # Append the segmented pore data to the worksheet
-                        for row in self.processed_cont_great_50_sz.get((shape["name"], size["name"]), []):
-                            ws.append(row)
-                    except Exception as e:
-                        messagebox.showerror("Error", f"Failed to append data to {shape["name"]}: {str(e)}") 
-                        return    
+        with stage("save_segmented"):
+            write_segmented_pore_data(
+                file_path, mosaic_name, self.shapes, self.sizes, self.processed_cont_great_50_sz,
+                workers=os.cpu_count()
+            )
+    except FileExistsError:
+        show_message("warning", "Warning", "File with segmented pore info already exist.")
+        return
+    except Exception as e:
+        show_message("error", "Error", f"Failed to create xlsx file to save segmented pore info: {str(e)}") 
+        return
 
-            try:
-                wb.save(filename)
-                wb.close()
-            except Exception as e:
-                messagebox.showerror("Error", f"Failed to create {filename}: {str(e)}") 
-                return    
+    show_message("info", "Success", f"Segmented pore data saved to .xlsx files in'{os.path.basename(file_path) + '/' + mosaic_name}'")
+
+
+def save_pore_table(self, file_path, mosaic_name):
+    """Save the morphometrics of every pore to a Parquet file"""
+    if not hasattr(self, 'processed_contours') or self.processed_contours is None:
+        show_message("warning", "Warning", "No processed contours available.")
+        return
+
+    try:
+        filename = pore_table_path(file_path, mosaic_name, "parquet")
+        with stage("save_pore_table", len(self.processed_contours)):
+            write_pore_table(filename, mosaic_name, self.processed_contours, self.calibration, self.area_50,
+                             self.pore_geometry)
+    except FileExistsError:
+        show_message("warning", "Warning", "File with the pore table already exist.")
+        return
     except Exception as e:
-        messagebox.showerror("Error", f"Failed to create xlsx file to save segmented pore info: {str(e)}") 
+        show_message("error", "Error", f"Failed to save the pore table: {str(e)}")
         return
 
+    show_message("info", "Success", f"Pore table saved to '{os.path.basename(filename)}'")
+
 
-                        
-    messagebox.showinfo("Success", f"Segmented pore data saved to .xlsx files in'{os.path.basename(file_path) + '/' + mosaic_name}'")
-                
\ No newline at end of file
+def save_run_report(file_path, mosaic_name):
+    """Save the timing and memory of the stages of this mosaic next to its .h5 file"""
+    run = current_run()
+    if run is None:
+        return
+    try:
+        # <mosaic>_run_report.json and .csv (see instrumentation.Run.write_report)
+        run.write_report(mosaic_output_path(file_path, mosaic_name, "_run_report"))
+    except Exception as e:
+        show_message("warning", "Warning", f"Failed to save the run report: {str(e)}")
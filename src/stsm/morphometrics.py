@@ -0,0 +1,403 @@
+"""
+Pore morphometrics and shape-size classification.
+
+Every descriptor of the pores above 50 micron is computed once per pore into
+NumPy arrays. Only the convex hulls and the ellipse fits need OpenCV calls per
+pore; the shape, size and irregularity classes are then assigned to all the
+pores at once and the segmented pore data is built by grouping.
+"""
+import heapq
+import math as m
+import os
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context, shared_memory
+import cv2
+import numpy as np
+
+# Shapes of interest are defined in a dictionary with min and max values
+SHAPES = [
+    {"name": "circ", "min": 0.8, "max": 1}, # Circular
+    {"name": "MLcirc", "min": 0.5, "max": 0.8}, # More or Less circular
+    {"name": "shpless", "min": 0.2, "max": 0.5}, # Shapeless
+    {"name": "elongated", "min": 0.0, "max": 0.2}, # Elongated
+]
+
+# Sizes of interest are defined in a dictionary with min and max values
+SIZES = [
+    {"name": "edS", "min": 0, "max": 50},           # ed -> Equivalent diameter;        S -> small
+    {"name": "edM", "min": 50, "max": 300},         #                                   M -> medium
+    {"name": "edL", "min": 300, "max": 1000},       #                                   L -> large
+    {"name": "edXL", "min": 1000, "max": 100000},    #                                   XL -> extra earge
+    {"name": "emdS", "min": 0, "max": 50},          # emd -> Ellipse minor diameter;    S -> small
+    {"name": "emdM", "min": 50, "max": 300},        #                                   M -> medium
+    {"name": "emdL", "min": 300, "max": 1000},      #                                   L -> large
+    {"name": "emdXL", "min": 1000, "max": 100000},   #                                   XL -> extra earge
+    {"name": "rmsS", "min": 0, "max": 50},          # rms -> Rectangle minor side;         S -> small
+    {"name": "rmsM", "min": 50, "max": 300},        #                                   M -> medium
+    {"name": "rmsL", "min": 300, "max": 1000},      #                                   L -> large
+    {"name": "rmsXL", "min": 1000, "max": 100000},   #                                   XL -> extra earge
+]
+
+# Size families: the descriptor each group of size classes is measured on
+SIZE_METRICS = {
+    "ed": "eq_diameter",      # Equivalent diameter
+    "emd": "ellipse_minor",   # Ellipse minor diameter
+    "rms": "rect_minor",      # Rectangle minor side
+}
+
+# Morphometric columns copied into the rows of the segmented pore data
+ROW_COLUMNS = ("idx", "is_edge", "area", "perimeter", "shape", "convex_shape", "elongation",
+               "irregularity", "ellipse_angle")
+
+# Rows built at once by SegmentedPores.iter_rows
+ROW_CHUNK = 4096
+
+#Corrected pore irregularity categories
+# according to Pagliai et al., 1984, EFFECTS OF ZERO AND CONVENTIONAL TILLAGE
+# ON THE LENGTH AND IRREGULARITY OF ELONGATED PORES IN A CLAY LOAM SOIL UNDER VITICULTURE
+# Table II: Irregulars theta <= 13.5°, Slightly irregulars <= 22.5°, Slightly regulars <= 31.5°, Regulars
+IRREGULARITY_LIMITS = (m.atan(0.3)*180/m.pi, m.atan(0.5)*180/m.pi, m.atan(0.7)*180/m.pi)
+
+
+def size_family(size_name):
+    """Family ("ed", "emd" or "rms") of a size class name"""
+    return size_name[:-2] if size_name.endswith("XL") else size_name[:-1]
+
+
+def pore_geometry(points, ring_offsets, ring_start, ring_stop):
+    """
+    Convex hull perimeter and fitted ellipse of some pores (the per pore OpenCV part).
+
+    Args:
+        points, ring_offsets: Points buffer and ring offsets of a ContourTable
+        ring_start, ring_stop: Rings of the pores to measure
+
+    Returns:
+        (hull_perimeter, ellipse): hull_perimeter is the perimeter of the convex
+        hull of the parent plus the perimeters of the convex hulls of the
+        children; ellipse holds (minor diameter, major diameter, angle).
+        Both are NaN for pores without contours, and the ellipse for
+        parents of less than 5 points
+    """
+    num = len(ring_start)
+    hull_perimeter = np.zeros(num)
+    ellipse = np.zeros((num, 3))
+    for i in range(num):
+        rings = [
+            points[ring_offsets[r]:ring_offsets[r + 1]].astype(np.int32).reshape(-1, 1, 2)
+            for r in range(ring_start[i], ring_stop[i])
+        ]
+        if not rings:
+            # Pore not traced (see pore_labels.trace_pores)
+            hull_perimeter[i], ellipse[i] = np.nan, np.nan
+            continue
+        # Summed as parent + np.sum(children) to get the same values as ever
+        hull_perimeter[i] = cv2.arcLength(cv2.convexHull(rings[0]), True) + \
+            np.sum([cv2.arcLength(cv2.convexHull(child), True) for child in rings[1:]])
+        if len(rings[0]) < 5:
+            # cv2.fitEllipse needs 5 points (only tiny pores have less)
+            ellipse[i] = np.nan
+            continue
+        _, (minor, major), angle = cv2.fitEllipse(rings[0])
+        ellipse[i] = minor, major, angle
+    return hull_perimeter, ellipse
+
+
+def fit_ellipses(table):
+    """
+    Ellipse of every pore of a table, as in pore_geometry (for pores whose hull
+    perimeter is known already: cv2.fitEllipse works in float32, so its
+    result depends on the position of the contour and cannot be reused
+    after shifting it).
+
+    Returns:
+        (N, 3) array of (minor diameter, major diameter, angle), NaN for
+        parents of less than 5 points
+    """
+    ellipse = np.zeros((len(table), 3))
+    for i in range(len(table)):
+        parent = table.parent(i)
+        if len(parent) < 5:
+            # cv2.fitEllipse needs 5 points (see pore_geometry)
+            ellipse[i] = np.nan
+            continue
+        _, (minor, major), angle = cv2.fitEllipse(parent)
+        ellipse[i] = minor, major, angle
+    return ellipse
+
+
+# Contour buffers of the table being measured, attached once per worker process
+_shared = {}
+
+
+def _attach_buffers(buffers):
+    # Pool initializer: map the shared points and ring offsets as arrays
+    for name, (shm_name, shape, dtype) in buffers.items():
+        shm = shared_memory.SharedMemory(name=shm_name)
+        _shared[name] = (shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf))
+
+
+def _chunk_geometry(ring_start, ring_stop):
+    # Worker task: pore_geometry of a chunk of pores read from the shared buffers
+    return pore_geometry(_shared["points"][1], _shared["ring_offsets"][1], ring_start, ring_stop)
+
+
+def balanced_chunks(weights, num_chunks):
+    """
+    Split pores in chunks of similar total weight.
+
+    Pores are assigned heaviest first to the lightest chunk so far (pore sizes
+    are heavy-tailed: a few large pores can weigh as much as thousands of
+    small ones).
+
+    Args:
+        weights: Cost estimate of each pore (e.g. its number of contour points)
+        num_chunks: Number of chunks
+
+    Returns:
+        List of arrays of pore positions, heaviest chunk first
+    """
+    order = np.argsort(weights, kind="stable")[::-1]
+    heap = [(0, c) for c in range(num_chunks)]
+    members = [[] for _ in range(num_chunks)]
+    loads = [0] * num_chunks
+    for pos, weight in zip(order.tolist(), weights[order].tolist()):
+        load, c = heapq.heappop(heap)
+        members[c].append(pos)
+        loads[c] = load + weight
+        heapq.heappush(heap, (loads[c], c))
+    # Heaviest chunks are submitted first
+    return [np.array(members[c], dtype=np.int64) for c in np.argsort(loads, kind="stable")[::-1] if members[c]]
+
+
+def pore_geometry_parallel(table, workers=None, chunks_per_worker=4):
+    """
+    pore_geometry of a ContourTable on a process pool.
+
+    The points buffer and ring offsets are copied once to shared memory, which
+    the worker processes map instead of receiving pickled contours. Pores are
+    split in balanced chunks (see balanced_chunks) and the results are written
+    back at the position of each pore, so they are identical to a serial run.
+
+    Args:
+        table: ContourTable of the pores to measure
+        workers: Number of worker processes (default: all cores)
+        chunks_per_worker: Chunks per worker, to even out the load
+
+    Returns:
+        (hull_perimeter, ellipse) as pore_geometry
+    """
+    num = len(table)
+    workers = workers or os.cpu_count() or 1
+    hull_perimeter = np.zeros(num)
+    ellipse = np.zeros((num, 3))
+    if num == 0:
+        return hull_perimeter, ellipse
+
+    # Work of a pore grows with its number of contour points
+    weights = table.ring_offsets[table.ring_stop] - table.ring_offsets[table.ring_start]
+    chunks = balanced_chunks(weights, min(num, workers * chunks_per_worker))
+
+    segments = []
+    try:
+        buffers = {}
+        for name in ("points", "ring_offsets"):
+            array = getattr(table, name)
+            shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            segments.append(shm)
+            np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+            buffers[name] = (shm.name, array.shape, array.dtype.str)
+
+        # Spawned, not forked: the caller can be a thread of a multithreaded
+        # process (the GUI's job worker, with Tk and OpenCV threads around),
+        # whose fork could deadlock on a lock held by another thread
+        with ProcessPoolExecutor(max_workers=workers, initializer=_attach_buffers,
+                                 initargs=(buffers, ), mp_context=get_context("spawn")) as pool:
+            futures = [
+                pool.submit(_chunk_geometry, table.ring_start[chunk], table.ring_stop[chunk])
+                for chunk in chunks
+            ]
+            # Merge back in pore order
+            for chunk, future in zip(chunks, futures):
+                hull_perimeter[chunk], ellipse[chunk] = future.result()
+    finally:
+        for shm in segments:
+            shm.close()
+            shm.unlink()
+    return hull_perimeter, ellipse
+
+
+def compute_morphometrics(table, calibration, geometry=None):
+    """
+    Compute the morphometric descriptors of every pore of a ContourTable.
+
+    Args:
+        table: ContourTable of the pores to measure (all traced)
+        calibration: Pixel calibration (pixel/micron)
+        geometry: Optional result of pore_geometry for the table (e.g. computed
+                  in parallel); computed here if not given
+
+    Returns:
+        Dict of arrays with one entry per pore: idx, is_edge, area, perimeter,
+        shape, convex_shape, elongation, irregularity (deg), eq_diameter,
+        ellipse_minor, ellipse_major, ellipse_angle, rect_minor and rect_major
+        (the rectangle sides are NaN for pores with shape >= pi / 4)
+    """
+    if geometry is None:
+        geometry = pore_geometry(table.points, table.ring_offsets, table.ring_start, table.ring_stop)
+    hull_perimeter, ellipse = geometry
+    area, perimeter = table.area, table.perimeter
+
+    #Shape = 4 pi area / perimeter^2
+    S = 4 * m.pi * area / perimeter**2
+    #(Corrected) Convex Shape = 4 pi area / Convex_perimeter^2
+    # adapted from Ringrose-Voase 1991, Micromorphology of Soil Structure:
+    #Description, Quantification, Application, Eq. 2
+    C = 4 * m.pi * area / hull_perimeter**2
+
+    # Rectangle with the same area and perimeter (only exists for S < pi / 4)
+    is_rect = S < m.pi / 4
+    root = np.sqrt(np.where(is_rect, perimeter**2 - 16 * area, np.nan))
+
+    return {
+        "idx": table.idx,
+        "is_edge": table.is_edge,
+        "area": area,
+        "perimeter": perimeter,
+        "shape": S,
+        "convex_shape": C,
+        "elongation": np.sqrt(S**2 + C**2)/m.sqrt(2), #Pore elongation
+        "irregularity": np.arctan(S / C)*180/m.pi, #Pore irragularity (deg)
+        "eq_diameter": 2 * np.sqrt(area / m.pi) / calibration, #Equivalent diameter = 2 sqrt(area / pi) / calibration
+        "ellipse_minor": ellipse[:, 0],
+        "ellipse_major": ellipse[:, 1],
+        "ellipse_angle": ellipse[:, 2],
+        "rect_minor": (perimeter - root)/4,
+        "rect_major": (perimeter + root)/4,
+    }
+
+
+def classify(values, classes):
+    """
+    Index of the class holding each value (min < value <= max), -1 if none.
+
+    Args:
+        values: Array of values
+        classes: List of dicts with "min" and "max" (not overlapping)
+    """
+    # Bin by the class lower limits, then check the upper limit of the bin
+    order = sorted(range(len(classes)), key=lambda i: classes[i]["min"])
+    mins = np.array([classes[i]["min"] for i in order], dtype=np.float64)
+    maxs = np.array([classes[i]["max"] for i in order], dtype=np.float64)
+    bins = np.searchsorted(mins, values, side="left") - 1
+    valid = bins >= 0
+    valid[valid] = values[valid] <= maxs[bins[valid]]
+    return np.where(valid, np.array(order)[np.maximum(bins, 0)], -1)
+
+
+def segment_pores(morpho, shapes, sizes, is_valid):
+    """
+    Group the pores by the shape-size combinations.
+
+    Args:
+        morpho: Result of compute_morphometrics
+        shapes, sizes: Shape and size class definitions
+        is_valid: Callable (shape name, size name) -> True for the combinations to report
+
+    Returns:
+        SegmentedPores, read as a dict {(shape name, size name): [rows]} with
+        the rows of the segmented pore workbooks, pores in idx order within
+        each group
+    """
+    shape_class = classify(morpho["shape"], shapes)
+
+    # Group key of every pore in each size family: shape class * sizes + size class
+    groups = {}
+    for family, metric in SIZE_METRICS.items():
+        family_sizes = [i for i, size in enumerate(sizes) if size_family(size["name"]) == family]
+        size_class = classify(morpho[metric], [sizes[i] for i in family_sizes])
+        matched = (shape_class >= 0) & (size_class >= 0)
+        key = shape_class * len(sizes) + np.array(family_sizes + [-1])[size_class]
+        pores = np.flatnonzero(matched)
+        # A stable sort keeps the pores of each group in idx order
+        pores = pores[np.argsort(key[pores], kind="stable")]
+        keys, starts = np.unique(key[pores], return_index=True)
+        for k, group in zip(keys.tolist(), np.split(pores, starts[1:])):
+            groups[divmod(k, len(sizes))] = group
+
+    segmented = {}
+    for si, shape in enumerate(shapes):
+        for zi, size in enumerate(sizes):
+            # Skip invalid shape-size combinations and empty groups
+            group = groups.get((si, zi))
+            if group is None or not len(group) or not is_valid(shape["name"], size["name"]):
+                continue
+            segmented[(shape["name"], size["name"])] = group
+    return SegmentedPores(morpho, segmented)
+
+
+class SegmentedPores(Mapping):
+    """
+    Pores grouped by shape-size combination, read as {(shape name, size name): [rows]}.
+
+    Only the positions of the pores of each group are kept; the rows (lists of
+    Python values, one per workbook column) are built from the morphometric
+    arrays when a group is read, or a chunk at a time with iter_rows, so
+    exporters never hold all the rows in memory.
+
+    Args:
+        morpho: Result of compute_morphometrics
+        groups: Dict {(shape name, size name): array of positions in morpho}
+    """
+
+    def __init__(self, morpho, groups):
+        self.morpho = morpho
+        self.groups = groups
+
+    def __getitem__(self, key):
+        return list(self.iter_rows(key))
+
+    def __iter__(self):
+        return iter(self.groups)
+
+    def __len__(self):
+        return len(self.groups)
+
+    def num_rows(self, key):
+        """Number of pores of a group (0 for the combinations without pores)"""
+        group = self.groups.get(key)
+        return 0 if group is None else len(group)
+
+    def iter_rows(self, key, chunk_rows=ROW_CHUNK):
+        """Yield the rows of a group (none for the combinations without pores)"""
+        group = self.groups.get(key)
+        if group is None:
+            return
+        shape_name, size_name = key
+        family = size_family(size_name)
+        second_name = None if family == "ed" else "ellipse_major" if family == "emd" else "rect_major"
+        for start in range(0, len(group), chunk_rows):
+            rows = group[start:start + chunk_rows]
+            # Python values of the chunk, once per column
+            col = {name: self.morpho[name][rows].tolist() for name in ROW_COLUMNS}
+            size_metric = self.morpho[SIZE_METRICS[family]][rows].tolist()
+            second_metric = [None] * len(rows) if second_name is None else self.morpho[second_name][rows].tolist()
+            angle = col["ellipse_angle"] if shape_name == "elongated" else [None] * len(rows)
+            for i, v in enumerate(col["irregularity"]):
+                yield [
+                    col["idx"][i],  # idx
+                    str(col["is_edge"][i]),  # is_edge
+                    col["area"][i],  # area
+                    col["perimeter"][i],  # perimeter
+                    col["shape"][i],  # Shape
+                    col["convex_shape"][i],  # Convex Shape
+                    col["elongation"][i],  # Pore elongation
+                    v if v <= IRREGULARITY_LIMITS[0] else None, # Irregulars
+                    v if IRREGULARITY_LIMITS[0] < v <= IRREGULARITY_LIMITS[1] else None, # Slightly irregulars
+                    v if IRREGULARITY_LIMITS[1] < v <= IRREGULARITY_LIMITS[2] else None, # Slightly regulars
+                    v if IRREGULARITY_LIMITS[2] < v else None, # Regulars
+                    size_metric[i],  # Size metric (Equivalent diameter, Ellipse minor diameter, etc.)
+                    second_metric[i],  # Ellipse major diameter or Rectangle major side
+                    angle[i],  # Ellipse angle
+                ]
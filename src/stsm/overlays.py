@@ -0,0 +1,90 @@
+import cv2
+import numpy as np
+
+# Sub-pixel bits used when drawing scaled contours (see cv2.polylines shift)
+DRAW_SHIFT = 4
+
+
+class ContourOverlay:
+    """
+    Layer of the Processing tab: pore contours drawn over the binary mosaic.
+
+    Only the binary image (shared with the other layers) and the rows of the
+    contour table to draw are kept; the BGR picture is rasterized on demand,
+    at display size by render() or at full resolution by materialize() when
+    the layer is saved. A full resolution BGR copy per layer would take
+    3 bytes per pixel of the mosaic for each layer.
+
+    Args:
+        image: Binary mosaic (single channel)
+        contours: ContourTable with the pores to draw
+        color: BGR color of the contours
+        thickness: Line thickness at full resolution (pixels)
+    """
+
+    def __init__(self, image, contours, color, thickness=2):
+        self.image = image
+        self.contours = contours
+        self.color = color
+        self.thickness = thickness
+        self.shape = image.shape[:2] + (3, )
+
+    def render(self, size):
+        """
+        The layer at display size.
+
+        The binary image is resized (area averaging when reducing) and the
+        contours are scaled and drawn at that size, with sub-pixel precision
+        and at least one pixel thick.
+
+        Args:
+            size: Display size (width, height)
+
+        Returns:
+            BGR image of that size
+        """
+        width, height = size
+        img_height, img_width = self.image.shape[:2]
+        interpolation = cv2.INTER_AREA if width < img_width else cv2.INTER_LINEAR
+        canvas = cv2.cvtColor(cv2.resize(self.image, size, interpolation=interpolation), cv2.COLOR_GRAY2BGR)
+
+        points, ring_offsets, _ = self.contours.pack()
+        if len(points) == 0:
+            return canvas
+        # Pixel centres of the mosaic mapped to the display, in fixed point
+        scale = np.array([width / img_width, height / img_height])
+        scaled = np.round(((points + 0.5) * scale - 0.5) * (1 << DRAW_SHIFT)).astype(np.int32)
+        rings = np.split(scaled, ring_offsets[1:-1])
+        thickness = max(1, int(round(self.thickness * scale.min())))
+        cv2.polylines(canvas, rings, True, self.color, thickness, cv2.LINE_8, DRAW_SHIFT)
+        return canvas
+
+    def materialize(self):
+        """The layer at full resolution (as drawn before layers were lazy), for saving"""
+        canvas = cv2.cvtColor(self.image, cv2.COLOR_GRAY2BGR)
+        cv2.drawContours(canvas, self.contours.contours(), -1, self.color, self.thickness)
+        return canvas
+
+
+class PreviewLayer:
+    """
+    Layer of the Binary tab for an image too large to be held in memory.
+
+    The image stays in its ImageSource (e.g. the binary mosaic fused to a
+    .npy file by fusion.binarize_tiled); a downsampled copy, read once, is
+    what gets displayed.
+
+    Args:
+        source: ImageSource of the image (single channel)
+        max_side: Largest side of the preview (pixels)
+    """
+
+    def __init__(self, source, max_side=2048):
+        self.source = source
+        self.shape = source.shape[:2]
+        self.preview, _ = source.thumbnail(max_side)
+
+    def render(self, size):
+        """The preview resized to the display size (width, height)"""
+        interpolation = cv2.INTER_AREA if size[0] < self.preview.shape[1] else cv2.INTER_LINEAR
+        return cv2.resize(self.preview, size, interpolation=interpolation)
@@ -0,0 +1,604 @@
+import csv
+import os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+import cv2
+import numpy as np
+import openpyxl as opxl
+import h5py
+from contour_table import ContourTable
+
+# Headers of the Global Pore Stats workbook (one row per mosaic)
+GPD_HEADERS = [
+    "Mosaic Name",
+    "Number of parent contours",
+    "Number of child contours",
+    "Porosity",
+    "Number of parent contours <= 50μm",
+    "Number of child contours\n(parent <= 50μm)",
+    "Percentage of pores <= 50μm",
+    "Number of parent contours > 50μm",
+    "Number of child contours\n(parent > 50μm)",
+    "Percentage of pores > 50μm"
+]
+
+
+# File formats of the segmented pore data (see write_segmented_pore_data)
+SEGMENTED_FORMATS = ("xlsx", "csv", "tsv")
+
+# Below this number of segmented pores the shapes are written one by one
+# (starting the worker processes costs more than it saves)
+PARALLEL_EXPORT_MIN_ROWS = 20000
+
+# Layout written by write_contours_hdf5 (see its docstring)
+HDF5_FORMAT_VERSION = 2
+
+# Rows of the pore attribute table of format 2 files
+PORE_DTYPE = np.dtype([
+    ("index", np.int64),
+    ("is_edge", np.bool_),
+    ("area", np.float64),
+    ("perimeter", np.float64),
+    ("num_children", np.int32),
+    ("bbox", np.int32, (4, )),
+])
+
+# Rows per chunk of the format 2 datasets
+HDF5_CHUNK_ROWS = 8192
+
+# Chunk cache of PoreReader (bytes)
+READER_CHUNK_CACHE = 32 * 1024 * 1024
+
+# Pores whose contours PoreReader keeps in memory
+READER_CACHE_PORES = 50000
+
+# PoreReader.read_contours reads pores closer than this (points) in one slice
+READER_GAP_POINTS = 65536
+
+
+def mosaic_output_path(file_path, mosaic_name, suffix):
+    """Build <file_path>/<mosaic_name>/<mosaic_name><suffix> and create its directory"""
+    filename = os.path.join(file_path, mosaic_name, mosaic_name + suffix)
+    # Creates the directory if does not exist
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    return filename
+
+
+def write_binary_image(filename, image):
+    """Write a binary mosaic to disk, raising if OpenCV cannot encode it"""
+    if not cv2.imwrite(filename, image):
+        raise IOError(f"Could not write '{filename}'")
+
+
+def append_gpd_stats(file_path, summary):
+    """
+    Append a summary row to <file_path>/Global_Pore_Stats.xlsx.
+
+    Args:
+        file_path: Directory holding the workbook (created with headers if missing)
+        summary: Tuple starting with the mosaic name followed by proc_cont_all's summary
+    """
+    xlsx_path = os.path.join(file_path, "Global_Pore_Stats.xlsx")
+    if not os.path.exists(xlsx_path):
+        # If file does not exist, create a new workbook and worksheet
+        wb = opxl.Workbook()
+        ws = wb.active
+        ws.title = "Global Pore Stats"
+        ws.append(GPD_HEADERS)
+    else:
+        # If file exists, load the existing workbook and worksheet
+        wb = opxl.load_workbook(xlsx_path)
+        ws = wb.active
+
+    # Append the summary to the worksheet
+    ws.append(summary)
+    wb.save(xlsx_path)
+    wb.close()
+    return xlsx_path
+
+
+def remove_gpd_stats(file_path, mosaic_names):
+    """
+    Remove the summary rows of some mosaics from <file_path>/Global_Pore_Stats.xlsx (if it exists).
+
+    Returns:
+        Number of rows removed
+    """
+    xlsx_path = os.path.join(file_path, "Global_Pore_Stats.xlsx")
+    if not os.path.exists(xlsx_path):
+        return 0
+    names = set(mosaic_names)
+    wb = opxl.load_workbook(xlsx_path)
+    ws = wb.active
+    # Bottom up, so the rows left keep their index
+    rows = [row for row in range(ws.max_row, 1, -1) if ws.cell(row=row, column=1).value in names]
+    for row in rows:
+        ws.delete_rows(row)
+    if rows:
+        wb.save(xlsx_path)
+    wb.close()
+    return len(rows)
+
+
+def write_contours_hdf5(filename, contour_data, format_version=HDF5_FORMAT_VERSION):
+    """
+    Save contours with edge information to HDF5 file.
+
+    Format 2 (default) stores one compound table of pore attributes and the
+    contour points of all the pores concatenated, with offset arrays:
+
+        attrs: format_version, num_contours
+        pores: (N,) PORE_DTYPE rows (index, is_edge, area, perimeter, num_children, bbox)
+        pore_rings: (N + 1,) rings of pore i are pore_rings[i] to pore_rings[i + 1] - 1,
+                    the first one is its parent, the others its children (none if untraced)
+        ring_offsets: (R + 1,) points of ring r are ring_offsets[r] to ring_offsets[r + 1] - 1
+        points: (P, 2) x, y coordinates, chunked and compressed
+
+    Format 1 stores one group per pore (see _write_contours_hdf5_v1).
+
+    Args:
+        filename: Output HDF5 filename
+        contour_data: ContourTable of the processed contours
+        format_version: 2, or 1 for readers of the original per-group layout
+    """
+    if format_version == 1:
+        _write_contours_hdf5_v1(filename, contour_data)
+        return
+
+    points, ring_offsets, pore_rings = contour_data.pack()
+    pores = np.zeros(len(contour_data), dtype=PORE_DTYPE)
+    for name in PORE_DTYPE.names:
+        pores[name] = getattr(contour_data, "idx" if name == "index" else name)
+
+    with h5py.File(filename, 'w') as f:
+        # Store metadata about the dataset
+        f.attrs['format_version'] = 2
+        f.attrs['num_contours'] = len(contour_data)
+
+        _create_chunked(f, "pores", pores)
+        _create_chunked(f, "pore_rings", pore_rings)
+        _create_chunked(f, "ring_offsets", ring_offsets)
+        _create_chunked(f, "points", points)
+
+
+def _create_chunked(f, name, data):
+    # Chunks of up to HDF5_CHUNK_ROWS rows, shuffled and gzip compressed
+    # (resizable, so that empty datasets can be chunked too)
+    chunks = (max(1, min(len(data), HDF5_CHUNK_ROWS)), ) + data.shape[1:]
+    return f.create_dataset(name, data=data, chunks=chunks, maxshape=(None, ) + data.shape[1:],
+                            compression="gzip", compression_opts=4, shuffle=True)
+
+
+def _write_contours_hdf5_v1(filename, contour_data):
+    """Save contours in the format 1 layout: one group per pore and one dataset per contour"""
+    with h5py.File(filename, 'w') as f:
+        # Create a group for all contours
+        contours_group = f.create_group("contours")
+
+        # Store metadata about the dataset
+        f.attrs['num_contours'] = len(contour_data)
+
+        # Create groups for edge and interior contours for easy filtering
+        edge_group = f.create_group("edge_contours")
+        interior_group = f.create_group("interior_contours")
+
+        # Create a group for each contour with its index as the name for direct access
+        for i, (idx, is_edge, parent, children, area, perimeter) in enumerate(contour_data.iter_rows()):
+            # Use the index as the group name for direct access
+            contour_group = contours_group.create_group(f"{idx}")
+
+            # Store the index and edge flag as attributes
+            contour_group.attrs['index'] = idx
+            contour_group.attrs['is_edge'] = is_edge
+            contour_group.attrs['area'] = area
+            contour_group.attrs['perimeter'] = perimeter
+
+            # Save parent contour (empty if it was not traced)
+            contour_group.create_dataset('parent', data=parent if parent is not None else np.zeros((0, 1, 2), np.int32))
+
+            # Save metadata about children
+            contour_group.attrs['num_children'] = int(contour_data.num_children[i])
+
+            # Create a group for children
+            if children:
+                children_group = contour_group.create_group('children')
+                for j, child in enumerate(children):
+                    children_group.create_dataset(f"{j}", data=child)
+
+            # Add reference to edge or interior group
+            if is_edge:
+                edge_group[f"{idx}"] = contour_group.ref
+            else:
+                interior_group[f"{idx}"] = contour_group.ref
+
+
+def hdf5_format_version(f):
+    """Layout version of an open contours file (files without the attribute are format 1)"""
+    return int(f.attrs.get('format_version', 1))
+
+
+def read_contours_hdf5(filename):
+    """
+    Load a contours file written by write_contours_hdf5 (any format version).
+
+    Returns:
+        ContourTable with the saved pores
+    """
+    with h5py.File(filename, 'r') as f:
+        version = hdf5_format_version(f)
+        if version == 2:
+            pores = f["pores"][:]
+            pore_rings = f["pore_rings"][:]
+            return ContourTable(
+                f["points"][:], f["ring_offsets"][:],
+                idx=pores["index"].astype(np.int64),
+                is_edge=pores["is_edge"].astype(bool),
+                area=pores["area"].astype(np.float64),
+                perimeter=pores["perimeter"].astype(np.float64),
+                num_children=pores["num_children"].astype(np.int32),
+                bbox=pores["bbox"].astype(np.int32),
+                ring_start=pore_rings[:-1],
+                ring_stop=pore_rings[1:],
+            )
+        if version != 1:
+            raise ValueError(f"Unsupported contours file format version {version}")
+        if "contours" not in f:
+            raise RuntimeError("Invalid H5: 'contours' group not found.")
+
+        # Format 1: one group per pore, in pore id order
+        groups = [f["contours"][key] for key in sorted(f["contours"].keys(), key=_pore_id_key)]
+        parents = [g['parent'][:] if 'parent' in g else None for g in groups]
+        children = [
+            [g['children'][key][:] for key in sorted(g['children'].keys(), key=int)] if 'children' in g else []
+            for g in groups
+        ]
+        table = ContourTable.from_contours(
+            parents, children,
+            is_edge=[bool(g.attrs.get('is_edge', False)) for g in groups],
+            area=[float(g.attrs.get('area', 0.0)) for g in groups],
+            perimeter=[float(g.attrs.get('perimeter', 0.0)) for g in groups],
+            num_children=[int(g.attrs.get('num_children', len(c))) for g, c in zip(groups, children)],
+        )
+        table.idx = np.array([int(g.attrs.get('index', g.name.rsplit('/', 1)[-1])) for g in groups], dtype=np.int64)
+        return table
+
+
+class PoreReader:
+    """
+    Random access to the pores of a contours file, with a file handle kept open.
+
+    Only a compact index is loaded: the sorted pore ids and, for format 2
+    files, the ring offsets, so each pore is then fetched with a single slice
+    read of the points dataset. Bounding boxes, for spatial queries, are
+    loaded on demand (see bboxes). Format 1 files have no index: it is built once
+    by listing the pore groups and cached next to the file
+    (<file>.index.npz, rebuilt if the file changes).
+
+    Usage:
+        with PoreReader(path) as reader:
+            attrs, parent, children = reader.read(reader.ids[0])
+    """
+
+    def __init__(self, path):
+        self.path = path
+        # Chunk cache large enough to keep the chunks of recent lookups decompressed
+        self.file = h5py.File(path, 'r', rdcc_nbytes=READER_CHUNK_CACHE)
+        self._bbox = None
+        self._index_cache = {}
+        # Contours of the recently read pores (read_contours)
+        self._cache = OrderedDict()
+        try:
+            self.version = hdf5_format_version(self.file)
+            if self.version == 2:
+                self._pores = self.file["pores"]
+                self._points = self.file["points"]
+                index = self._pores["index"]
+                self._pore_rings = self.file["pore_rings"][:]
+                self._ring_offsets = self.file["ring_offsets"][:]
+                # Row of each pore id (ids are usually the rows themselves)
+                self._rows = np.argsort(index, kind="stable")
+                self.ids = index[self._rows]
+            elif self.version == 1:
+                if "contours" not in self.file:
+                    raise RuntimeError("Invalid H5: 'contours' group not found.")
+                self.ids = self._load_v1_index()
+            else:
+                raise ValueError(f"Unsupported contours file format version {self.version}")
+        except Exception:
+            self.file.close()
+            raise
+
+    def _load_v1_index(self):
+        # Sorted integer pore ids, from the cache if it matches the file
+        self._index_cache = self._read_v1_cache()
+        if "ids" in self._index_cache:
+            return self._index_cache["ids"]
+        ids = np.sort(np.array([int(k) for k in self.file["contours"].keys() if k.isdigit()], dtype=np.int64))
+        self._write_v1_cache(ids=ids)
+        return ids
+
+    def _read_v1_cache(self):
+        # Arrays of <file>.index.npz, if it was built for this version of the file
+        stat = os.stat(self.path)
+        try:
+            with np.load(self.path + ".index.npz") as data:
+                if data["mtime_ns"] == stat.st_mtime_ns and data["size"] == stat.st_size:
+                    return {name: data[name] for name in data.files}
+        except (OSError, KeyError, ValueError):
+            pass
+        return {}
+
+    def _write_v1_cache(self, **arrays):
+        stat = os.stat(self.path)
+        self._index_cache.update(arrays, mtime_ns=stat.st_mtime_ns, size=stat.st_size)
+        try:
+            np.savez(self.path + ".index.npz", **self._index_cache)
+        except OSError:
+            pass  # Read-only location: the index is just not cached
+
+    def bboxes(self):
+        """
+        (x, y, w, h) bounding box of every pore, aligned with self.ids.
+
+        Loaded once. Format 1 files do not store them: they are computed from
+        the parent contours the first time and added to the cached index.
+        """
+        if self._bbox is None:
+            if self.version == 2:
+                self._bbox = self._pores["bbox"][self._rows] if len(self._rows) else np.zeros((0, 4), np.int32)
+            elif "bbox" in self._index_cache:
+                self._bbox = self._index_cache["bbox"]
+            else:
+                bbox = np.zeros((len(self.ids), 4), dtype=np.int32)
+                for i, pore_id in enumerate(self.ids):
+                    cg = self.file["contours"][str(pore_id)]
+                    if 'parent' in cg and cg['parent'].size:
+                        bbox[i] = cv2.boundingRect(cg['parent'][:].reshape(-1, 1, 2).astype(np.int32))
+                self._bbox = bbox
+                self._write_v1_cache(bbox=bbox)
+        return self._bbox
+
+    def read_contours(self, pore_ids):
+        """
+        Parent and children contours of several pores, e.g. all the pores in view.
+
+        Recently read pores are kept in memory. With format 2 files the pores
+        that are close in the points dataset are fetched with a single slice read.
+
+        Returns:
+            Dict {pore id: (parent, children)}, as in read
+        """
+        result = {}
+        missing = []
+        for pore_id in pore_ids:
+            pore_id = int(pore_id)
+            if pore_id in self._cache:
+                self._cache.move_to_end(pore_id)
+                result[pore_id] = self._cache[pore_id]
+            elif self._position(pore_id) is not None:
+                missing.append(pore_id)
+
+        if self.version == 1:
+            for pore_id in missing:
+                _, parent, children = self._read_v1(str(pore_id))
+                result[pore_id] = (parent, children)
+        elif missing:
+            rows = self._rows[[self._position(pore_id) for pore_id in missing]]
+            ring0, ring1 = self._pore_rings[rows], self._pore_rings[rows + 1]
+            starts, stops = self._ring_offsets[ring0], self._ring_offsets[ring1]
+            order = np.argsort(starts, kind="stable")
+            # Runs of pores separated by less than READER_GAP_POINTS points
+            breaks = np.flatnonzero(starts[order][1:] - np.maximum.accumulate(stops[order])[:-1] > READER_GAP_POINTS) + 1
+            for run in np.split(order, breaks):
+                base = int(starts[run].min())
+                points = self._points[base:int(stops[run].max())].astype(np.int32)
+                for k in run.tolist():
+                    offsets = self._ring_offsets[ring0[k]:ring1[k] + 1] - base
+                    rings = [points[a:b].reshape(-1, 1, 2) for a, b in zip(offsets[:-1], offsets[1:])]
+                    result[missing[k]] = (rings[0] if rings else None, rings[1:])
+
+        for pore_id in missing:
+            self._cache[pore_id] = result[pore_id]
+        while len(self._cache) > READER_CACHE_PORES:
+            self._cache.popitem(last=False)
+        return result
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, pore_id):
+        return self._position(pore_id) is not None
+
+    def _position(self, pore_id):
+        # Position of the pore id in self.ids (None if missing)
+        try:
+            pore_id = int(pore_id)
+        except (TypeError, ValueError):
+            return None
+        pos = int(np.searchsorted(self.ids, pore_id))
+        return pos if pos < len(self.ids) and self.ids[pos] == pore_id else None
+
+    def read(self, pore_id):
+        """
+        Read a single pore.
+
+        Returns:
+            (attrs, parent, children): attrs is a dict with index, is_edge, area,
+            perimeter and num_children; parent (None if not traced) and children
+            are (N, 1, 2) int32 contours
+
+        Raises:
+            KeyError: If the pore is not in the file
+        """
+        pos = self._position(pore_id)
+        if pos is None:
+            raise KeyError(f"Pore_id '{pore_id}' not found in H5")
+        if self.version == 1:
+            return self._read_v1(str(self.ids[pos]))
+
+        row = int(self._rows[pos])
+        pore = self._pores[row]
+        offsets = self._ring_offsets[self._pore_rings[row]:self._pore_rings[row + 1] + 1]
+        # Parent and children are contiguous: one read for all of them
+        points = self._points[offsets[0]:offsets[-1]].astype(np.int32) if len(offsets) > 1 else None
+        rings = [points[a - offsets[0]:b - offsets[0]].reshape(-1, 1, 2) for a, b in zip(offsets[:-1], offsets[1:])]
+        attrs = {name: pore[name].item() for name in ("index", "is_edge", "area", "perimeter", "num_children")}
+        return attrs, (rings[0] if rings else None), rings[1:]
+
+    def _read_v1(self, name):
+        cg = self.file["contours"][name]
+        attrs = {
+            "index": int(cg.attrs.get('index', int(name))),
+            "is_edge": bool(cg.attrs.get('is_edge', False)),
+            "area": float(cg.attrs.get('area', 0.0)),
+            "perimeter": float(cg.attrs.get('perimeter', 0.0)),
+            "num_children": int(cg.attrs.get('num_children', 0)),
+        }
+        parent = cg['parent'][:] if 'parent' in cg else None
+        children = [cg['children'][key][:] for key in sorted(cg['children'].keys(), key=int)] if 'children' in cg else []
+
+        # Ensure correct contour shapes and dtypes
+        def _as_contour(arr):
+            if arr is None or np.size(arr) == 0:
+                return None
+            return np.asarray(arr).reshape(-1, 1, 2).astype(np.int32)
+
+        return attrs, _as_contour(parent), [c for c in (_as_contour(c) for c in children) if c is not None]
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _pore_id_key(name):
+    # Pore groups are named after their (integer) index
+    return (0, int(name), "") if str(name).isdigit() else (1, 0, str(name))
+
+
+def segmented_headers(shape_name, size_name):
+    """Column headers of a shape-size sheet of the segmented pore workbooks"""
+    return [
+        "Pore id",
+        "is_edge",
+        "Area",
+        "Perimeter",
+        "Shape",
+        "Convex Shape",
+        "Pore elongation",
+        "Irregular",
+        "Slightly irregulars",
+        "Slightly regulars",
+        "Regulars",
+        "Equivalent diameter" if size_name in ["edS", "edM", "edL", "edXL"] else
+        "Ellipse minor diameter" if size_name in ["emdS", "emdM", "emdL", "emdXL"] else
+        "Rectangle minor side",
+        None if size_name in ["edS", "edM", "edL", "edXL"] else
+        "Ellipse major diameter" if size_name in ["emdS", "emdM", "emdL", "emdXL"] else
+        "Rectangle major side",
+        "Angle" if shape_name == "elongated" else None,  # Ellipse angle
+    ]
+
+
+def is_valid_shape_size(shape_name, size_name):
+    """True for the shape-size combinations reported in the segmented pore data"""
+    return (
+        (shape_name != "elongated" and size_name in ["edS", "edM", "edL", "edXL"]) or
+        (shape_name != "circ" and size_name in ["emdS", "emdM", "emdL", "emdXL"]) or
+        ((shape_name not in ["circ", "MLcirc"]) and size_name in ["rmsS", "rmsM", "rmsL", "rmsXL"])
+    )
+
+
+def write_segmented_pore_data(file_path, mosaic_name, shapes, sizes, segmented, file_format="xlsx",
+                              workers=None):
+    """
+    Save the segmented pores, streaming the rows to the files.
+
+    With the "xlsx" format there is one workbook per shape (one sheet per
+    size), written with openpyxl's write-only mode; "csv" and "tsv" write one
+    text file per shape-size combination (<mosaic>_<shape>_<size>.csv). The
+    columns are the same in every format (see segmented_headers). Rows are
+    produced a chunk at a time (see SegmentedPores.iter_rows), so memory does
+    not grow with the number of pores.
+
+    Args:
+        file_path: Output directory (files go to <file_path>/<mosaic_name>/)
+        mosaic_name: Name of the mosaic
+        shapes, sizes: Shape and size class definitions (see proc_cont_great_50)
+        segmented: SegmentedPores or dict {(shape name, size name): [rows]}
+        file_format: "xlsx", "csv" or "tsv"
+        workers: Processes writing the shapes concurrently (default: one
+                 shape after the other in this process)
+
+    Raises:
+        FileExistsError: If a segmented pore file of this mosaic already exists
+    """
+    if file_format not in SEGMENTED_FORMATS:
+        raise ValueError(f"Unknown segmented pore data format '{file_format}'")
+    # Check every output first, so nothing is written if one exists
+    for shape in shapes:
+        for filename in _segmented_files(file_path, mosaic_name, shape, sizes, file_format).values():
+            if os.path.exists(filename):
+                raise FileExistsError(f"File with segmented pore info already exist: '{filename}'")
+
+    jobs = [(file_path, mosaic_name, shape, sizes, segmented, file_format) for shape in shapes]
+    total_rows = sum(_num_rows(segmented, key) for key in segmented)
+    if workers and workers > 1 and total_rows >= PARALLEL_EXPORT_MIN_ROWS:
+        # Serializing rows is pure Python: processes write the shapes in parallel
+        # (spawned, not forked, as in morphometrics.pore_geometry_parallel)
+        with ProcessPoolExecutor(max_workers=min(workers, len(jobs)), mp_context=get_context("spawn")) as pool:
+            for _ in pool.map(_write_segmented_shape, *zip(*jobs)):
+                pass
+    else:
+        for job in jobs:
+            _write_segmented_shape(*job)
+
+
+def _segmented_files(file_path, mosaic_name, shape, sizes, file_format):
+    # Output file of each size of a shape ({size name: filename}; one shared workbook for xlsx)
+    valid = [size["name"] for size in sizes if is_valid_shape_size(shape["name"], size["name"])]
+    if file_format == "xlsx":
+        filename = mosaic_output_path(file_path, mosaic_name, "_" + shape["name"] + ".xlsx")
+        return {size_name: filename for size_name in valid}
+    return {
+        size_name: mosaic_output_path(file_path, mosaic_name, f"_{shape['name']}_{size_name}.{file_format}")
+        for size_name in valid
+    }
+
+
+def _num_rows(segmented, key):
+    return segmented.num_rows(key) if hasattr(segmented, "num_rows") else len(segmented.get(key, []))
+
+
+def _segmented_rows(segmented, key):
+    return segmented.iter_rows(key) if hasattr(segmented, "iter_rows") else segmented.get(key, [])
+
+
+def _write_segmented_shape(file_path, mosaic_name, shape, sizes, segmented, file_format):
+    """Write the files of one shape (see write_segmented_pore_data)"""
+    files = _segmented_files(file_path, mosaic_name, shape, sizes, file_format)
+    if file_format == "xlsx":
+        wb = opxl.Workbook(write_only=True)
+        for size_name in files:
+            ws = wb.create_sheet(size_name)
+            # Write headers
+            ws.append(segmented_headers(shape["name"], size_name))
+            # Append the segmented pore data to the worksheet
+            for row in _segmented_rows(segmented, (shape["name"], size_name)):
+                ws.append(row)
+        if files:
+            wb.save(next(iter(files.values())))
+        wb.close()
+        return
+
+    delimiter = "\t" if file_format == "tsv" else ","
+    for size_name, filename in files.items():
+        with open(filename, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f, delimiter=delimiter)
+            writer.writerow(segmented_headers(shape["name"], size_name))
+            writer.writerows(_segmented_rows(segmented, (shape["name"], size_name)))
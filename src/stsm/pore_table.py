@@ -0,0 +1,237 @@
+"""
+Columnar export of the morphometrics of every pore of a mosaic.
+
+The segmented pore data (see pore_io.write_segmented_pore_data) only holds the
+pores larger than 50 micron, split in one sheet per shape-size combination.
+The pore table has one row per pore of the mosaic, with its descriptors and
+class labels as columns, for analysis with pandas, polars or DuckDB:
+
+    idx, is_edge, area, perimeter, num_children, bbox_x, bbox_y, bbox_w,
+    bbox_h, great_50 (area > 50 micron pore), shape, convex_shape,
+    elongation, irregularity, eq_diameter, ellipse_minor, ellipse_major,
+    ellipse_angle, rect_minor, rect_major, shape_class, irregularity_class,
+    ed_class, emd_class and rms_class (plus the mosaic name)
+
+Labels are dictionary encoded (categoricals in pandas) and null when the
+value falls in no class. Descriptors that cannot be measured are NaN: the
+ellipse of contours with less than 5 points, everything but the area of
+the pores that were not traced, the rectangle sides when S >= pi / 4.
+
+Rows are computed and written one row group at a time, so the file grows
+while the pores are measured and memory does not grow with their number.
+Two formats are written:
+
+    .parquet    compressed, one row group per chunk of pores
+    .arrow      Arrow IPC file (Feather v2), uncompressed: it can be
+                memory-mapped and read without copies
+                (pyarrow.ipc.open_file, polars.read_ipc(memory_map=True))
+
+With a campaign name the table goes to a hive partition,
+<output>/pore_tables/campaign=<campaign>/<mosaic>.parquet, so the tables of
+every mosaic read as one dataset with a campaign column
+(pyarrow.dataset.dataset(..., partitioning="hive"), polars.scan_parquet).
+
+Needs the optional pyarrow package.
+"""
+import os
+import numpy as np
+from morphometrics import (SHAPES, SIZES, SIZE_METRICS, IRREGULARITY_LIMITS, classify, compute_morphometrics,
+                           pore_geometry, size_family)
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+    import pyarrow.parquet as pq
+except ImportError:  # Optional: only the pore table export needs it
+    pa = pq = None
+
+# File formats of the pore table (see write_pore_table)
+PORE_TABLE_FORMATS = ("parquet", "arrow")
+
+# Pores per row group (and per chunk measured at once)
+PORE_TABLE_ROW_GROUP = 65536
+
+# Folder of the campaign partitions in the output directory
+PORE_TABLES_DIR = "pore_tables"
+
+# Names of the irregularity classes (limits in IRREGULARITY_LIMITS)
+IRREGULARITY_CLASSES = ("Irregular", "Slightly irregular", "Slightly regular", "Regular")
+
+# Numeric columns of the table, in order, with their NumPy type
+PORE_TABLE_COLUMNS = (
+    ("idx", np.int64),
+    ("is_edge", np.bool_),
+    ("area", np.float64),
+    ("perimeter", np.float64),
+    ("num_children", np.int32),
+    ("bbox_x", np.int32),
+    ("bbox_y", np.int32),
+    ("bbox_w", np.int32),
+    ("bbox_h", np.int32),
+    ("great_50", np.bool_),
+    ("shape", np.float64),
+    ("convex_shape", np.float64),
+    ("elongation", np.float64),
+    ("irregularity", np.float64),
+    ("eq_diameter", np.float64),
+    ("ellipse_minor", np.float64),
+    ("ellipse_major", np.float64),
+    ("ellipse_angle", np.float64),
+    ("rect_minor", np.float64),
+    ("rect_major", np.float64),
+)
+
+
+def pore_table_available():
+    """True if pyarrow is installed (the pore table can be written)"""
+    return pa is not None
+
+
+def pore_table_labels(shapes=SHAPES, sizes=SIZES):
+    """Label columns of the table: {column name: class names}, in order"""
+    labels = {
+        "shape_class": tuple(shape["name"] for shape in shapes),
+        "irregularity_class": IRREGULARITY_CLASSES,
+    }
+    for family in SIZE_METRICS:
+        labels[family + "_class"] = tuple(size["name"] for size in sizes if size_family(size["name"]) == family)
+    return labels
+
+
+def pore_table_path(file_path, mosaic_name, file_format="parquet", campaign=None):
+    """
+    Path of the pore table of a mosaic, creating its directory.
+
+    <file_path>/<mosaic_name>/<mosaic_name>.<format>, or
+    <file_path>/pore_tables/campaign=<campaign>/<mosaic_name>.<format> with a campaign.
+    """
+    if campaign is None:
+        filename = os.path.join(file_path, mosaic_name, f"{mosaic_name}.{file_format}")
+    else:
+        filename = os.path.join(file_path, PORE_TABLES_DIR, f"campaign={campaign}", f"{mosaic_name}.{file_format}")
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    return filename
+
+
+def iter_pore_columns(contours, calibration, area_50, geometry=None, shapes=SHAPES, sizes=SIZES,
+                      chunk_rows=PORE_TABLE_ROW_GROUP):
+    """
+    Yield the columns of the pore table, chunk_rows pores at a time.
+
+    Args:
+        contours: ContourTable of all the pores
+        calibration: Pixel calibration (pixel/micron)
+        area_50: Area (pixels) of a 50 micron pore
+        geometry: Optional (hull_perimeter, ellipse) of the pores > area_50,
+                  in table order (see proc_cont_great_50); only the other pores
+                  are measured then
+        shapes, sizes: Shape and size class definitions
+        chunk_rows: Pores per chunk
+
+    Yields:
+        Dict {column: array} with the columns of PORE_TABLE_COLUMNS and the
+        class index (-1 if none) of each label column of pore_table_labels
+    """
+    great_50 = contours.area > area_50
+    # Position of each pore > 50 micron in geometry
+    great_50_pos = np.cumsum(great_50) - 1
+    families = {
+        family: [size for size in sizes if size_family(size["name"]) == family] for family in SIZE_METRICS
+    }
+
+    for start in range(0, len(contours), chunk_rows):
+        chunk = contours[start:start + chunk_rows]
+        known = great_50[start:start + chunk_rows] if geometry is not None else np.zeros(len(chunk), dtype=bool)
+        hull_perimeter, ellipse = np.empty(len(chunk)), np.empty((len(chunk), 3))
+        if known.any():
+            pos = great_50_pos[start:start + chunk_rows][known]
+            hull_perimeter[known], ellipse[known] = geometry[0][pos], geometry[1][pos]
+        hull_perimeter[~known], ellipse[~known] = pore_geometry(
+            chunk.points, chunk.ring_offsets, chunk.ring_start[~known], chunk.ring_stop[~known]
+        )
+
+        # Zero perimeters (single point contours) and untraced pores give NaN
+        with np.errstate(divide="ignore", invalid="ignore"):
+            morpho = compute_morphometrics(chunk, calibration, (hull_perimeter, ellipse))
+
+        columns = {name: morpho[name] for name, _ in PORE_TABLE_COLUMNS if name in morpho}
+        columns["num_children"] = chunk.num_children
+        for i, name in enumerate(("bbox_x", "bbox_y", "bbox_w", "bbox_h")):
+            columns[name] = chunk.bbox[:, i]
+        columns["great_50"] = great_50[start:start + chunk_rows]
+
+        # Class labels
+        columns["shape_class"] = classify(morpho["shape"], shapes)
+        irregularity = morpho["irregularity"]
+        columns["irregularity_class"] = np.where(
+            np.isnan(irregularity), -1, np.searchsorted(IRREGULARITY_LIMITS, irregularity, side="left")
+        )
+        for family, metric in SIZE_METRICS.items():
+            columns[family + "_class"] = classify(morpho[metric], families[family])
+        yield {name: np.ascontiguousarray(values) for name, values in columns.items()}
+
+
+def pore_table_schema(shapes=SHAPES, sizes=SIZES):
+    """Arrow schema of the pore table"""
+    label = pa.dictionary(pa.int8(), pa.string())
+    fields = [pa.field("mosaic", pa.dictionary(pa.int32(), pa.string()))]
+    fields += [pa.field(name, pa.from_numpy_dtype(dtype)) for name, dtype in PORE_TABLE_COLUMNS]
+    fields += [pa.field(name, label) for name in pore_table_labels(shapes, sizes)]
+    return pa.schema(fields)
+
+
+def _record_batch(schema, mosaic_name, columns, labels):
+    # Arrow arrays of a chunk; numeric columns wrap the NumPy buffers
+    num = len(columns["idx"])
+    arrays = [pa.DictionaryArray.from_arrays(pa.array(np.zeros(num, dtype=np.int32)), pa.array([mosaic_name]))]
+    arrays += [pa.array(columns[name].astype(dtype, copy=False)) for name, dtype in PORE_TABLE_COLUMNS]
+    for name, class_names in labels.items():
+        codes = columns[name].astype(np.int8)
+        arrays.append(pa.DictionaryArray.from_arrays(
+            pa.array(codes, mask=codes < 0), pa.array(class_names, type=pa.string())
+        ))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def write_pore_table(filename, mosaic_name, contours, calibration, area_50, geometry=None,
+                     shapes=SHAPES, sizes=SIZES, row_group_rows=PORE_TABLE_ROW_GROUP):
+    """
+    Write the pore table of a mosaic (see the module docstring).
+
+    The format is given by the extension of filename (.parquet or .arrow).
+
+    Args:
+        filename: Output file (see pore_table_path)
+        mosaic_name: Name of the mosaic (value of the "mosaic" column)
+        contours, calibration, area_50, geometry, shapes, sizes: See iter_pore_columns
+        row_group_rows: Pores per row group
+
+    Raises:
+        ImportError: If pyarrow is not installed
+        FileExistsError: If filename already exists
+    """
+    if pa is None:
+        raise ImportError("Writing the pore table needs the pyarrow package (pip install pyarrow)")
+    file_format = os.path.splitext(filename)[1].lstrip(".").lower()
+    if file_format not in PORE_TABLE_FORMATS:
+        raise ValueError(f"Unknown pore table format '{file_format}'")
+    if os.path.exists(filename):
+        raise FileExistsError(f"Pore table already exist: '{filename}'")
+
+    schema = pore_table_schema(shapes, sizes)
+    labels = pore_table_labels(shapes, sizes)
+    if file_format == "parquet":
+        writer = pq.ParquetWriter(filename, schema)
+        write = lambda batch: writer.write_table(pa.Table.from_batches([batch]), row_group_size=row_group_rows)
+    else:
+        writer = pa.ipc.new_file(filename, schema)
+        write = writer.write_batch
+    try:
+        for columns in iter_pore_columns(contours, calibration, area_50, geometry, shapes, sizes, row_group_rows):
+            write(_record_batch(schema, mosaic_name, columns, labels))
+    except BaseException:
+        # No partial tables are left behind
+        writer.close()
+        os.remove(filename)
+        raise
+    writer.close()
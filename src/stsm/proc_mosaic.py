@@ -1,72 +1,160 @@
+import os
 import cv2
 from tkinter import messagebox
 import numpy as np
 import math as m
+from tiled_contours import find_contour_groups, find_contour_groups_tiled, TILE_SIZE
+from pore_labels import label_pores, trace_pores
+from contour_table import ContourTable
+from overlays import ContourOverlay
+from morphometrics import SHAPES, SIZES, compute_morphometrics, fit_ellipses, pore_geometry, pore_geometry_parallel, segment_pores
+from pore_io import is_valid_shape_size
+from instrumentation import stage, timed
 
-def process_mosaic(self, image):
+# Mosaics larger than this (pixels) are processed in tiles by the Processing tab
+TILED_MIN_PIXELS = 8192 * 8192
+
+# Default diameter cut-offs (micron) of the cumulative pore size table
+DIAMETER_CUTOFFS = (50, )
+
+# Below this number of pores > 50 micron the morphometrics run serially
+# (starting the worker processes costs more than it saves)
+PARALLEL_MORPHO_MIN_PORES = 2000
+
+def to_binary(image):
+    """Return a single channel binary version of a loaded mosaic (or ROI of it)"""
+    # Check if the image is color (3 channels) or grayscale (1 channel)
+    if len(image.shape) == 3:
+        # Convert to grayscale for processing
+        gray_image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    else:
+        # Image is already grayscale
+        gray_image = image
+
+    # Check if the image is already binary (only contains 0 and 255 values)
+    unique_values = np.unique(gray_image)
+    if len(unique_values) <= 2 and np.all(np.isin(unique_values, [0, 255])):
+        # Image is already binary, no need to threshold
+        return gray_image
+
+    # Apply thresholding to ensure binary image
+    _, binary_image = cv2.threshold(gray_image, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    return binary_image
+
+def process_binary_mosaic(self, image, calibration, tile_size=None, workers=None, border_size=1,
+                          backend="contours", trace_all=True, morpho_workers=None, region=None, rect=None,
+                          cache=None):
+    """
+    Run the pore analysis of a binary mosaic without touching the GUI.
+
+    `self` only needs to accept attributes, so the same pipeline runs for the
+    Processing tab and for the headless batch engine (see batch.py).
+
+    With a ProcessedRegion holding `rect`, the pores are taken from it (only
+    the ones cut by the border of rect are traced again) and so are the convex
+    hull perimeters already measured; the results are those of processing the
+    image from scratch.
+
+    With a ResultCache, the results of an image already processed with the
+    same calibration and settings are read from it, skipping the contour
+    extraction and the morphometrics; new results are stored in it.
+
+    Args:
+        image: Binary mosaic (single channel, 0/255)
+        calibration: Pixel calibration (pixel/micron)
+        tile_size, workers, border_size, backend: Contour extraction settings
+            (see enhanced_process_mosaic_optimized)
+        trace_all: With the components backend, False only traces the pores
+            larger than 50 micron (the ones that need shape metrics)
+        morpho_workers: Processes for the morphometrics (see proc_cont_great_50)
+        region: Optional ProcessedRegion the image was cropped from (see processed_region.py)
+        rect: (x0, y0, x1, y1) of the image in the mosaic (default: the whole image)
+        cache: Optional ResultCache (see result_cache.py)
+    """
     # Store the image for further analysis
     self.image = image
-    
-    # Call the optimized contour processing function
-    processed_contours = enhanced_process_mosaic_optimized(image)
 
-    # Store the processed contours for further analysis
-    self.processed_contours = processed_contours
-    
     # Segmenting contours by diameter less than 50 micron
     # Converting diameter to pixels using the pixel calibration value
-    self.calibration = float(self.pixel_cal_input.get())
-    D_pix = 50 * self.calibration
-    
-    # Calculate the area of the circle with diameter D_pix
-    self.area_50 = round(np.pi * (D_pix/2)**2)
-    
-    # Create copies of the original image for drawing contours
-    all_contours_image = image.copy()
-    small_contours_image = image.copy()
-    large_contours_image = image.copy()
-    
-    # Convert to BGR for colored contours
-    all_contours_image = cv2.cvtColor(all_contours_image, cv2.COLOR_GRAY2BGR)
-    small_contours_image = cv2.cvtColor(small_contours_image, cv2.COLOR_GRAY2BGR)
-    large_contours_image = cv2.cvtColor(large_contours_image, cv2.COLOR_GRAY2BGR)
-    
-    # Prepare lists for small and large contours
-    small_contours = []
-    large_contours = []
-    all_contours = []
-    
-    # Collect all contours (parents and children)
-    for idx, is_edge, parent, children, area, perimeter in processed_contours:
-        all_contours.append(parent)
-        all_contours.extend(children)
-        
-        if area <= self.area_50:
-            small_contours.append(parent)
-            small_contours.extend(children)
-        else:
-            large_contours.append(parent)
-            large_contours.extend(children)
-    
-    # Draw all contours on the original image
-    cv2.drawContours(all_contours_image, all_contours, -1, (0, 0, 255), 2)  # Red color for all contours
-    
-    # Draw the contours on the small contours image
-    cv2.drawContours(small_contours_image, small_contours, -1, (255, 0, 0), 2)  # Blue color
-    
-    # Draw the contours on the large contours image
-    cv2.drawContours(large_contours_image, large_contours, -1, (0, 255, 0), 2)  # Green color
-    
-    # Clear previous images
-    self.proc_images = []
-    
-    # Add the processed images to the images list in the desired order
-    # First: Small contours
-    self.proc_images.append(small_contours_image)
-    # Second: Large contours
-    self.proc_images.append(large_contours_image)
-    # Third (last): Original with all contours
-    self.proc_images.append(all_contours_image)
+    self.calibration = float(calibration)
+
+    # Calculate the area of the circle with a diameter of 50 micron
+    self.area_50 = diameter_to_area(50, self.calibration)
+
+    if rect is None:
+        rect = (0, 0, image.shape[1], image.shape[0])
+    if cache is not None:
+        with stage("cache_get"):
+            key = cache.key(image, rect, self.calibration, (border_size, backend, trace_all))
+            cached = cache.get(key)
+        if cached is not None:
+            self.processed_contours, self.pore_geometry, self.morphometrics = cached
+            # Rows of the region, unknown for a cached crop of it
+            num = len(self.processed_contours)
+            self.region_rows = np.arange(num) if region is None else np.full(num, -1)
+            proc_cont_all(self)
+            segment_great_50(self)
+            return
+
+    known_hulls = None
+    if region is None:
+        # Call the optimized contour processing function
+        self.processed_contours = enhanced_process_mosaic_optimized(
+            image, tile_size, workers, border_size, backend, None if trace_all else self.area_50
+        )
+        self.region_rows = np.arange(len(self.processed_contours))
+    else:
+        # Pores of the region inside rect, plus the pieces of the cut ones
+        with stage("region_crop") as s:
+            self.processed_contours, self.region_rows = region.crop(rect)
+            bbox = self.processed_contours.bbox
+            self.processed_contours.is_edge = edge_flags(bbox[:, :2], bbox[:, :2] + bbox[:, 2:] - 1, image.shape, border_size)
+            known_hulls = region.hull_perimeters(self.region_rows[self.processed_contours.area > self.area_50])
+            s.items = len(self.processed_contours)
+
+    proc_cont_all(self)
+    proc_cont_great_50(self, morpho_workers, known_hulls)
+
+    if cache is not None:
+        with stage("cache_put"):
+            cache.put(key, self.processed_contours, self.pore_geometry, self.morphometrics)
+
+def analyse_mosaic(self, image, calibration, region=None, rect=None, cache=None):
+    """
+    Pore analysis of the Processing tab, without touching the GUI (it runs
+    on the background worker, see roi.process_selected_roi): in tiles for
+    large mosaics, or from a region already processed, or from the result
+    cache (see process_binary_mosaic).
+    """
+    tile_size = TILE_SIZE if image.shape[0] * image.shape[1] > TILED_MIN_PIXELS else None
+    process_binary_mosaic(self, image, calibration, tile_size, morpho_workers=os.cpu_count(),
+                          region=region, rect=rect, cache=cache)
+
+
+def process_mosaic(self, image, region=None, rect=None):
+    # Find the pores and compute their stats, then make the contour layers
+    analyse_mosaic(self, image, self.pixel_cal_input.get(), region, rect, self.result_cache)
+    make_contour_layers(self)
+
+
+def make_contour_layers(self):
+    """Contour layers of the Processing tab from the analysed mosaic (self.image)"""
+    image = self.image
+    processed_contours = self.processed_contours
+    
+    # Split the pores by size; the layers keep these row sets and draw them
+    # over the binary image only when displayed or saved (see overlays.py)
+    is_small = processed_contours.area <= self.area_50
+    
+    # Add the layers in the desired order
+    self.proc_images = [
+        # First: Small contours, blue
+        ContourOverlay(image, processed_contours[is_small], (255, 0, 0)),
+        # Second: Large contours, green
+        ContourOverlay(image, processed_contours[~is_small], (0, 255, 0)),
+        # Third (last): Original with all contours, red
+        ContourOverlay(image, processed_contours, (0, 0, 255)),
+    ]
     
     # Update the layer names to reflect the new order
     self.proc_layer_names = ["Pore \u2264 50μm", "Pore > 50μm", "All Contours"]
@@ -74,13 +162,52 @@ def process_mosaic(self, image):
     # Set the default layer order to show the original with all contours on top
     self.proc_layer_order = [0, 1, 2]  # This keeps the order as is, with all contours last/top
 
-    proc_cont_all(self)
-    proc_cont_great_50(self)
-
 #Contour edge detection function
+def contour_bounds(contours):
+    """
+    Bounding coordinates of many contours at once.
+
+    Args:
+        contours: List of contours
+
+    Returns:
+        (mins, maxs): (N, 2) arrays with the minimum and maximum (x, y) of each contour
+    """
+    if len(contours) == 0:
+        empty = np.zeros((0, 2), dtype=np.int32)
+        return empty, empty
+    # Concatenate all points and reduce them per contour in one pass
+    lengths = np.fromiter((len(c) for c in contours), dtype=np.int64, count=len(contours))
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    points = np.concatenate(contours).reshape(-1, 2)
+    return np.minimum.reduceat(points, starts, axis=0), np.maximum.reduceat(points, starts, axis=0)
+
+def edge_flags(mins, maxs, shape, border_size=1):
+    """
+    Flag the contours that reach the guard frame of the image.
+
+    A filled contour covers its own points, so it has pixels in the
+    `border_size` wide frame around the image if and only if its bounding
+    coordinates do.
+
+    Args:
+        mins, maxs: Bounding coordinates as returned by contour_bounds
+        shape: Shape of the image
+        border_size: Width of the frame to consider (default: 1 pixel)
+
+    Returns:
+        Boolean array, True for the contours touching the edge
+    """
+    height, width = shape[:2]
+    return (
+        (mins[:, 0] < border_size) | (mins[:, 1] < border_size) |
+        (maxs[:, 0] >= width - border_size) | (maxs[:, 1] >= height - border_size)
+    )
+
+@timed("edge_flags")
 def detect_edge_contours_optimized(image, contours, border_size=1):
     """
-    Efficiently identify which contours touch the edge of the image using optimized masks.
+    Efficiently identify which contours touch the edge of the image.
     
     Args:
         image: The original binary image
@@ -88,181 +215,159 @@ def detect_edge_contours_optimized(image, contours, border_size=1):
         border_size: Size of the border to consider (default: 1 pixel)
         
     Returns:
-        List of booleans indicating whether each contour touches the edge
+        Boolean array indicating whether each contour touches the edge
     """
-    height, width = image.shape[:2]
-    is_edge_contour = []
-    
-    # Create a small border mask for each edge of the image
-    left_edge = np.zeros((height, border_size), dtype=np.uint8)
-    left_edge.fill(255)
-    
-    right_edge = np.zeros((height, border_size), dtype=np.uint8)
-    right_edge.fill(255)
-    
-    top_edge = np.zeros((border_size, width), dtype=np.uint8)
-    top_edge.fill(255)
-    
-    bottom_edge = np.zeros((border_size, width), dtype=np.uint8)
-    bottom_edge.fill(255)
-    
-    for contour in contours:
-        # Get bounding rectangle of contour
-        x, y, w, h = cv2.boundingRect(contour)
-        
-        # Quick check if bounding box touches the edge
-        if x <= border_size or y <= border_size or x + w >= width - border_size or y + h >= height - border_size:
-            # Create a small mask just for the bounding rectangle (with padding)
-            padding = border_size + 1
-            x_start = max(0, x - padding)
-            y_start = max(0, y - padding)
-            x_end = min(width, x + w + padding)
-            y_end = min(height, y + h + padding)
-            
-            # Create a small mask just for the bounding rectangle area
-            small_mask = np.zeros((y_end - y_start, x_end - x_start), dtype=np.uint8)
-            
-            # Adjust contour coordinates for the smaller mask
-            adjusted_contour = contour - np.array([[x_start, y_start]])
-            cv2.drawContours(small_mask, [adjusted_contour], 0, 255, -1)
-            
-            # Check each edge that the bounding box might touch
-            touches_edge = False
-            
-            if x_start == 0:  # Left edge
-                edge_slice = left_edge[y_start:y_end, 0:min(border_size, small_mask.shape[1])]
-                if edge_slice.shape[1] > 0:  # Ensure the slice is not empty
-                    mask_slice = small_mask[:, 0:edge_slice.shape[1]]
-                    if np.any(cv2.bitwise_and(mask_slice, edge_slice)):
-                        touches_edge = True
-            
-            if not touches_edge and x_end == width:  # Right edge
-                edge_slice = right_edge[y_start:y_end, 0:min(border_size, small_mask.shape[1])]
-                if edge_slice.shape[1] > 0:
-                    mask_slice = small_mask[:, -edge_slice.shape[1]:]
-                    if np.any(cv2.bitwise_and(mask_slice, edge_slice)):
-                        touches_edge = True
-            
-            if not touches_edge and y_start == 0:  # Top edge
-                edge_slice = top_edge[0:min(border_size, small_mask.shape[0]), x_start:x_end]
-                if edge_slice.shape[0] > 0:
-                    mask_slice = small_mask[0:edge_slice.shape[0], :]
-                    if np.any(cv2.bitwise_and(mask_slice, edge_slice)):
-                        touches_edge = True
-            
-            if not touches_edge and y_end == height:  # Bottom edge
-                edge_slice = bottom_edge[0:min(border_size, small_mask.shape[0]), x_start:x_end]
-                if edge_slice.shape[0] > 0:
-                    mask_slice = small_mask[-edge_slice.shape[0]:, :]
-                    if np.any(cv2.bitwise_and(mask_slice, edge_slice)):
-                        touches_edge = True
-            
-            is_edge_contour.append(touches_edge)
-        else:
-            # Bounding box doesn't touch the edge, so contour definitely doesn't
-            is_edge_contour.append(False)
-    
-    return is_edge_contour
+    mins, maxs = contour_bounds(contours)
+    return edge_flags(mins, maxs, image.shape, border_size)
 
 # Contour processing function with optimized edge detection and flags
-def enhanced_process_mosaic_optimized(image):
-    """Process the loaded mosaic image with optimized edge detection"""
-    # Find contours with hierarchy
-    contours, hierarchy = cv2.findContours(image, cv2.RETR_CCOMP, cv2.CHAIN_APPROX_SIMPLE)
+@timed("contours")
+def enhanced_process_mosaic_optimized(image, tile_size=None, workers=None, border_size=1, backend="contours",
+                                      trace_above=None):
+    """
+    Process the loaded mosaic image with optimized edge detection
+
+    Args:
+        image: Binary mosaic
+        tile_size: If given, extract the contours on tiles of this size in
+                   parallel (see tiled_contours.py) instead of in a single call
+        workers: Number of threads for the tiled extraction (default: all cores)
+        border_size: Width of the image frame that flags a pore as is_edge (default: 1 pixel)
+        backend: "contours" (areas from the contour polygons) or "components"
+                 (pixel-exact areas from a connected components labeling,
+                 see pore_labels.py; tile_size is not used)
+        trace_above: With the components backend, only trace the contours
+                     (and get the perimeter) of the pores with a larger area
+                     (default: trace all the pores)
+
+    Returns:
+        ContourTable with one row per parent contour
+    """
+    # Find contours with hierarchy, grouped as parents and their children
+    if backend == "components":
+        with stage("label_pores") as s:
+            pores = label_pores(image)
+            num = len(pores["area"])
+            s.items = num
+        with stage("trace_pores") as s:
+            rows = np.arange(num) if trace_above is None else np.flatnonzero(pores["area"] > trace_above)
+            parent_contours = [None] * num
+            children_contours = [[] for _ in range(num)]
+            for row, parent, child_contours in zip(rows, *trace_pores(pores, rows)):
+                parent_contours[row] = parent
+                children_contours[row] = child_contours
+            s.items = len(rows)
+        with stage("contour_table"):
+            processed_contours = ContourTable.from_contours(
+                parent_contours, children_contours,
+                area=pores["area"], num_children=pores["num_holes"], bbox=pores["bbox"]
+            )
+    elif backend != "contours":
+        raise ValueError(f"Unknown backend '{backend}'")
+    else:
+        with stage("find_contours") as s:
+            if tile_size:
+                parent_contours, children_contours = find_contour_groups_tiled(image, tile_size, workers=workers)
+            else:
+                parent_contours, children_contours = find_contour_groups(image)
+            s.items = len(parent_contours)
+        # Final area (parent - children) and perimeter (parent + children) are
+        # computed for all the contours at once
+        with stage("contour_table"):
+            processed_contours = ContourTable.from_contours(parent_contours, children_contours)
     
     # Check if contours were found
-    if len(contours) == 0 or hierarchy is None:
+    if len(processed_contours) == 0:
         print("No contours found in the image.")
-        return []
-    
-    # Flatten hierarchy array for easier access
-    hierarchy = hierarchy[0]
+        return processed_contours
     
-    # Find all parent contours (those with no parent)
-    parent_indices = [i for i, h in enumerate(hierarchy) if h[3] == -1]
-    parent_contours = [contours[i] for i in parent_indices]
-    
-    # Detect which parent contours touch the edge using optimized method
-    is_edge_contour = detect_edge_contours_optimized(image, parent_contours)
-    
-    # Create a list to store processed contours with their properties and hierarchy
-    # Format: [idx, is_edge, parent_contour, [child_contours], final_area, final_perimeter]
-    processed_contours = []
-
-    for idx, (parent_idx, is_edge) in enumerate(zip(parent_indices, is_edge_contour)):
-        # Take a parent contour
-        parent = contours[parent_idx]
-        
-        # Calculate initial area and perimeter for the parent
-        parent_area = cv2.contourArea(parent)
-        parent_perimeter = cv2.arcLength(parent, True)
-        
-        # Find all children of this parent
-        child_idx = hierarchy[parent_idx][2]  # First child #I THINK HERE IS MY ERROR!!!
-        children_area = 0
-        children_perimeter = 0
-        child_contours = []
-        
-        # Process all children
-        while child_idx != -1:
-            child_contour = contours[child_idx]
-            child_contours.append(child_contour)
-            children_area += cv2.contourArea(child_contour)
-            children_perimeter += cv2.arcLength(child_contour, True)
-            
-            # Move to the next child at the same level
-            child_idx = hierarchy[child_idx][0]
-        
-        # Calculate final area and perimeter
-        final_area = parent_area - children_area
-        final_perimeter = parent_perimeter + children_perimeter
-        
-        # Add to processed contours list
-        processed_contours.append([
-            idx,
-            is_edge,  # Edge flag
-            parent,
-            child_contours,
-            final_area,
-            final_perimeter
-        ])
-        
+    # Detect which parent contours touch the edge from their bounding boxes
+    with stage("edge_flags", len(processed_contours)):
+        bbox = processed_contours.bbox
+        processed_contours.is_edge = edge_flags(bbox[:, :2], bbox[:, :2] + bbox[:, 2:] - 1, image.shape, border_size)
     
     return processed_contours
 
-def proc_cont_all(self):
+def diameter_to_area(diameter, calibration):
+    """Area (pixels) of a circular pore of `diameter` micron, rounded as area_50"""
+    return round(m.pi * (diameter * calibration / 2)**2)
+
+def pore_size_table(areas, num_children, cutoff_areas):
+    """
+    Cumulative pore size table from a single sort of the pore areas.
+
+    Args:
+        areas: Area of every pore (pixels)
+        num_children: Number of children (holes) of every pore
+        cutoff_areas: Increasing area cut-offs (pixels)
+
+    Returns:
+        Dict of arrays with one entry per cut-off, for the pores with area <= cut-off:
+            "num_parents": number of pores
+            "num_children": number of their children
+            "area": their total area
+    """
+    # Sort the pores by area once and accumulate counts and areas in that order
+    order = np.argsort(areas, kind="stable")
+    cum_area = np.concatenate(([0.0], np.cumsum(areas[order])))
+    cum_children = np.concatenate(([0], np.cumsum(num_children[order], dtype=np.int64)))
+
+    # Number of pores with area <= each cut-off
+    counts = np.searchsorted(areas[order], cutoff_areas, side="right")
+    return {
+        "num_parents": counts,
+        "num_children": cum_children[counts],
+        "area": cum_area[counts],
+    }
+
+@timed("global_stats")
+def proc_cont_all(self, diameters=DIAMETER_CUTOFFS):
+    """
+    Global stats of the processed contours.
+
+    Sets self.summary (totals and the split at 50 micron) and
+    self.pore_size_table, the cumulative table at each diameter cut-off.
+
+    Args:
+        diameters: Diameter cut-offs (micron) of the pore size table
+
+    Returns:
+        self.pore_size_table: dict of arrays with one entry per cut-off (in
+        increasing order): "diameter", "area_px" (cut-off area in pixels),
+        "num_parents", "num_children" and "area" of the pores with area <= cut-off,
+        and "fraction" of the total pore area
+    """
     #TOTALS
     # Calculate the area of the image in pixels
     image_area = np.shape(self.image)[0] * np.shape(self.image)[1]
-    
-    # Calculate the number of parent contours (with or whitout children)
-    num_parent_contours = len(self.processed_contours)
 
-    # Calculate the number of child contours
-    num_child_contours = sum([len(contour[3]) for contour in self.processed_contours])
-    
-    # Calculathe the total area of all contours
-    cont_total_area = sum([contour[4] for contour in self.processed_contours])
- 
+    # Columns of the contour table
+    areas = self.processed_contours.area
+    num_children = self.processed_contours.num_children
+
+    # Cut-offs in pixels, plus the 50 micron one of the summary and the
+    # total (every pore has area <= inf), all resolved in one pass
+    diameters = np.unique(np.asarray(diameters, dtype=np.float64))
+    cutoff_areas = [diameter_to_area(d, self.calibration) for d in diameters]
+    table = pore_size_table(areas, num_children, cutoff_areas + [self.area_50, np.inf])
+
+    # Calculate the number of parent contours (with or whitout children),
+    # the number of child contours and the total area of all contours
+    num_parent_contours = int(table["num_parents"][-1])
+    num_child_contours = int(table["num_children"][-1])
+    cont_total_area = float(table["area"][-1])
+
     #LESS THAN 50 micron
-    # Calculate the number of parent contours with area greater than 50 micron
-    num_parent_contours_less_50 = sum([1 for contour in self.processed_contours if contour[4] <= self.area_50])
+    # Parent and child contours and total area of contours with diameter less than 50 micron
+    num_parent_contours_less_50 = int(table["num_parents"][-2])
+    num_child_contours_less_50 = int(table["num_children"][-2])
+    cont_total_area_less_50 = float(table["area"][-2])
 
-    # Calculate the number of child contours with area greater than 50 micron
-    num_child_contours_less_50 = sum([len(contour[3]) for contour in self.processed_contours if contour[4] <= self.area_50])
-    
-    # Calculate the total area of contours with diameter less than 50 micron
-    cont_total_area_less_50 = sum([contour[4] for contour in self.processed_contours if contour[4] <= self.area_50])
-    
     #GREATHER THAN 50 micron
-    # Calculate the number of parent contours with area greater than 50 micron
-    num_parent_contours_great_50 = sum([1 for contour in self.processed_contours if contour[4] > self.area_50])
-
-    # Calculate the number of child contours with area greater than 50 micron
-    num_child_contours_great_50 = sum([len(contour[3]) for contour in self.processed_contours if contour[4] > self.area_50])
-    
-    # Calculate the total area of contours with diameter greather than 50 micron
-    cont_total_area_great_50 = sum([contour[4] for contour in self.processed_contours if contour[4] > self.area_50])
+    # The complement of the pores less than 50 micron
+    num_parent_contours_great_50 = num_parent_contours - num_parent_contours_less_50
+    num_child_contours_great_50 = num_child_contours - num_child_contours_less_50
+    cont_total_area_great_50 = cont_total_area - cont_total_area_less_50
     #------------------------------------------------
 
     #Summary of the results to be appended as a new row to a Excel file (using openpyxl)
@@ -278,110 +383,72 @@ def proc_cont_all(self):
         cont_total_area_great_50 / cont_total_area,  # Percentage of pores less than 50 micron
     )
 
+    # Cumulative pore size table at the requested cut-offs
+    self.pore_size_table = {
+        "diameter": diameters,
+        "area_px": np.asarray(cutoff_areas, dtype=np.float64),
+        "num_parents": table["num_parents"][:-2],
+        "num_children": table["num_children"][:-2],
+        "area": table["area"][:-2],
+        "fraction": table["area"][:-2] / cont_total_area if cont_total_area else np.zeros(len(diameters)),
+    }
+    return self.pore_size_table
+
     
     
-def proc_cont_great_50(self):
+def measure_pores(table, workers=None):
+    """pore_geometry of a table, on a process pool when there are enough pores"""
+    if workers and workers > 1 and len(table) >= PARALLEL_MORPHO_MIN_PORES:
+        return pore_geometry_parallel(table, workers)
+    return pore_geometry(table.points, table.ring_offsets, table.ring_start, table.ring_stop)
+
+@timed("morphometrics")
+def proc_cont_great_50(self, workers=None, known_hulls=None):
+    """
+    Morphometrics and shape-size segmentation of the pores larger than 50 micron.
+
+    With `workers` > 1 and enough pores, the convex hulls and ellipse fits run
+    on a process pool (see pore_geometry_parallel); results are the same.
+
+    Sets self.shapes, self.sizes, self.morphometrics (dict of descriptor
+    arrays, see compute_morphometrics), self.pore_geometry (convex hull
+    perimeter and ellipse of these pores, see pore_geometry) and
+    self.processed_cont_great_50_sz (SegmentedPores, read as {(shape name, size name): [rows]}).
+
+    Args:
+        workers: Processes for the convex hulls and ellipse fits
+        known_hulls: Optional convex hull perimeters of these pores, NaN for
+            the ones to measure (see ProcessedRegion.hull_perimeters); the
+            ellipses of the others are still fitted, see fit_ellipses
+    """
     # Segment contours (pores from now on...) with an area greather than the area of a pore with a diameter of 50 micron
-    processed_cont_great_50= [
-        [
-            cont[0], #id
-            cont[1], #is_edge
-            cont[4], #area
-            cont[5], #perimeter
-            S := 4 * m.pi * cont[4] / cont[5]**2, #Shape = 4 pi area / perimeter^2
-            #C := float(4 * m.pi * (cv2.contourArea(cv2.convexHull(cont[2])) -
-            #                 np.sum([cv2.contourArea(cv2.convexHull(contch)) for contch in cont[3]]))/cont[5]**2), #Convex Shape = 4 pi Convex_area / perimeter^2
-            #(Corrected) Convex Shape = 4 pi area / Convex_perimeter^2 
-            # adapted from Ringrose-Voase 1991, Micromorphology of Soil Structure:
-            #Description, Quantification, Application, Eq. 2
-            C := float(4 * m.pi * cont[4] / (cv2.arcLength(cv2.convexHull(cont[2]), True) + 
-                             np.sum([cv2.arcLength(cv2.convexHull(contch), True) for contch in cont[3]]))**2), 
-            m.sqrt(S**2 + C**2)/m.sqrt(2), #Pore elongation
-            m.atan(S/C)*180/m.pi, #Pore irragularity (deg)
-            2 * m.sqrt(cont[4] / m.pi) / self.calibration, #Equivalent diameter = 2 sqrt(area / pi) / self.calibration
-            cv2.fitEllipse(cont[2])[1][0], #Ellipse minor diameter
-            cv2.fitEllipse(cont[2])[1][1], #Ellipse major diameter
-            cv2.fitEllipse(cont[2])[2], # Ellipse angle
-            (cont[5] - m.sqrt(cont[5]**2 - 16 * cont[4]))/4 if S < m.pi / 4 else None,  # Rectangle minor side
-            (cont[5] + m.sqrt(cont[5]**2 - 16 * cont[4]))/4 if S < m.pi / 4 else None #Rectangle major side
-            ] 
-                for cont in self.processed_contours if cont[4] > self.area_50]
-        
-    # Shapes of interest are defined in a dictionary with min and max values
-    self.shapes = [
-        {"name": "circ", "min": 0.8, "max": 1}, # Circular
-        {"name": "MLcirc", "min": 0.5, "max": 0.8}, # More or Less circular
-        {"name": "shpless", "min": 0.2, "max": 0.5}, # Shapeless
-        {"name": "elongated", "min": 0.0, "max": 0.2}, # Elongated 
-    ]
+    pores_great_50 = self.processed_contours[self.processed_contours.area > self.area_50]
 
-    # Sizes of interest are defined in a dictionary with min and max values
-    self.sizes = [
-        {"name": "edS", "min": 0, "max": 50},           # ed -> Equivalent diameter;        S -> small
-        {"name": "edM", "min": 50, "max": 300},         #                                   M -> medium
-        {"name": "edL", "min": 300, "max": 1000},       #                                   L -> large
-        {"name": "edXL", "min": 1000, "max": 100000},    #                                   XL -> extra earge
-        {"name": "emdS", "min": 0, "max": 50},          # emd -> Ellipse minor diameter;    S -> small
-        {"name": "emdM", "min": 50, "max": 300},        #                                   M -> medium
-        {"name": "emdL", "min": 300, "max": 1000},      #                                   L -> large
-        {"name": "emdXL", "min": 1000, "max": 100000},   #                                   XL -> extra earge   
-        {"name": "rmsS", "min": 0, "max": 50},          # rms -> Rectangle minor side;         S -> small
-        {"name": "rmsM", "min": 50, "max": 300},        #                                   M -> medium
-        {"name": "rmsL", "min": 300, "max": 1000},      #                                   L -> large
-        {"name": "rmsXL", "min": 1000, "max": 100000},   #                                   XL -> extra earge
-    ]                            
+    # Every descriptor is computed once per pore
+    with stage("pore_geometry", len(pores_great_50)):
+        if known_hulls is None:
+            self.pore_geometry = measure_pores(pores_great_50, workers)
+        else:
+            missing = np.isnan(known_hulls)
+            hull_perimeter, ellipse = known_hulls.copy(), np.zeros((len(pores_great_50), 3))
+            hull_perimeter[missing], ellipse[missing] = measure_pores(pores_great_50[missing], workers)
+            ellipse[~missing] = fit_ellipses(pores_great_50[~missing])
+            self.pore_geometry = hull_perimeter, ellipse
+    with stage("descriptors", len(pores_great_50)):
+        self.morphometrics = compute_morphometrics(pores_great_50, self.calibration, self.pore_geometry)
 
-    # All the results segmented according shape an size are stored in a dict
-    self.processed_cont_great_50_sz = {}
+    segment_great_50(self)
 
-    # Pores are segmented according the defined shape-size combinations.
-    for shape in self.shapes:
-        for size in self.sizes:
-            # Skip invalid shape-size combinations
-            if (
-                (shape["name"] != "elongated" and size["name"] in ["edS", "edM", "edL", "edXL"]) or
-                (shape["name"] != "circ" and size["name"] in ["emdS", "emdM", "emdL", "emdXL"]) or
-                ((shape["name"] not in ["circ", "MLcirc"]) and size["name"] in ["rmsS", "rmsM", "rmsL", "rmsXL"])
-            ):
-                for cont in processed_cont_great_50:
-                    # Determine the size metric based on shape and size
-                    size_metric = (
-                        cont[8] if size["name"] in ["edS", "edM", "edL", "edXL"] else #Equivalent diameter
-                        cont[9] if size["name"] in ["emdS", "emdM", "emdL", "emdXL"] else #Ellipse minor diameter
-                        cont[12] #Rectangle minor side
-                    )
-
-                    # Check if the contour matches the shape and size criteria
-                    if shape["min"] < cont[4] <= shape["max"] and size["min"] < size_metric <= size["max"]:
-                        # Use (shape["name"], size["name"]) as the key in the dictionary
-                        key = (shape["name"], size["name"])
-                        if key not in self.processed_cont_great_50_sz:
-                            self.processed_cont_great_50_sz[key] = []
-
-                        # Append the processed contour data to the dictionary
-                        self.processed_cont_great_50_sz[key].append([
-                            cont[0],  # idx
-                            str(cont[1]),  # is_edge
-                            cont[2],  # area
-                            cont[3],  # perimeter
-                            cont[4],  # Shape
-                            cont[5],  # Convex Shape
-                            cont[6],  # Pore elongation
-                            #Corrected pore irregularity categories 
-                            # according to Pagliai et al., 1984, EFFECTS OF ZERO AND CONVENTIONAL TILLAGE 
-                            # ON THE LENGTH AND IRREGULARITY OF ELONGATED PORES IN A CLAY LOAM SOIL UNDER VITICULTURE
-                            # Table II
-                            cont[7] if cont[7] <= m.atan(0.3)*180/m.pi else None, #if cont[7] <= 13.5 else None,  # Irregulars theta <= 13.5°
-                            cont[7] if m.atan(0.3)*180/m.pi < cont[7] <= m.atan(0.5)*180/m.pi else None, # if 13.5 < cont[7] <= 22.5 else None,  # Slightly irregulars
-                            cont[7] if m.atan(0.5)*180/m.pi < cont[7] <= m.atan(0.7)*180/m.pi else None, # if 22.5 < cont[7] <= 31.5 else None,  # Slightly regulars
-                            cont[7] if m.atan(0.7)*180/m.pi < cont[7] else None, #if 31.5 < cont[7] else "",  # Regulars
-                            size_metric,  # Size metric (Equivalent diameter, Ellipse minor diameter, etc.)
-                            None if size["name"] in ["edS", "edM", "edL", "edXL"] else #For circular shaped pores
-                            cont[10] if size["name"] in ["emdS", "emdM", "emdL", "emdXL"] else #Ellipse major diameter
-                            cont[13],  # Rectangle major side
-                            cont[11] if shape["name"] == "elongated" else None,  # Ellipse angle
-                        ])
+@timed("segment")
+def segment_great_50(self):
+    """Shape-size segmentation of self.morphometrics (sets self.shapes, self.sizes and self.processed_cont_great_50_sz)"""
+    # Shapes and sizes of interest are defined in dictionaries with min and max values
+    self.shapes = SHAPES
+    self.sizes = SIZES
 
+    # Pores are segmented according the defined shape-size combinations.
+    # All the results segmented according shape an size are stored in a dict
+    self.processed_cont_great_50_sz = segment_pores(self.morphometrics, self.shapes, self.sizes, is_valid_shape_size)
 
     # Example: Accessing the processed data
     #print(self.processed_cont_great_50_sz.get(("circ", "edM"), []))
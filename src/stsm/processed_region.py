@@ -0,0 +1,157 @@
+"""
+Reuse of the pores of a processed region for the ROIs selected inside it.
+
+The pores of image[y0:y1, x0:x1] are those of the whole region, except near
+the border of the rectangle:
+
+    - pores whose bbox lies inside the rectangle are the same pores, only
+      shifted (their contours, areas, perimeters and convex hull perimeters
+      do not change);
+    - pores cut by the border of the rectangle split into one or more pieces,
+      which are traced again on small windows around them.
+
+The binary image must be the same for the region and the ROI, so this only
+holds when the mosaic is already binary: an Otsu threshold computed on a
+different region would give a different image.
+"""
+import os
+import cv2
+import numpy as np
+from contour_table import ContourTable
+from tiled_contours import find_contour_groups
+
+
+class ProcessedRegion:
+    """
+    Binary image, pores and convex hull perimeters of a region processed from scratch.
+
+    Args:
+        key: Identity of the mosaic (see mosaic_key)
+        rect: (x0, y0, x1, y1) of the region in the mosaic
+        image: Binary image of the region
+        contours: ContourTable of the region
+    """
+
+    def __init__(self, key, rect, image, contours):
+        self.key = key
+        self.rect = tuple(int(v) for v in rect)
+        self.image = image
+        self.contours = contours
+        # Convex hull perimeter (see morphometrics.pore_geometry) of each
+        # pore, NaN until measured
+        self.hull_perimeter = np.full(len(contours), np.nan)
+
+    def covers(self, key, rect):
+        """True if rect (x0, y0, x1, y1) of mosaic `key` lies inside the region"""
+        x0, y0, x1, y1 = rect
+        rx0, ry0, rx1, ry1 = self.rect
+        return key == self.key and rx0 <= x0 < x1 <= rx1 and ry0 <= y0 < y1 <= ry1
+
+    def hull_perimeters(self, rows):
+        """
+        Convex hull perimeters already measured for some region rows.
+
+        Args:
+            rows: Region rows (-1 for pores that are not region pores)
+
+        Returns:
+            Array of perimeters, NaN for the pores still to be measured
+        """
+        hull_perimeter = np.full(len(rows), np.nan)
+        known = rows >= 0
+        hull_perimeter[known] = self.hull_perimeter[rows[known]]
+        return hull_perimeter
+
+    def store_hull_perimeters(self, rows, hull_perimeter):
+        """Keep the hull perimeters measured for some pores (rows -1 are skipped)"""
+        known = rows >= 0
+        self.hull_perimeter[rows[known]] = hull_perimeter[known]
+
+    def crop(self, rect):
+        """
+        Pores of the image cropped to rect (in mosaic coordinates), as
+        enhanced_process_mosaic_optimized finds them in the cropped image.
+
+        Args:
+            rect: (x0, y0, x1, y1), inside the region
+
+        Returns:
+            (contours, rows): ContourTable of the crop (coordinates relative to
+            it, is_edge not set) in findContours order, and the region row of
+            each of its pores (-1 for the pieces of the pores cut by the border)
+        """
+        # Rectangle in region coordinates
+        x0, y0 = rect[0] - self.rect[0], rect[1] - self.rect[1]
+        x1, y1 = rect[2] - self.rect[0], rect[3] - self.rect[1]
+        width, height = x1 - x0, y1 - y0
+        bx, by = self.contours.bbox[:, 0], self.contours.bbox[:, 1]
+        bx1, by1 = bx + self.contours.bbox[:, 2], by + self.contours.bbox[:, 3]
+
+        inside = (bx >= x0) & (by >= y0) & (bx1 <= x1) & (by1 <= y1)
+        cut = (bx < x1) & (bx1 > x0) & (by < y1) & (by1 > y0) & ~inside
+        kept = np.flatnonzero(inside)
+        kept_table = self.contours[kept].shifted(-x0, -y0)
+
+        # Pores inside that touch the border are also found around the cut
+        # ones: they are recognised by their start point (first contour point)
+        start_points = kept_table.points[kept_table.ring_offsets[kept_table.ring_start]].astype(np.int64)
+        kept_starts = set(map(tuple, start_points[_touches_frame(kept_table.bbox, width, height)].tolist()))
+
+        pieces = {}
+        for wx0, wy0, wx1, wy1 in _cut_windows(np.stack([bx, by, bx1, by1], axis=1)[cut], x0, y0, x1, y1):
+            window = np.ascontiguousarray(self.image[wy0:wy1, wx0:wx1])
+            for parent, children in zip(*find_contour_groups(window, offset=(wx0 - x0, wy0 - y0))):
+                px, py, pw, ph = cv2.boundingRect(parent)
+                # Blobs reaching the window edge away from the crop border
+                # belong to pores that continue outside the window
+                truncated = (
+                    (px == wx0 - x0 and wx0 > x0) or (py == wy0 - y0 and wy0 > y0) or
+                    (px + pw == wx1 - x0 and wx1 < x1) or (py + ph == wy1 - y0 and wy1 < y1)
+                )
+                start = tuple(int(v) for v in parent[0, 0])
+                if truncated or start in kept_starts or start in pieces:
+                    continue
+                if _touches_frame(np.array([[px, py, pw, ph]]), width, height)[0]:
+                    pieces[start] = (parent, children)
+
+        new_table = ContourTable.from_contours([p for p, _ in pieces.values()], [c for _, c in pieces.values()])
+        table = ContourTable.concatenate([kept_table, new_table])
+        rows = np.concatenate([kept, np.full(len(new_table), -1, dtype=np.int64)])
+
+        # findContours reports parents in reverse raster order of their start point
+        starts = table.points[table.ring_offsets[table.ring_start]].astype(np.int64)
+        order = np.lexsort((starts[:, 0], starts[:, 1]))[::-1]
+        table = table[order]
+        table.idx = np.arange(len(table), dtype=np.int64)
+        return table, rows[order]
+
+
+def _touches_frame(bbox, width, height):
+    # Boxes (x, y, w, h) reaching the outer rows or columns of a width x height image
+    return (bbox[:, 0] == 0) | (bbox[:, 1] == 0) | (bbox[:, 0] + bbox[:, 2] == width) | \
+        (bbox[:, 1] + bbox[:, 3] == height)
+
+
+def _cut_windows(boxes, x0, y0, x1, y1):
+    """
+    Windows to trace the pieces of the cut pores in.
+
+    Each window is the box of a cut pore clipped to the crop, grown by one
+    pixel so the pieces of that pore never reach its edge inside the crop.
+    If the windows add up to more than the crop, the crop is traced whole.
+    """
+    windows = np.empty((len(boxes), 4), dtype=np.int64)
+    windows[:, 0] = np.maximum(boxes[:, 0] - 1, x0)
+    windows[:, 1] = np.maximum(boxes[:, 1] - 1, y0)
+    windows[:, 2] = np.minimum(boxes[:, 2] + 1, x1)
+    windows[:, 3] = np.minimum(boxes[:, 3] + 1, y1)
+    total = np.sum((windows[:, 2] - windows[:, 0]) * (windows[:, 3] - windows[:, 1]))
+    if total >= (x1 - x0) * (y1 - y0):
+        return [(x0, y0, x1, y1)]
+    return [tuple(w) for w in windows.tolist()]
+
+
+def mosaic_key(path):
+    """Identity of a mosaic file: path, modification time and size"""
+    stat = os.stat(path)
+    return os.path.abspath(path), stat.st_mtime_ns, stat.st_size
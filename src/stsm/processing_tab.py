@@ -3,6 +3,7 @@ from tkinter import ttk
 from load_save import load_mosaic, save_proc_image, save_original_binary, save_mosaic_stats_data
 from display import update_proc_display
 from roi import confirm_roi, set_confirm_roi_button_visible
+from jobs import cancel_job
 
 def processing_tab(self):
     # Create a frame for controls
@@ -33,6 +34,24 @@ def processing_tab(self):
     )
     self.load_mosaic_button.pack(pady=5)
     
+    # Progress of the job running in the background (see jobs.py) and a
+    # button to cancel it
+    self.proc_status_var = tk.StringVar(value="")
+    self.proc_status_label = ttk.Label(
+        self.processing_frame_controls,
+        textvariable=self.proc_status_var,
+        foreground="gray"
+    )
+    self.proc_status_label.pack(pady=(0, 5))
+    
+    self.cancel_job_button = ttk.Button(
+        self.processing_frame_controls,
+        text="Cancel",
+        command= lambda: cancel_job(),
+        state=tk.DISABLED  # Enabled while a job runs
+    )
+    self.cancel_job_button.pack(pady=5)
+    
     # Create a button to confirm ROI selection
     self.confirm_roi_button = ttk.Button(
         self.processing_frame_controls,
@@ -0,0 +1,77 @@
+import threading
+import cv2
+import numpy as np
+
+# Levels are halved until their largest side is at most this (pixels)
+PYRAMID_MIN_SIDE = 512
+
+
+class ImagePyramid:
+    """
+    Multi-resolution pyramid of an image for zoomed-out rendering.
+
+    Level 0 is the image itself and level k is level k - 1 halved with
+    cv2.INTER_AREA (area averaging, so thin pores fade instead of vanishing as
+    with nearest neighbour decimation). Levels are built on first use, or all
+    of them in a background thread with build_async.
+
+    Args:
+        image: Full resolution image (NumPy array or ImageSource)
+        min_side: Smallest level size (largest side in pixels)
+    """
+
+    def __init__(self, image, min_side=PYRAMID_MIN_SIDE):
+        self.levels = [image]
+        self._lock = threading.Lock()
+        # Number of levels so that the coarsest one is about min_side
+        self.num_levels = 1
+        side = max(image.shape[:2])
+        while side > min_side:
+            side = (side + 1) // 2
+            self.num_levels += 1
+
+    def level_for_scale(self, scale):
+        """Coarsest level with at least `scale` resolution (scale = display px per image px)"""
+        level = 0
+        while level + 1 < self.num_levels and 2 ** (level + 1) * scale <= 1:
+            level += 1
+        return level
+
+    def get(self, level, wait=True):
+        """
+        Image of a level and its downsampling factor.
+
+        Args:
+            level: Level wanted
+            wait: Build the missing levels now; otherwise return the best level
+                  already built (never coarser than `level`)
+
+        Returns:
+            (image, factor): factor is 2 ** level of the returned level
+        """
+        level = min(level, self.num_levels - 1)
+        if wait:
+            self._build(level)
+        available = min(level, len(self.levels) - 1)
+        return self.levels[available], 2 ** available
+
+    def _build(self, level):
+        with self._lock:
+            while len(self.levels) <= level:
+                prev = self.levels[-1]
+                h, w = prev.shape[:2]
+                if isinstance(prev, np.ndarray):
+                    self.levels.append(cv2.resize(prev, ((w + 1) // 2, (h + 1) // 2), interpolation=cv2.INTER_AREA))
+                else:
+                    # Level 0 is an ImageSource: halved band by band
+                    self.levels.append(prev.downsample(2))
+
+    def build_async(self, on_done=None):
+        """Build every level in a background thread, then call on_done() (from that thread)"""
+        def worker():
+            self._build(self.num_levels - 1)
+            if on_done is not None:
+                on_done()
+        thread = threading.Thread(target=worker, daemon=True)
+        thread.start()
+        return thread
@@ -0,0 +1,190 @@
+"""
+Content-addressed on-disk cache of processed mosaics.
+
+An entry holds the contour table, the pore geometry and the morphometric
+arrays of one run of the pipeline, in a single uncompressed .npz file named
+after a hash of everything the results depend on: the binary pixels, the ROI
+rectangle, the calibration, the extraction settings and PIPELINE_VERSION.
+Reopening the same mosaic (or recovering from a crash before saving) then
+skips the contour extraction and the morphometrics.
+
+The cache is bounded in size: reading an entry touches its modification time
+and the least recently used entries are deleted when the total size goes
+over the limit. The GUI's cache (see default_cache) goes to STSM_CACHE_DIR
+(default ~/.cache/stsm), limited to STSM_CACHE_MAX_MB (default 2048);
+STSM_CACHE_MAX_MB=0 turns it off.
+"""
+import hashlib
+import os
+import tempfile
+import numpy as np
+from contour_table import ContourTable
+
+# Bump when a change of the pipeline changes its results, so old entries
+# are not used anymore
+PIPELINE_VERSION = 1
+
+# Default location and size limit, overridden by STSM_CACHE_DIR and
+# STSM_CACHE_MAX_MB
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "stsm")
+CACHE_MAX_BYTES = 2 * 1024 ** 3
+
+# Rows hashed at once (keeps the copies of non-contiguous ROIs small)
+HASH_BAND_ROWS = 1024
+
+
+def default_cache():
+    """The result cache of the GUI (see module docstring), or None if it is turned off"""
+    cache = ResultCache()
+    return cache if cache.enabled else None
+
+
+def image_digest(image):
+    """
+    SHA-1 digest of the pixels (and shape and dtype) of an image, read in bands.
+
+    SHA-1 is used for speed (it is hardware accelerated on most CPUs, about
+    twice as fast as BLAKE2b here); keys only need to tell images apart.
+    """
+    digest = hashlib.sha1()
+    digest.update(repr((image.shape, str(image.dtype))).encode())
+    for y0 in range(0, image.shape[0], HASH_BAND_ROWS):
+        digest.update(np.ascontiguousarray(image[y0:y0 + HASH_BAND_ROWS]).data)
+    return digest.digest()
+
+
+class ResultCache:
+    """
+    Size-bounded LRU cache of pipeline results on disk.
+
+    Args:
+        directory: Cache folder (default: STSM_CACHE_DIR or ~/.cache/stsm)
+        max_bytes: Size limit of the folder (default: STSM_CACHE_MAX_MB or 2 GB)
+    """
+
+    def __init__(self, directory=None, max_bytes=None):
+        self.directory = directory or os.environ.get("STSM_CACHE_DIR") or CACHE_DIR
+        if max_bytes is None:
+            max_mb = os.environ.get("STSM_CACHE_MAX_MB")
+            max_bytes = int(float(max_mb) * 1024 ** 2) if max_mb else CACHE_MAX_BYTES
+        self.max_bytes = max_bytes
+
+    @property
+    def enabled(self):
+        """False if the size limit is 0 (nothing is read or stored)"""
+        return self.max_bytes > 0
+
+    def key(self, image, rect, calibration, settings=()):
+        """
+        Key of the results of an image.
+
+        Args:
+            image: Binary image processed
+            rect: (x0, y0, x1, y1) of the image in the mosaic
+            calibration: Pixel calibration (pixel/micron)
+            settings: Other parameters the results depend on (e.g. border size)
+        """
+        digest = hashlib.sha1(image_digest(image))
+        digest.update(repr((PIPELINE_VERSION, tuple(int(v) for v in rect), float(calibration),
+                            tuple(settings))).encode())
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".npz")
+
+    def get(self, key):
+        """
+        Cached results, or None.
+
+        Returns:
+            (contours, geometry, morphometrics): ContourTable of all the pores,
+            (hull_perimeter, ellipse) and dict of morphometric arrays of the
+            pores larger than 50 micron
+        """
+        if not self.enabled:
+            return None
+        path = self._path(key)
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                contours = ContourTable(
+                    data["points"], data["ring_offsets"],
+                    **{name: data["c_" + name] for name in ContourTable.COLUMNS}
+                )
+                geometry = data["hull_perimeter"], data["ellipse"]
+                morphometrics = {name[2:]: data[name] for name in data.files if name.startswith("m_")}
+        except FileNotFoundError:
+            return None
+        except Exception:
+            # Truncated or unreadable entry: drop it
+            self._remove(path)
+            return None
+        # Mark as recently used
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return contours, geometry, morphometrics
+
+    def put(self, key, contours, geometry, morphometrics):
+        """
+        Store the results of a run, then evict old entries beyond the size limit.
+
+        The cache is best effort: if the entry cannot be written (e.g. full
+        disk), it is skipped.
+        """
+        if not self.enabled:
+            return
+        points, ring_offsets, pore_rings = contours.pack()
+        arrays = {
+            "points": points,
+            "ring_offsets": ring_offsets,
+            "hull_perimeter": geometry[0],
+            "ellipse": geometry[1],
+        }
+        for name in ContourTable.COLUMNS[:-2]:
+            arrays["c_" + name] = getattr(contours, name)
+        arrays["c_ring_start"], arrays["c_ring_stop"] = pore_rings[:-1], pore_rings[1:]
+        for name, values in morphometrics.items():
+            arrays["m_" + name] = values
+
+        # Written aside and renamed, so readers never see a partial entry
+        tmp_path = None
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, **arrays)
+            os.replace(tmp_path, self._path(key))
+        except OSError:
+            if tmp_path is not None:
+                self._remove(tmp_path)
+            return
+        self.evict()
+
+    def evict(self):
+        """Delete the least recently used entries until the cache fits its size limit"""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return
+        entries = []
+        for name in names:
+            if name.endswith(".npz"):
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime_ns, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self._remove(os.path.join(self.directory, name))
+            total -= size
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -1,9 +1,11 @@
 import tkinter as tk
-import cv2
-import numpy as np
+from types import SimpleNamespace
 from layer_controls import show_proc_layer_controls
 from display import update_proc_display
-from proc_mosaic import process_mosaic
+from proc_mosaic import analyse_mosaic, make_contour_layers, to_binary
+from processed_region import ProcessedRegion
+from instrumentation import stage
+from jobs import start_job
 
 def set_confirm_roi_button_visible(self, visible: bool):
     """Show/hide and enable/disable the Confirm ROI button safely.
@@ -47,9 +49,9 @@ def start_roi(self, event):
     x = event.x
     y = event.y
     
-    # Check if click is within the image
+    # Check if click is within the image (roi_scale maps original image pixels to the canvas)
     img_x, img_y = self.roi_image_pos
-    img_height, img_width = self.roi_image.shape[:2]
+    img_height, img_width = self.original_image.shape[:2]
     img_width_scaled = int(img_width * self.roi_scale)
     img_height_scaled = int(img_height * self.roi_scale)
     
@@ -119,7 +121,7 @@ def confirm_roi(self, event=None):
     orig_y2 = int(y2 / self.roi_scale)
     
     # Ensure coordinates are within image bounds
-    img_height, img_width = self.roi_image.shape[:2]
+    img_height, img_width = self.original_image.shape[:2]
     orig_x1 = max(0, orig_x1)
     orig_y1 = max(0, orig_y1)
     orig_x2 = min(img_width, orig_x2)
@@ -154,48 +156,79 @@ def exit_roi_mode(self):
     # Hide and disable the confirm ROI button
     set_confirm_roi_button_visible(self, False)
 
+def processing_controls(self):
+    """Processing tab controls disabled while a job runs in the background"""
+    return [self.load_mosaic_button, self.pixel_cal_input, self.confirm_roi_button,
+            self.save_small_contours_button, self.save_large_contours_button, self.save_all_contours_button,
+            self.save_mosaic_stats_data_button]
+
+
 def process_selected_roi(self, x1, y1, x2, y2):
-    """Process the selected ROI"""
+    """
+    Process the selected ROI in the background (see jobs.py).
+
+    The analysis runs on the worker, into a namespace of its own; the results
+    replace the ones shown only when it ends, so a cancelled job leaves them
+    as they were.
+    """
     if self.original_image is None:
         return
         
-    # Crop the original image to the selected ROI
-    roi_image = self.original_image[y1:y2, x1:x2].copy()
-    
-    # Check if the image is color (3 channels) or grayscale (1 channel)
-    if len(roi_image.shape) == 3:
-        # Convert to grayscale for processing
-        gray_roi = cv2.cvtColor(roi_image, cv2.COLOR_BGR2GRAY)
-        
-        # Check if the image is already binary (only contains 0 and 255 values)
-        unique_values = np.unique(gray_roi)
-        if len(unique_values) <= 2 and np.all(np.isin(unique_values, [0, 255])):
-            # Image is already binary, no need to threshold
-            binary_roi = gray_roi
+    rect = (x1, y1, x2, y2)
+    region = self.processed_region
+    if region is not None and not region.covers(self.mosaic_key, rect):
+        region = None
+    calibration = self.pixel_cal_input.get()
+    mosaic = self.original_image
+    
+    def work(job):
+        results = SimpleNamespace()
+        if region is not None:
+            # Inside the region processed last: reuse its binary image and pores
+            rx0, ry0 = region.rect[:2]
+            binary_roi = region.image[y1 - ry0:y2 - ry0, x1 - rx0:x2 - rx0]
+            roi_image = None
         else:
-            # Apply thresholding to ensure binary image
-            _, binary_roi = cv2.threshold(gray_roi, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-    else:
-        # Image is already grayscale
-        gray_roi = roi_image
+            # Read the selected ROI from the original image (only this region is loaded)
+            with stage("read_roi", (x2 - x1) * (y2 - y1)):
+                roi_image = mosaic[y1:y2, x1:x2]
+            
+            # Binarize the ROI (Otsu only if it is not binary yet)
+            with stage("threshold", (x2 - x1) * (y2 - y1)):
+                binary_roi = to_binary(roi_image)
         
-        # Check if the image is already binary (only contains 0 and 255 values)
-        unique_values = np.unique(gray_roi)
-        if len(unique_values) <= 2 and np.all(np.isin(unique_values, [0, 255])):
-            # Image is already binary, no need to threshold
-            binary_roi = gray_roi
-        else:
-            # Apply thresholding to ensure binary image
-            _, binary_roi = cv2.threshold(gray_roi, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-    
-    # Store the original binary image for later use
-    self.original_binary = binary_roi.copy()
-    
-    # Process the ROI to find contours
-    process_mosaic(self, binary_roi)
-    
-    # Show the layer controls now that we have images
-    show_proc_layer_controls(self)
+        # Process the ROI to find contours
+        with stage("process"):
+            analyse_mosaic(results, binary_roi, calibration, region, rect, self.result_cache)
+        return results, binary_roi, binary_roi is roi_image
+    
+    def on_done(result):
+        results, binary_roi, was_binary = result
+        vars(self).update(vars(results))
+        
+        # Store the original binary image for later use (never drawn on: the
+        # contour layers are rasterized separately)
+        self.original_binary = binary_roi
+        make_contour_layers(self)
+        
+        new_region = region
+        if new_region is None:
+            # Keep this region for the ROIs selected inside it later; only valid
+            # if the mosaic was binary already (no Otsu threshold of this ROI)
+            self.processed_region = None
+            if was_binary:
+                new_region = ProcessedRegion(self.mosaic_key, rect, binary_roi, self.processed_contours)
+        if new_region is not None:
+            # Remember the convex hull perimeters measured in this run
+            new_region.store_hull_perimeters(self.region_rows[self.processed_contours.area > self.area_50],
+                                             self.pore_geometry[0])
+            self.processed_region = new_region
+        
+        # Show the layer controls now that we have images
+        show_proc_layer_controls(self)
+        
+        # Update the display
+        update_proc_display(self)
     
-    # Update the display
-    update_proc_display(self)
\ No newline at end of file
+    start_job(self.root, "Processing", work, on_done, processing_controls(self), self.proc_status_var,
+              self.cancel_job_button)
@@ -0,0 +1,102 @@
+import numpy as np
+
+# Boxes spanning more grid cells than this are kept out of the grid and
+# checked one by one (a few huge pores would otherwise fill most cells)
+MAX_CELLS_PER_BOX = 64
+
+# Upper bound of the number of grid cells
+MAX_GRID_CELLS = 4 * 1024 * 1024
+
+
+class GridIndex:
+    """
+    Uniform grid over axis-aligned bounding boxes, for rectangle and point queries.
+
+    Every box is registered in the grid cells it overlaps; cells are stored
+    in CSR form (cell_start, items) so the whole index is a few NumPy arrays,
+    built without Python loops over the boxes.
+
+    Args:
+        bbox: (N, 4) array of (x, y, w, h) boxes
+        cell_size: Side of the grid cells in pixels (default: from the box sizes)
+    """
+
+    def __init__(self, bbox, cell_size=None):
+        bbox = np.asarray(bbox, dtype=np.int64).reshape(-1, 4)
+        self.x0, self.y0 = bbox[:, 0], bbox[:, 1]
+        # Inclusive right and bottom coordinates
+        self.x1 = bbox[:, 0] + np.maximum(bbox[:, 2], 1) - 1
+        self.y1 = bbox[:, 1] + np.maximum(bbox[:, 3], 1) - 1
+        num = len(bbox)
+
+        if cell_size is None:
+            # About the size of a typical box, so most boxes span 1-4 cells
+            cell_size = int(np.median(np.maximum(bbox[:, 2], bbox[:, 3]))) * 2 if num else 64
+        # Coarser cells for very large extents, to keep the index small
+        extent = (int(self.x1.max()) + 1) * (int(self.y1.max()) + 1) if num else 0
+        self.cell_size = max(16, int(cell_size), int(np.ceil(np.sqrt(extent / MAX_GRID_CELLS))))
+        self.cols = int(self.x1.max() // self.cell_size) + 1 if num else 1
+        self.rows = int(self.y1.max() // self.cell_size) + 1 if num else 1
+
+        cx0, cy0 = self.x0 // self.cell_size, self.y0 // self.cell_size
+        cx1, cy1 = self.x1 // self.cell_size, self.y1 // self.cell_size
+        span_x, span_y = cx1 - cx0 + 1, cy1 - cy0 + 1
+        spans = span_x * span_y
+        big = spans > MAX_CELLS_PER_BOX
+        self.big = np.flatnonzero(big)
+
+        # One (cell, box) entry per cell overlapped by each regular box
+        boxes = np.flatnonzero(~big)
+        counts = spans[boxes]
+        box_of_entry = np.repeat(boxes, counts)
+        # Position of each entry within the cells of its box
+        k = np.arange(len(box_of_entry)) - np.repeat(np.cumsum(counts) - counts, counts)
+        cell_x = cx0[box_of_entry] + k % span_x[box_of_entry]
+        cell_y = cy0[box_of_entry] + k // span_x[box_of_entry]
+        cells = cell_y * self.cols + cell_x
+
+        order = np.argsort(cells, kind="stable")
+        self.items = box_of_entry[order]
+        self.cell_start = np.searchsorted(cells[order], np.arange(self.rows * self.cols + 1))
+
+    def __len__(self):
+        return len(self.x0)
+
+    def query(self, x0, y0, x1, y1):
+        """
+        Boxes intersecting the rectangle [x0, x1) x [y0, y1).
+
+        Returns:
+            Sorted array of box positions
+        """
+        if x1 <= x0 or y1 <= y0 or len(self) == 0:
+            return np.zeros(0, dtype=np.int64)
+        cx0 = min(max(int(x0) // self.cell_size, 0), self.cols - 1)
+        cy0 = min(max(int(y0) // self.cell_size, 0), self.rows - 1)
+        cx1 = min(max(int(x1 - 1) // self.cell_size, 0), self.cols - 1)
+        cy1 = min(max(int(y1 - 1) // self.cell_size, 0), self.rows - 1)
+
+        # Entries of the cells of each grid row in the range are contiguous
+        row_cells = np.arange(cy0, cy1 + 1) * self.cols
+        starts = self.cell_start[row_cells + cx0]
+        stops = self.cell_start[row_cells + cx1 + 1]
+        candidates = np.concatenate([self.items[a:b] for a, b in zip(starts, stops)] + [self.big])
+        candidates = np.unique(candidates)
+
+        # Exact test (cells are coarser than the boxes)
+        hit = (
+            (self.x0[candidates] < x1) & (self.x1[candidates] >= x0) &
+            (self.y0[candidates] < y1) & (self.y1[candidates] >= y0)
+        )
+        return candidates[hit]
+
+    def query_point(self, x, y):
+        """
+        Boxes containing the point (x, y), smallest box first.
+
+        Returns:
+            Array of box positions
+        """
+        hits = self.query(x, y, x + 1, y + 1)
+        box_area = (self.x1[hits] - self.x0[hits] + 1) * (self.y1[hits] - self.y0[hits] + 1)
+        return hits[np.argsort(box_area, kind="stable")]
@@ -0,0 +1,546 @@
+"""
+Mosaic stitching: a grid of overlapping microscope tiles into one mosaic.
+
+    1. Registration: every pair of neighbouring tiles (right and bottom
+       neighbours) is registered by phase correlation, first on the
+       overlapping strips downsampled STITCH_DOWNSAMPLE times (robust to
+       large stage errors and cheap), then refined at full resolution on
+       the overlap found, with sub-pixel precision.
+    2. Placement: tile positions are solved by weighted least squares over
+       all the pairwise offsets (weighted by the phase correlation
+       response). Offsets with a low response (empty resin, blurred tiles)
+       or that disagree with the others by more than STITCH_MAX_RESIDUAL
+       pixels are replaced by the nominal stage offset, with a tiny weight
+       that keeps the grid connected.
+    3. Blending: the mosaic is assembled in blocks of STITCH_BLOCK pixels,
+       each one a feathered average of the tiles covering it (weights fall
+       linearly to the tile borders over the overlap), and streamed to a
+       .npy file (memory-mapped) or a tiled TIFF (needs tifffile), which
+       open_image_source reads without loading them.
+
+Registration and blending run on a thread pool (OpenCV decodes, correlates
+and resizes without the GIL); decoded tiles are kept in a small LRU cache,
+so only a couple of tile rows are in memory.
+
+The grid position of each tile is read from its file name when every name
+has one (e.g. tile_r003_c012.tif, row3_col12.png), otherwise the tiles are
+taken in name order, row by row (or in a snake: odd rows right to left)
+with the given number of columns.
+
+Usage:
+    python stitching.py TILES_DIR -o MOSAIC.npy --cols 40 [--overlap 0.1] [--order rows]
+                        [--downsample 4] [-w WORKERS]
+"""
+import argparse
+import csv
+import os
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+from instrumentation import stage
+
+try:
+    import tifffile
+except ImportError:  # Optional: mosaics are then written as .npy files
+    tifffile = None
+
+# Image files taken as tiles
+TILE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff")
+
+# Grid position in a tile file name: r<row>c<col>, row<row>_col<col>...
+TILE_NAME_PATTERN = re.compile(r"r(?:ow)?[_-]?(\d+)[_-]*c(?:ol)?[_-]?(\d+)", re.IGNORECASE)
+
+# Scan orders of tiles without positions in their names
+SCAN_ORDERS = ("rows", "snake")
+
+# Nominal overlap between neighbouring tiles (fraction of the tile side)
+STITCH_OVERLAP = 0.1
+
+# Downsampling of the strips of the coarse registration
+STITCH_DOWNSAMPLE = 4
+
+# Offsets with a lower phase correlation response are not trusted
+STITCH_MIN_RESPONSE = 0.05
+
+# Offsets farther (pixels) from the solved placement are not trusted
+STITCH_MAX_RESIDUAL = 3.0
+
+# Weight of the nominal offset of pairs that could not be registered
+NOMINAL_WEIGHT = 1e-3
+
+# Side of the blocks the mosaic is blended and written in (and TIFF tile side)
+STITCH_BLOCK = 1024
+
+
+def list_tiles(folder):
+    """Image files of a folder, in natural name order (tile_2 before tile_10)"""
+    names = [name for name in os.listdir(folder) if name.lower().endswith(TILE_EXTENSIONS)]
+    key = lambda name: [int(part) if part.isdigit() else part.lower() for part in re.split(r"(\d+)", name)]
+    return [os.path.join(folder, name) for name in sorted(names, key=key)]
+
+
+def tile_grid_positions(paths, cols=None, order="rows"):
+    """
+    Grid (row, col) of each tile.
+
+    Args:
+        paths: Tile files
+        cols: Number of columns (needed when the names have no position)
+        order: Scan order of the tiles, one of SCAN_ORDERS
+
+    Returns:
+        List of (row, col), the first row and column being 0
+    """
+    matches = [TILE_NAME_PATTERN.search(os.path.basename(path)) for path in paths]
+    if paths and all(matches):
+        grid = [(int(match.group(1)), int(match.group(2))) for match in matches]
+        row0, col0 = min(row for row, _ in grid), min(col for _, col in grid)
+        grid = [(row - row0, col - col0) for row, col in grid]
+        if len(set(grid)) != len(grid):
+            raise ValueError("Several tiles have the same grid position in their names")
+        return grid
+    if not cols or cols < 1:
+        raise ValueError("The number of columns of the grid is needed (the tile names have no positions)")
+    if order not in SCAN_ORDERS:
+        raise ValueError(f"Unknown scan order '{order}' (one of {', '.join(SCAN_ORDERS)})")
+    grid = []
+    for k in range(len(paths)):
+        row, col = divmod(k, cols)
+        if order == "snake" and row % 2:
+            col = cols - 1 - col
+        grid.append((row, col))
+    return grid
+
+
+def read_tile(path):
+    """A tile as stored (grayscale or BGR, alpha dropped)"""
+    image = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+    if image is None:
+        raise IOError(f"Failed to load tile '{path}'")
+    if image.ndim == 3 and image.shape[2] == 4:
+        image = image[..., :3]
+    return image
+
+
+def _gray(image):
+    # Float grayscale image for phase correlation
+    if image.ndim == 3:
+        image = cv2.cvtColor(np.ascontiguousarray(image), cv2.COLOR_BGR2GRAY)
+    return image.astype(np.float32)
+
+
+class TileCache:
+    """
+    Thread-safe LRU cache of decoded tiles.
+
+    Args:
+        paths: Tile files (tiles are requested by index)
+        capacity: Tiles kept
+        convert: Function applied to each tile after reading it
+    """
+
+    def __init__(self, paths, capacity, convert=None):
+        self.paths = paths
+        self.capacity = max(1, capacity)
+        self.convert = convert
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.shape = None
+
+    def get(self, index):
+        with self._lock:
+            if index in self._cache:
+                self._cache.move_to_end(index)
+                return self._cache[index]
+        # Decoded outside the lock (a tile may rarely be read twice)
+        tile = read_tile(self.paths[index])
+        if self.shape is None:
+            self.shape = tile.shape
+        elif tile.shape != self.shape:
+            raise ValueError(f"Tile '{self.paths[index]}' is {tile.shape[1]}x{tile.shape[0]}, "
+                             f"not {self.shape[1]}x{self.shape[0]} as the others")
+        if self.convert is not None:
+            tile = self.convert(tile)
+        with self._lock:
+            self._cache[index] = tile
+            while len(self._cache) > self.capacity:
+                self._cache.popitem(last=False)
+        return tile
+
+
+def _dft_size(n):
+    # Largest even size up to n the DFT is fast for (OpenCV biases the peak
+    # of odd sizes by half a pixel)
+    m = max(2, n - n % 2)
+    while m > 2 and cv2.getOptimalDFTSize(m) != m:
+        m -= 2
+    return m
+
+
+def phase_shift(a, b, pad=False):
+    """
+    Translation of b's content relative to a's (same size float images).
+
+    Both are cropped (from their origin) to an even size fast for the DFT.
+
+    Args:
+        a, b: The images
+        pad: Zero-pad them to twice their width, so shifts up to the whole
+             width (not half of it) are told apart
+
+    Returns:
+        (tx, ty, response): content at (x, y) in a is at (x + tx, y + ty) in
+        b; the response (0-1) measures how sharp the correlation peak is
+    """
+    height = _dft_size(a.shape[0])
+    width = _dft_size(2 * a.shape[1]) // 2 if pad else _dft_size(a.shape[1])
+    a, b = a[:height, :width], b[:height, :width]
+    window = cv2.createHanningWindow((width, height), cv2.CV_32F)
+    if not pad:
+        (tx, ty), response = cv2.phaseCorrelate(np.ascontiguousarray(a), np.ascontiguousarray(b), window)
+        return tx, ty, response
+    # Tapered along y only: the shared content may lie on the x borders
+    window = window[:, width // 2, None] / window.max()
+    padded = np.zeros((2, height, 2 * width), dtype=np.float32)
+    padded[0, :, :width] = (a - a.mean()) * window
+    padded[1, :, :width] = (b - b.mean()) * window
+    (tx, ty), response = cv2.phaseCorrelate(padded[0], padded[1])
+    return tx, ty, response
+
+
+def register_pair(a, b, overlap_px, downsample=STITCH_DOWNSAMPLE):
+    """
+    Offset of tile b, right neighbour of tile a (transpose both for a bottom
+    neighbour).
+
+    The right strip of a and the left strip of b, twice the nominal overlap
+    wide, are correlated downsampled (zero-padded: their nominal shift is
+    the overlap, half their width); the overlap this gives is correlated
+    again at full resolution.
+
+    Args:
+        a, b: Float grayscale tiles (same size)
+        overlap_px: Nominal overlap (pixels)
+        downsample: Downsampling of the coarse registration
+
+    Returns:
+        (dx, dy, response): position of b's origin relative to a's
+    """
+    height, width = a.shape
+    strip = min(width, 2 * overlap_px)
+    # Coarse: the strips, downsampled
+    factor = max(1, min(downsample, strip // 16, height // 16))
+    size = (max(1, strip // factor), max(1, height // factor))
+    tx, ty, _ = phase_shift(cv2.resize(a[:, width - strip:], size, interpolation=cv2.INTER_AREA),
+                            cv2.resize(b[:, :strip], size, interpolation=cv2.INTER_AREA), pad=True)
+    dx = int(round(width - strip - tx * strip / size[0]))
+    dy = int(round(-ty * height / size[1]))
+    if not (0 < dx < width and abs(dy) < height):
+        return float(dx), float(dy), 0.0
+
+    # Refined: the overlap of the coarse placement, at full resolution
+    win_a = a[max(0, dy):height + min(0, dy), dx:]
+    win_b = b[max(0, -dy):height - max(0, dy), :width - dx]
+    if min(win_a.shape) < 8:
+        return float(dx), float(dy), 0.0
+    tx, ty, response = phase_shift(win_a, win_b)
+    return dx - tx, dy - ty, response
+
+
+def tile_pairs(grid):
+    """Neighbouring tiles: (i, j, direction), j right ("h") or below ("v") of i"""
+    index = {position: i for i, position in enumerate(grid)}
+    pairs = []
+    for i, (row, col) in enumerate(grid):
+        if (row, col + 1) in index:
+            pairs.append((i, index[(row, col + 1)], "h"))
+        if (row + 1, col) in index:
+            pairs.append((i, index[(row + 1, col)], "v"))
+    # Row order, so the tile cache holds the rows being registered
+    pairs.sort(key=lambda pair: (grid[pair[0]], pair[2]))
+    return pairs
+
+
+def register_tiles(paths, grid, overlap=STITCH_OVERLAP, downsample=STITCH_DOWNSAMPLE, workers=None):
+    """
+    Register every pair of neighbouring tiles (see register_pair), in parallel.
+
+    Args:
+        paths: Tile files
+        grid: (row, col) of each tile (see tile_grid_positions)
+        overlap: Nominal overlap (fraction of the tile side)
+        downsample: Downsampling of the coarse registration
+        workers: Number of threads (default: all cores)
+
+    Returns:
+        (tile_shape, pairs, offsets): offsets is an (N, 3) array of dx, dy
+        and response of each pair of tile_pairs
+    """
+    workers = workers or os.cpu_count() or 1
+    pairs = tile_pairs(grid)
+    cols = max(col for _, col in grid) + 1
+    tiles = TileCache(paths, 2 * cols + 2 * workers, _gray)
+    tile_shape = tiles.get(0).shape
+
+    def register(pair):
+        i, j, direction = pair
+        a, b = tiles.get(i), tiles.get(j)
+        if direction == "h":
+            return register_pair(a, b, int(round(a.shape[1] * overlap)), downsample)
+        dy, dx, response = register_pair(np.ascontiguousarray(a.T), np.ascontiguousarray(b.T),
+                                         int(round(a.shape[0] * overlap)), downsample)
+        return dx, dy, response
+
+    with stage("register", len(pairs)):
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            offsets = np.array(list(pool.map(register, pairs)), dtype=np.float64).reshape(-1, 3)
+    return tile_shape[:2], pairs, offsets
+
+
+def solve_placement(num_tiles, pairs, offsets, nominal, min_response=STITCH_MIN_RESPONSE,
+                    max_residual=STITCH_MAX_RESIDUAL):
+    """
+    Tile positions best agreeing with the pairwise offsets (weighted least squares).
+
+    Args:
+        num_tiles: Number of tiles
+        pairs: (i, j, direction) of each offset (see tile_pairs)
+        offsets: (N, 3) dx, dy and response of each pair
+        nominal: {"h": (dx, dy), "v": (dx, dy)} nominal offsets of the stage
+        min_response: Offsets with a lower response are not trusted
+        max_residual: Offsets farther from the solution are not trusted
+
+    Returns:
+        (positions, trusted): (num_tiles, 2) integer x, y of each tile (the
+        mosaic starts at 0, 0) and which offsets were used
+    """
+    i = np.array([pair[0] for pair in pairs], dtype=np.int64)
+    j = np.array([pair[1] for pair in pairs], dtype=np.int64)
+    nominal_offsets = np.array([nominal[pair[2]] for pair in pairs], dtype=np.float64).reshape(-1, 2)
+    trusted = offsets[:, 2] >= min_response
+
+    while True:
+        # Untrusted pairs keep their nominal offset, with a tiny weight
+        d = np.where(trusted[:, None], offsets[:, :2], nominal_offsets)
+        w = np.where(trusted, offsets[:, 2], NOMINAL_WEIGHT)
+        # Normal equations: weighted graph Laplacian, tile 0 anchored at 0, 0
+        laplacian = np.zeros((num_tiles, num_tiles))
+        np.add.at(laplacian, (i, i), w)
+        np.add.at(laplacian, (j, j), w)
+        np.add.at(laplacian, (i, j), -w)
+        np.add.at(laplacian, (j, i), -w)
+        laplacian[0, 0] += 1.0
+        rhs = np.zeros((num_tiles, 2))
+        np.add.at(rhs, j, w[:, None] * d)
+        np.add.at(rhs, i, -w[:, None] * d)
+        solution = np.linalg.solve(laplacian, rhs)
+
+        # Distrust the worst offsets that do not fit, and solve again
+        residual = np.hypot(*(solution[j] - solution[i] - d).T)
+        residual[~trusted] = 0
+        worst = residual.max() if len(residual) else 0
+        if worst <= max_residual:
+            break
+        trusted &= residual < max(max_residual, worst / 2)
+
+    positions = np.round(solution - solution.min(axis=0)).astype(np.int64)
+    return positions, trusted
+
+
+def feather_ramp(length, ramp):
+    """Blending weights along a tile side: linear up to 1 over `ramp` pixels from each end"""
+    distance = np.minimum(np.arange(1, length + 1), np.arange(length, 0, -1))
+    return np.minimum(distance / max(1, ramp), 1.0).astype(np.float32)
+
+
+def blend_block(tiles, positions, tile_shape, ramps, rect, dtype):
+    """
+    Feathered average of the tiles covering a block of the mosaic.
+
+    Args:
+        tiles: TileCache of the tiles
+        positions: (N, 2) x, y of each tile
+        tile_shape: (height, width) of the tiles
+        ramps: (row weights, column weights) of a tile (see feather_ramp)
+        rect: Block (x0, y0, x1, y1)
+        dtype: Type of the mosaic
+
+    Returns:
+        The block (uncovered pixels are 0)
+    """
+    x0, y0, x1, y1 = rect
+    height, width = tile_shape
+    covering = np.flatnonzero((positions[:, 0] < x1) & (positions[:, 0] + width > x0) &
+                              (positions[:, 1] < y1) & (positions[:, 1] + height > y0))
+    acc = wsum = None
+    for k in covering:
+        tile = tiles.get(k)
+        tx, ty = positions[k]
+        # Part of the tile inside the block
+        a0, a1 = max(y0, ty), min(y1, ty + height)
+        b0, b1 = max(x0, tx), min(x1, tx + width)
+        weight = ramps[0][a0 - ty:a1 - ty, None] * ramps[1][None, b0 - tx:b1 - tx]
+        part = tile[a0 - ty:a1 - ty, b0 - tx:b1 - tx]
+        if acc is None:
+            acc = np.zeros((y1 - y0, x1 - x0) + tile.shape[2:], dtype=np.float32)
+            wsum = np.zeros((y1 - y0, x1 - x0), dtype=np.float32)
+        if part.ndim == 3:
+            acc[a0 - y0:a1 - y0, b0 - x0:b1 - x0] += part * weight[..., None]
+        else:
+            acc[a0 - y0:a1 - y0, b0 - x0:b1 - x0] += part * weight
+        wsum[a0 - y0:a1 - y0, b0 - x0:b1 - x0] += weight
+    if acc is None:
+        return None
+    wsum[wsum == 0] = 1
+    if acc.ndim == 3:
+        wsum = wsum[..., None]
+    return np.clip(np.rint(acc / wsum), 0, np.iinfo(dtype).max).astype(dtype)
+
+
+def write_mosaic(out_path, shape, dtype, blocks, block_size=STITCH_BLOCK):
+    """
+    Write the mosaic block by block to a .npy file or a tiled TIFF.
+
+    Args:
+        out_path: Output file (.npy, or .tif/.tiff with tifffile)
+        shape: Shape of the mosaic
+        dtype: Type of the mosaic
+        blocks: Iterator of ((x0, y0, x1, y1), block or None) in row-major order
+        block_size: Side of the blocks (TIFF tiles)
+    """
+    ext = os.path.splitext(out_path)[1].lower()
+    if ext == ".npy":
+        out = np.lib.format.open_memmap(out_path, mode="w+", dtype=dtype, shape=shape)
+        for (x0, y0, x1, y1), block in blocks:
+            if block is not None:
+                out[y0:y1, x0:x1] = block
+        out.flush()
+        del out
+    elif ext in (".tif", ".tiff"):
+        if tifffile is None:
+            raise ImportError("Writing tiled TIFF mosaics needs the tifffile package (pip install tifffile), "
+                              "or save the mosaic as .npy")
+
+        def tiles():
+            # Full-size tiles, padded at the right and bottom edges, in RGB
+            for (x0, y0, x1, y1), block in blocks:
+                tile = np.zeros((block_size, block_size) + tuple(shape[2:]), dtype=dtype)
+                if block is not None:
+                    tile[:y1 - y0, :x1 - x0] = block[..., ::-1] if block.ndim == 3 else block
+                yield tile
+
+        tifffile.imwrite(out_path, tiles(), shape=shape, dtype=dtype, tile=(block_size, block_size),
+                         photometric="rgb" if len(shape) == 3 else "minisblack", bigtiff=True)
+    else:
+        raise ValueError(f"Unknown mosaic format '{ext}' (.npy, .tif or .tiff)")
+
+
+def blend_mosaic(paths, positions, tile_shape, out_path, overlap=STITCH_OVERLAP, workers=None,
+                 block_size=STITCH_BLOCK):
+    """
+    Assemble the placed tiles into the mosaic file, blending the seams (see blend_block).
+
+    Blocks of a band of block_size rows are blended in parallel and written
+    before the next band starts.
+
+    Returns:
+        Shape of the mosaic
+    """
+    workers = workers or os.cpu_count() or 1
+    height, width = tile_shape
+    probe = read_tile(paths[0])
+    shape = (int(positions[:, 1].max()) + height, int(positions[:, 0].max()) + width) + probe.shape[2:]
+    ramps = (feather_ramp(height, int(round(height * overlap))), feather_ramp(width, int(round(width * overlap))))
+    # Enough tiles for the two rows of tiles a band of blocks can cover
+    tiles_per_band = int(np.sum(positions[:, 1] < positions[:, 1].min() + height + block_size))
+    tiles = TileCache(paths, 2 * tiles_per_band + workers)
+    bands = range(0, shape[0], block_size)
+
+    def blocks(pool):
+        for y0 in bands:
+            rects = [(x0, y0, min(x0 + block_size, shape[1]), min(y0 + block_size, shape[0]))
+                     for x0 in range(0, shape[1], block_size)]
+            blended = pool.map(lambda rect: blend_block(tiles, positions, tile_shape, ramps, rect, probe.dtype),
+                               rects)
+            yield from zip(rects, blended)
+
+    with stage("blend", len(bands)):
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            write_mosaic(out_path, shape, probe.dtype, blocks(pool), block_size)
+    return shape
+
+
+def write_placement(path, paths, grid, positions):
+    """Write the grid and mosaic position of every tile as CSV"""
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["tile", "row", "col", "x", "y"])
+        for tile, (row, col), (x, y) in zip(paths, grid, positions):
+            writer.writerow([os.path.basename(tile), row, col, int(x), int(y)])
+
+
+def build_mosaic(paths, out_path, cols=None, order="rows", overlap=STITCH_OVERLAP, downsample=STITCH_DOWNSAMPLE,
+                 workers=None):
+    """
+    Stitch a grid of tiles into a mosaic file (see the module docstring).
+
+    The tile positions are also written as <mosaic>_placement.csv.
+
+    Args:
+        paths: Tile files
+        out_path: Output mosaic (.npy, or .tif/.tiff with tifffile)
+        cols, order: Grid of tiles without positions in their names (see tile_grid_positions)
+        overlap: Nominal overlap between neighbouring tiles (fraction of the tile side)
+        downsample: Downsampling of the coarse registration
+        workers: Number of threads (default: all cores)
+
+    Returns:
+        Dict with the mosaic "shape", the tile "positions", and the number
+        of "pairs" of neighbours and of them "registered" (trusted)
+    """
+    if len(paths) < 2:
+        raise ValueError("At least two tiles are needed")
+    if not 0 < overlap < 0.5:
+        raise ValueError("The overlap must be between 0 and 0.5")
+    grid = tile_grid_positions(paths, cols, order)
+    tile_shape, pairs, offsets = register_tiles(paths, grid, overlap, downsample, workers)
+    height, width = tile_shape
+    nominal = {"h": (width - round(width * overlap), 0), "v": (0, height - round(height * overlap))}
+    with stage("place", len(paths)):
+        positions, trusted = solve_placement(len(paths), pairs, offsets, nominal)
+    shape = blend_mosaic(paths, positions, tile_shape, out_path, overlap, workers)
+    write_placement(os.path.splitext(out_path)[0] + "_placement.csv", paths, grid, positions)
+    return {"shape": shape, "positions": positions, "pairs": len(pairs), "registered": int(trusted.sum())}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stitch a grid of overlapping microscope tiles into a mosaic")
+    parser.add_argument("tiles", help="Folder of tiles")
+    parser.add_argument("-o", "--output", required=True, help="Output mosaic (.npy, or .tif with tifffile)")
+    parser.add_argument("--cols", type=int, default=None, help="Columns of the grid (if the names have no positions)")
+    parser.add_argument("--order", choices=SCAN_ORDERS, default="rows", help="Scan order of the tiles")
+    parser.add_argument("--overlap", type=float, default=STITCH_OVERLAP, help="Nominal overlap (fraction)")
+    parser.add_argument("--downsample", type=int, default=STITCH_DOWNSAMPLE,
+                        help="Downsampling of the coarse registration")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="Threads (default: all cores)")
+    args = parser.parse_args(argv)
+
+    paths = list_tiles(args.tiles)
+    start = time.perf_counter()
+    try:
+        result = build_mosaic(paths, args.output, args.cols, args.order, args.overlap, args.downsample, args.workers)
+    except (ValueError, IOError, ImportError) as e:
+        parser.error(str(e))
+    height, width = result["shape"][:2]
+    print(f"{args.output}: {len(paths)} tiles, {width}x{height} px, {result['registered']}/{result['pairs']} "
+          f"pairs registered, {time.perf_counter() - start:.1f} s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,184 @@
+"""
+Seeded generator of synthetic binary thin sections, for benchmarks.
+
+Pores are filled ellipses (255) on a solid background (0):
+
+    - equivalent diameters follow a lognormal or a power law (Pareto)
+      distribution, as the heavy-tailed pore sizes of real sections;
+    - a fraction of the pores is elongated (aspect ratio 3 to 12);
+    - a fraction of the pores large enough gets a hole (a child contour);
+    - a number of pores is centred on the frame of the image, so they are
+      flagged is_edge.
+
+Pore parameters are drawn first, from the seed only, and the image is then
+rasterized band by band: synthetic_mosaic returns an array and
+write_synthetic_mosaic fills a memory-mapped .npy file of any size (which
+open_image_source reads without loading it), with the same pixels.
+"""
+import math as m
+import cv2
+import numpy as np
+
+# Pores per megapixel when their number is not given
+SYNTHETIC_PORES_PER_MP = 1000
+
+# Rows rasterized at once by write_synthetic_mosaic
+SYNTHETIC_BAND_ROWS = 4096
+
+# Pores with a smaller equivalent diameter (pixels) never get a hole
+MIN_HOLED_DIAMETER = 12
+
+# Value of the hole pixels in the patch of a pore (see draw_pores)
+HOLE_VALUE = 128
+
+
+def synthetic_pores(width, height, num_pores=None, seed=0, distribution="lognormal", median_diameter=8.0,
+                    sigma=0.9, alpha=1.8, max_diameter=None, elongated_fraction=0.15, hole_fraction=0.1,
+                    edge_pores=None):
+    """
+    Draw the parameters of the pores of a synthetic section.
+
+    Args:
+        width, height: Image size (pixels)
+        num_pores: Number of pores (default: SYNTHETIC_PORES_PER_MP per megapixel)
+        seed: Seed of the random generator (same seed, same pores)
+        distribution: "lognormal" or "powerlaw" equivalent diameters
+        median_diameter: Median equivalent diameter (pixels) with "lognormal",
+                         smallest one with "powerlaw"
+        sigma: Spread (log space) of the lognormal diameters
+        alpha: Exponent of the power law diameters (smaller: heavier tail)
+        max_diameter: Largest equivalent diameter (default: 1/8 of the smallest side)
+        elongated_fraction: Fraction of elongated pores
+        hole_fraction: Fraction of the pores (large enough) with a hole
+        edge_pores: Pores centred on the image frame (default: 1% of the pores)
+
+    Returns:
+        Dict of arrays, one entry per pore: "center" (N, 2), "axes" (N, 2)
+        half axes, "angle" (deg) and "hole_axes" (N, 2) half axes of the hole
+        (0 for pores without hole), all integers
+    """
+    rng = np.random.default_rng(seed)
+    if num_pores is None:
+        num_pores = int(round(width * height / 1e6 * SYNTHETIC_PORES_PER_MP))
+    if max_diameter is None:
+        max_diameter = max(2.0, min(width, height) / 8)
+    if edge_pores is None:
+        edge_pores = num_pores // 100
+    edge_pores = min(edge_pores, num_pores)
+
+    # Equivalent diameters
+    if distribution == "lognormal":
+        diameter = median_diameter * np.exp(sigma * rng.standard_normal(num_pores))
+    elif distribution == "powerlaw":
+        diameter = median_diameter * (1 + rng.pareto(alpha, num_pores))
+    else:
+        raise ValueError(f"Unknown diameter distribution '{distribution}'")
+    diameter = np.clip(diameter, 1.0, max_diameter)
+
+    # Axes of an ellipse of that area: a * b = (d / 2)^2, a / b = aspect
+    aspect = np.ones(num_pores)
+    elongated = rng.random(num_pores) < elongated_fraction
+    aspect[elongated] = rng.uniform(3, 12, elongated.sum())
+    radius = diameter / 2
+    axes = np.stack([radius * np.sqrt(aspect), radius / np.sqrt(aspect)], axis=1)
+    angle = rng.uniform(0, 180, num_pores)
+
+    # Holes, about a third of the pore axes
+    holed = (rng.random(num_pores) < hole_fraction) & (diameter >= MIN_HOLED_DIAMETER) & ~elongated
+    hole_axes = np.where(holed[:, None], axes * rng.uniform(0.25, 0.45, (num_pores, 1)), 0)
+
+    center = np.stack([rng.uniform(0, width, num_pores), rng.uniform(0, height, num_pores)], axis=1)
+    # Pores on the frame: one coordinate on a side, chosen at random
+    side = rng.integers(0, 4, edge_pores)
+    center[:edge_pores, 0] = np.where(side == 0, 0, np.where(side == 1, width - 1, center[:edge_pores, 0]))
+    center[:edge_pores, 1] = np.where(side == 2, 0, np.where(side == 3, height - 1, center[:edge_pores, 1]))
+
+    return {
+        "center": np.round(center).astype(np.int64),
+        "axes": np.maximum(np.round(axes), 1).astype(np.int64),
+        "angle": np.round(angle).astype(np.int64),
+        "hole_axes": np.round(hole_axes).astype(np.int64),
+    }
+
+
+def draw_pores(image, pores, y0=0):
+    """
+    Rasterize pores on an image holding rows y0 to y0 + image height of the section.
+
+    Each pore is drawn on its own patch, never clipped (OpenCV rasterizes a
+    clipped ellipse slightly differently), then pasted in order, so a band
+    gets the same pixels as the same rows of the whole image.
+    """
+    rows, cols = image.shape[:2]
+    center, axes, angle, hole_axes = pores["center"], pores["axes"], pores["angle"], pores["hole_axes"]
+    # Pores reaching the band (the largest half axis bounds the ellipse)
+    reach = axes.max(axis=1) + 1
+    in_band = np.flatnonzero((center[:, 1] + reach >= y0) & (center[:, 1] - reach < y0 + rows))
+    for (cx, cy), (a, b), theta, (ha, hb), r in zip(center[in_band].tolist(), axes[in_band].tolist(),
+                                                    angle[in_band].tolist(), hole_axes[in_band].tolist(),
+                                                    reach[in_band].tolist()):
+        patch = np.zeros((2 * r + 1, 2 * r + 1), dtype=np.uint8)
+        cv2.ellipse(patch, (r, r), (a, b), theta, 0, 360, 255, -1)
+        has_hole = ha > 0 and hb > 0
+        if has_hole:
+            cv2.ellipse(patch, (r, r), (ha, hb), theta, 0, 360, HOLE_VALUE, -1)
+        # Part of the patch inside the image
+        x0, y1 = cx - r, cy - r - y0
+        px0, py0 = max(0, -x0), max(0, -y1)
+        px1, py1 = min(2 * r + 1, cols - x0), min(2 * r + 1, rows - y1)
+        if px1 <= px0 or py1 <= py0:
+            continue
+        patch = patch[py0:py1, px0:px1]
+        view = image[y1 + py0:y1 + py1, x0 + px0:x0 + px1]
+        view[patch == 255] = 255
+        if has_hole:
+            view[patch == HOLE_VALUE] = 0
+    return image
+
+
+def synthetic_mosaic(width, height, **kwargs):
+    """
+    Synthetic binary section as an array.
+
+    Args:
+        width, height: Image size (pixels)
+        **kwargs: Pore parameters (see synthetic_pores)
+
+    Returns:
+        uint8 image, pores 255 and background 0
+    """
+    pores = synthetic_pores(width, height, **kwargs)
+    return draw_pores(np.zeros((height, width), dtype=np.uint8), pores)
+
+
+def write_synthetic_mosaic(path, width, height, band_rows=SYNTHETIC_BAND_ROWS, **kwargs):
+    """
+    Write a synthetic section of any size to a .npy file, band by band.
+
+    Only one band is in memory at a time; the pixels are those of
+    synthetic_mosaic with the same arguments.
+
+    Args:
+        path: Output .npy file
+        width, height: Image size (pixels)
+        band_rows: Rows rasterized at once
+        **kwargs: Pore parameters (see synthetic_pores)
+
+    Returns:
+        Number of pores drawn
+    """
+    pores = synthetic_pores(width, height, **kwargs)
+    image = np.lib.format.open_memmap(path, mode="w+", dtype=np.uint8, shape=(height, width))
+    band = np.empty((min(band_rows, height), width), dtype=np.uint8)
+    for y0 in range(0, height, band_rows):
+        rows = min(band_rows, height - y0)
+        band[:rows] = 0
+        image[y0:y0 + rows] = draw_pores(band[:rows], pores, y0)
+    image.flush()
+    del image
+    return len(pores["center"])
+
+
+def side_for_megapixels(megapixels):
+    """Side (pixels) of a square image of about that many megapixels"""
+    return max(1, int(round(m.sqrt(megapixels * 1e6))))
@@ -0,0 +1,196 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+
+# Default tile geometry for find_contour_groups_tiled (pixels)
+TILE_SIZE = 4096
+TILE_HALO = 256
+
+
+def find_contour_groups(image, offset=(0, 0)):
+    """
+    Find the pores of a binary image with a single cv2.findContours call.
+
+    Args:
+        image: Binary image
+        offset: (x, y) added to the contour points (e.g. when image is a
+                window of a larger one)
+
+    Returns:
+        (parents, children): list of parent contours and, for each of them,
+        the list of its child (hole) contours, in findContours order
+    """
+    # Find contours with hierarchy
+    contours, hierarchy = cv2.findContours(image, cv2.RETR_CCOMP, cv2.CHAIN_APPROX_SIMPLE, offset=offset)
+
+    # Check if contours were found
+    if len(contours) == 0 or hierarchy is None:
+        return [], []
+
+    return _group_by_parent(contours, hierarchy[0])
+
+
+def _group_by_parent(contours, hierarchy):
+    """Split RETR_CCOMP output in parent contours and their list of children"""
+    parents = []
+    children = []
+    # Parent contours are those with no parent
+    for i, h in enumerate(hierarchy):
+        if h[3] != -1:
+            continue
+        parents.append(contours[i])
+        child_contours = []
+        child_idx = h[2]  # First child
+        while child_idx != -1:
+            child_contours.append(contours[child_idx])
+            # Move to the next child at the same level
+            child_idx = hierarchy[child_idx][0]
+        children.append(child_contours)
+    return parents, children
+
+
+def _tile_grid(height, width, tile_size):
+    """Core rectangles (x0, y0, x1, y1) that partition the image"""
+    return [
+        (x0, y0, min(width, x0 + tile_size), min(height, y0 + tile_size))
+        for y0 in range(0, height, tile_size)
+        for x0 in range(0, width, tile_size)
+    ]
+
+
+def _process_tile(image, core, halo):
+    """
+    Extract the pores owned by one tile.
+
+    The tile is read with a halo around its core. A pore is owned by the tile
+    whose core holds its start point (the first contour point, i.e. its
+    top-most, left-most pixel), so pores in overlapping halos are reported once.
+    Owned pores that touch the halo border inside the image may continue in
+    a neighbouring tile: they are returned as seams to be resolved later.
+
+    Returns:
+        (pores, seams): pores as (start, parent, children) in image coordinates,
+        seams as the start points of the truncated owned pores
+    """
+    height, width = image.shape[:2]
+    x0, y0, x1, y1 = core
+    px0, py0 = max(0, x0 - halo), max(0, y0 - halo)
+    px1, py1 = min(width, x1 + halo), min(height, y1 + halo)
+
+    tile = np.ascontiguousarray(image[py0:py1, px0:px1])
+    contours, hierarchy = cv2.findContours(
+        tile, cv2.RETR_CCOMP, cv2.CHAIN_APPROX_SIMPLE, offset=(px0, py0)
+    )
+    if len(contours) == 0 or hierarchy is None:
+        return [], []
+
+    pores = []
+    seams = []
+    for parent, children in zip(*_group_by_parent(contours, hierarchy[0])):
+        sx, sy = (int(v) for v in parent[0, 0])
+        if not (x0 <= sx < x1 and y0 <= sy < y1):
+            continue  # Owned by another tile
+        bx, by, bw, bh = cv2.boundingRect(parent)
+        truncated = (
+            (bx == px0 and px0 > 0) or (by == py0 and py0 > 0) or
+            (bx + bw == px1 and px1 < width) or (by + bh == py1 and py1 < height)
+        )
+        if truncated:
+            seams.append((sx, sy))
+        else:
+            pores.append(((sx, sy), parent, children))
+    return pores, seams
+
+
+def _resolve_seam(image, seed, halo, resolved):
+    """
+    Extract the whole pore holding `seed` with a window grown until it fits.
+
+    The pore is isolated with a flood fill from the seed, so its parent and
+    children are traced exactly as in the full image.
+
+    Args:
+        resolved: List of (x0, y0, mask) of pores already stitched, used to skip
+                  seeds that belong to one of them
+
+    Returns:
+        (start, parent, children), or None if the seed was already resolved
+    """
+    height, width = image.shape[:2]
+    sx, sy = seed
+    for x0, y0, mask in resolved:
+        if 0 <= sx - x0 < mask.shape[1] and 0 <= sy - y0 < mask.shape[0] and mask[sy - y0, sx - x0]:
+            return None
+
+    margin = halo
+    wx0, wy0, wx1, wy1 = sx, sy, sx + 1, sy + 1
+    while True:
+        wx0, wy0 = max(0, wx0 - margin), max(0, wy0 - margin)
+        wx1, wy1 = min(width, wx1 + margin), min(height, wy1 + margin)
+        window = np.array(image[wy0:wy1, wx0:wx1], dtype=np.uint8)
+        # 8-connected fill of the pore with a marker value
+        _, _, _, (rx, ry, rw, rh) = cv2.floodFill(window, None, (sx - wx0, sy - wy0), 128, flags=8)
+        truncated = (
+            (rx == 0 and wx0 > 0) or (ry == 0 and wy0 > 0) or
+            (rx + rw == window.shape[1] and wx1 < width) or (ry + rh == window.shape[0] and wy1 < height)
+        )
+        if not truncated:
+            break
+        # Grow around the part found so far and try again
+        wx0, wy0, wx1, wy1 = wx0 + rx, wy0 + ry, wx0 + rx + rw, wy0 + ry + rh
+        margin *= 2
+
+    mask = np.where(window[ry:ry + rh, rx:rx + rw] == 128, 255, 0).astype(np.uint8)
+    contours, hierarchy = cv2.findContours(
+        mask, cv2.RETR_CCOMP, cv2.CHAIN_APPROX_SIMPLE, offset=(wx0 + rx, wy0 + ry)
+    )
+    parents, children = _group_by_parent(contours, hierarchy[0])
+    resolved.append((wx0 + rx, wy0 + ry, mask))
+    parent = parents[0]
+    return (tuple(int(v) for v in parent[0, 0]), parent, children[0])
+
+
+def find_contour_groups_tiled(image, tile_size=TILE_SIZE, halo=TILE_HALO, workers=None):
+    """
+    Tiled, multi-threaded equivalent of find_contour_groups.
+
+    The image is split into tile_size x tile_size tiles extracted in parallel
+    (OpenCV releases the GIL), each one read with a `halo` of overlap. Pores that
+    cross a tile seam are stitched by re-tracing them on a window that holds
+    them entirely, so every pore gets exactly the parent and children contours of
+    the single call, and pores are returned in the same order.
+
+    Args:
+        image: Binary image, or any 2D array-like supporting slicing and .shape
+        tile_size: Side of the tile cores in pixels
+        halo: Overlap read around each tile; pores smaller than this never need stitching
+        workers: Number of threads (default: all cores)
+
+    Returns:
+        (parents, children) as find_contour_groups
+    """
+    height, width = image.shape[:2]
+    cores = _tile_grid(height, width, tile_size)
+    workers = workers or os.cpu_count() or 1
+
+    # Pores keyed by start point: a pore can be reached from several tiles
+    pores = {}
+    seams = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for tile_pores, tile_seams in pool.map(lambda core: _process_tile(image, core, halo), cores):
+            for start, parent, children in tile_pores:
+                pores[start] = (parent, children)
+            seams.extend(tile_seams)
+
+    # Stitch the pores crossing tile seams
+    resolved = []
+    for seed in seams:
+        pore = _resolve_seam(image, seed, halo, resolved)
+        if pore is not None:
+            start, parent, children = pore
+            pores.setdefault(start, (parent, children))
+
+    # findContours reports parents in reverse raster order of their start point
+    starts = sorted(pores, key=lambda p: (p[1], p[0]), reverse=True)
+    return [pores[p][0] for p in starts], [pores[p][1] for p in starts]
@@ -5,14 +5,24 @@ import tkinter.messagebox as messagebox
 from PIL import Image, ImageTk
 import cv2
 import numpy as np
-import h5py
 import threading
 import os
+from contour_table import ContourTable
+from pore_io import PoreReader
+from spatial_index import GridIndex
+from pyramid import ImagePyramid
+from image_source import open_image_source
+
+# Above this number of pores in view, only the selected pore is outlined
+VIS_MAX_DRAWN_PORES = 5000
+
+# Mouse moves (pixels) below which a press-release is a click, not a pan
+VIS_CLICK_TOLERANCE = 3
 
 
 def visualize_tab(self):
     # State variables for this tab
-    self.vis_binary_image = None  # numpy grayscale image
+    self.vis_binary_image = None  # grayscale ImageSource
     self.vis_display_image = None  # color image for drawing overlays
     self.vis_tk_image = None
     self.vis_scale = 1.0  # base scale to fit canvas (updated per render)
@@ -21,12 +31,15 @@ def visualize_tab(self):
     self.vis_pan_y = 0
     self.vis_image_pos = (0, 0)
     self.vis_h5_path = None
+    self.vis_reader = None  # PoreReader of the loaded .h5 (kept open)
+    self.vis_index = None  # GridIndex over the pore bounding boxes (positions in vis_reader.ids)
+    self.vis_view = None  # (x_pos, y_pos, scale) of the last render, to map clicks to the image
+    self.vis_pyramid = None  # ImagePyramid of vis_binary_image
     self.vis_pore_ids = []
     self.vis_loading_var = tk.StringVar(value="")
     self.vis_line_thickness_var = tk.IntVar(value=2)
-    # Contours currently selected (original image coordinates)
-    self._vis_parent_contour = None
-    self._vis_children_contours = []
+    # Pore currently selected, as a one row ContourTable (original image coordinates)
+    self._vis_pore = None
     # Render throttle state
     self._vis_render_scheduled = False
     self._vis_render_after_id = None
@@ -166,10 +179,10 @@ def _vis_load_h5(self):
 
     def worker():
         try:
-            with h5py.File(path, 'r') as f:
-                if "contours" not in f:
-                    raise RuntimeError("Invalid H5: 'contours' group not found.")
-                ids = list(f["contours"].keys())
+            # Opens the file once and loads only its pore index
+            reader = PoreReader(path)
+            # Spatial index of all the pores for viewport drawing and click selection
+            index = GridIndex(reader.bboxes())
         except Exception as e:
             self.root.after(0, lambda: [
                 messagebox.showerror("Error", f"Failed to load H5: {e}"),
@@ -179,12 +192,16 @@ def _vis_load_h5(self):
             return
 
         def on_done():
+            if self.vis_reader is not None:
+                self.vis_reader.close()
+            self.vis_reader = reader
+            self.vis_index = index
             self.vis_h5_path = path
             # If huge, avoid populating combobox values to keep UI responsive
-            self.vis_pore_ids = sorted(ids, key=lambda s: int(s) if str(s).isdigit() else s)
+            self.vis_pore_ids = reader.ids
             if len(self.vis_pore_ids) <= 500:
-                self.vis_pore_id_combo["values"] = self.vis_pore_ids
-                if self.vis_pore_ids:
+                self.vis_pore_id_combo["values"] = [str(i) for i in self.vis_pore_ids]
+                if len(self.vis_pore_ids):
                     self.vis_pore_id_combo.current(0)
             else:
                 self.vis_pore_id_combo["values"] = []  # act as free-entry
@@ -205,10 +222,11 @@ def _vis_try_autoload_binary(self):
     for ext in [".tiff", ".tif", ".png", ".bmp", ".jpg", ".jpeg"]:
         cand = base + ext
         if os.path.exists(cand):
-            img = cv2.imread(cand, cv2.IMREAD_GRAYSCALE)
-            if img is not None:
-                self.vis_binary_image = img
-                _vis_update_display(self)
+            try:
+                img = open_image_source(cand, gray=True)
+            except Exception:
+                return
+            _vis_set_binary_image(self, img)
             return
 
 
@@ -219,16 +237,29 @@ def _vis_load_binary(self):
     ])
     if not path:
         return
-    img = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
-    if img is None:
+    try:
+        # Read on demand: only the viewport (and the pyramid levels) are loaded
+        img = open_image_source(path, gray=True)
+    except Exception:
         messagebox.showerror("Error", "Failed to load image.")
         return
+    _vis_set_binary_image(self, img)
+
+
+def _vis_set_binary_image(self, img):
+    # New image to render: its pyramid levels are built in the background and
+    # the view is refreshed when they are ready (until then level 0 is used)
     self.vis_binary_image = img
+    self.vis_pyramid = ImagePyramid(img)
+    pyramid = self.vis_pyramid
+    self.vis_pyramid.build_async(
+        lambda: self.root.after(0, lambda: _vis_schedule_render(self) if self.vis_pyramid is pyramid else None)
+    )
     _vis_update_display(self)
 
 
-def _vis_show_contour(self):
-    if self.vis_h5_path is None:
+def _vis_show_contour(self, focus=True):
+    if self.vis_reader is None:
         messagebox.showwarning("Warning", "Load the .h5 file first.")
         return
     if self.vis_binary_image is None:
@@ -239,42 +270,20 @@ def _vis_show_contour(self):
         messagebox.showwarning("Warning", "Select a Pore_id.")
         return
     try:
-        with h5py.File(self.vis_h5_path, 'r') as f:
-            if "contours" not in f or pore_id not in f["contours"]:
-                raise KeyError(f"Pore_id '{pore_id}' not found in H5")
-            cg = f["contours"][pore_id]
-            # Read stats
-            idx = int(cg.attrs.get('index', int(pore_id)))
-            is_edge = bool(cg.attrs.get('is_edge', False))
-            area = float(cg.attrs.get('area', 0.0))
-            perimeter = float(cg.attrs.get('perimeter', 0.0))
-            num_children = int(cg.attrs.get('num_children', 0))
-
-            # Read parent contour points
-            parent = np.array(cg['parent'][:]) if 'parent' in cg else None
-            # Read children
-            children = []
-            if 'children' in cg:
-                chg = cg['children']
-                for key in chg.keys():
-                    children.append(np.array(chg[key][:]))
-
-        # Ensure correct contour shapes and dtypes
-        def _as_contour(arr):
-            if arr is None:
-                return None
-            c = np.asarray(arr)
-            if c.ndim == 2 and c.shape[1] == 2:
-                c = c.reshape(-1, 1, 2)
-            c = c.astype(np.int32)
-            return c
-
-        p_contour = _as_contour(parent)
-        ch_contours = [_as_contour(c) for c in children]
-
-        # Store contours for viewport rendering
-        self._vis_parent_contour = p_contour
-        self._vis_children_contours = [c for c in ch_contours if c is not None]
+        # Read stats and contours (any file format version)
+        attrs, p_contour, ch_contours = self.vis_reader.read(pore_id)
+        idx = attrs['index']
+        is_edge = attrs['is_edge']
+        area = attrs['area']
+        perimeter = attrs['perimeter']
+        num_children = attrs['num_children']
+
+        # Store the pore for viewport rendering
+        self._vis_pore = ContourTable.from_contours(
+            [p_contour], [ch_contours],
+            is_edge=[is_edge], area=[area], perimeter=[perimeter], num_children=[num_children]
+        )
+        self._vis_pore.idx[:] = idx
         # Discard any precomposed display image to avoid stale state
         self.vis_display_image = None
 
@@ -286,9 +295,9 @@ def _vis_show_contour(self):
         self._vis_stat_vars['num_children'].set(str(num_children))
 
         # Auto-zoom to pore with 20% padding
-        bbox = _vis_compute_bbox(p_contour, ch_contours)
-        if bbox is not None:
-            _vis_focus_bbox(self, bbox, padding=0.2)
+        if focus and p_contour is not None:
+            x, y, w, h = (int(v) for v in self._vis_pore.bbox[0])
+            _vis_focus_bbox(self, (x, y, x + w - 1, y + h - 1), padding=0.2)
         _vis_update_display(self)
 
     except Exception as e:
@@ -315,6 +324,29 @@ def _vis_update_display(self):
     if ch <= 1:
         ch = 600
 
+    view = _vis_render_view(self, cw, ch)
+    if view is None:
+        return
+    dest_bgr, (dest_x1, dest_y1) = view
+
+    # Convert to Tk image and draw at destination position
+    pil = Image.fromarray(cv2.cvtColor(dest_bgr, cv2.COLOR_BGR2RGB))
+    tkimg = ImageTk.PhotoImage(pil)
+    self.vis_tk_image = tkimg
+    self.vis_canvas.create_image(dest_x1, dest_y1, anchor=tk.NW, image=tkimg)
+
+
+def _vis_render_view(self, cw, ch):
+    """
+    Render the visible part of the binary image and its pore outlines (no Tk calls).
+
+    Args:
+        cw, ch: Canvas size
+
+    Returns:
+        (dest_bgr, (x, y)): BGR picture and its position in the canvas, or
+        None if no part of the image is visible
+    """
     h, w = self.vis_binary_image.shape[:2]
     base_scale = min(cw / w, ch / h)
     self.vis_scale = base_scale
@@ -324,6 +356,7 @@ def _vis_update_display(self):
     x_pos = (cw - w * scale) / 2 + self.vis_pan_x
     y_pos = (ch - h * scale) / 2 + self.vis_pan_y
     self.vis_image_pos = (int(x_pos), int(y_pos))
+    self.vis_view = (x_pos, y_pos, scale)
 
     # Compute visible image rectangle in image coords
     x1_img = int(max(0, (0 - x_pos) / scale))
@@ -332,7 +365,7 @@ def _vis_update_display(self):
     y2_img = int(min(h, (ch - y_pos) / scale))
 
     if x2_img <= x1_img or y2_img <= y1_img:
-        return
+        return None
 
     # Destination rectangle in canvas coords
     dest_x1 = int(max(0, x_pos))
@@ -343,10 +376,16 @@ def _vis_update_display(self):
     dest_w = max(1, min(dest_w, cw - dest_x1))
     dest_h = max(1, min(dest_h, ch - dest_y1))
 
-    # Prepare resized crop
-    crop = self.vis_binary_image[y1_img:y2_img, x1_img:x2_img]
-    # Resize to destination size
-    resized = cv2.resize(crop, (dest_w, dest_h), interpolation=cv2.INTER_NEAREST)
+    # Prepare resized crop from the pyramid level nearest to the display scale,
+    # so the pixels touched per frame follow the canvas size, not the mosaic size
+    if self.vis_pyramid is not None:
+        level_image, factor = self.vis_pyramid.get(self.vis_pyramid.level_for_scale(scale), wait=False)
+    else:
+        level_image, factor = self.vis_binary_image, 1
+    crop = level_image[y1_img // factor:-(-y2_img // factor), x1_img // factor:-(-x2_img // factor)]
+    # Resize to destination size (nearest when magnifying to keep pixels crisp)
+    interpolation = cv2.INTER_AREA if scale * factor < 1 else cv2.INTER_NEAREST
+    resized = cv2.resize(crop, (dest_w, dest_h), interpolation=interpolation)
     dest_bgr = cv2.cvtColor(resized, cv2.COLOR_GRAY2BGR)
 
     # Draw contours transformed into the cropped-resized space
@@ -364,20 +403,74 @@ def _vis_update_display(self):
         pts = np.round(pts).astype(np.int32).reshape(-1, 1, 2)
         return pts
 
-    pc = _transform_contour(self._vis_parent_contour)
-    chs = [c for c in ([_transform_contour(c) for c in self._vis_children_contours] if self._vis_children_contours else []) if c is not None]
+    # All the pores in view, from the spatial index
+    _vis_draw_visible_pores(self, dest_bgr, (x1_img, y1_img, x2_img, y2_img), scale)
+
+    pore = self._vis_pore
+    pc = _transform_contour(pore.parent(0)) if pore is not None else None
+    chs = [_transform_contour(c) for c in pore.children(0)] if pore is not None else []
 
     if pc is not None and len(pc) >= 2:
         cv2.drawContours(dest_bgr, [pc], -1, (255, 0, 0), thickness)
-    for ch in chs:
-        if len(ch) >= 2:
-            cv2.drawContours(dest_bgr, [ch], -1, (0, 255, 0), thickness)
+    for child in chs:
+        if len(child) >= 2:
+            cv2.drawContours(dest_bgr, [child], -1, (0, 255, 0), thickness)
+
+    return dest_bgr, (dest_x1, dest_y1)
 
-    # Convert to Tk image and draw at destination position
-    pil = Image.fromarray(cv2.cvtColor(dest_bgr, cv2.COLOR_BGR2RGB))
-    tkimg = ImageTk.PhotoImage(pil)
-    self.vis_tk_image = tkimg
-    self.vis_canvas.create_image(dest_x1, dest_y1, anchor=tk.NW, image=tkimg)
+
+def _vis_draw_visible_pores(self, dest_bgr, rect, scale):
+    # Outline every pore intersecting the visible image rectangle (if not too many)
+    if self.vis_index is None:
+        return
+    x1_img, y1_img, x2_img, y2_img = rect
+    positions = self.vis_index.query(x1_img, y1_img, x2_img, y2_img)
+    if len(positions) == 0:
+        return
+    if len(positions) > VIS_MAX_DRAWN_PORES:
+        cv2.putText(dest_bgr, f"{len(positions)} pores in view: zoom in to see their outlines",
+                    (10, 20), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 200, 255), 1, cv2.LINE_AA)
+        return
+
+    rings = []
+    for parent, children in self.vis_reader.read_contours(self.vis_reader.ids[positions]).values():
+        if parent is not None:
+            rings.append(parent)
+            rings.extend(children)
+    if not rings:
+        return
+
+    # Transform all the points at once into the cropped-resized space
+    lengths = [len(r) for r in rings]
+    pts = np.concatenate(rings).reshape(-1, 2).astype(np.float64)
+    pts[:, 0] = (pts[:, 0] - x1_img) * scale
+    pts[:, 1] = (pts[:, 1] - y1_img) * scale
+    pts = np.round(pts).astype(np.int32).reshape(-1, 1, 2)
+    cv2.polylines(dest_bgr, np.split(pts, np.cumsum(lengths)[:-1]), True, (0, 200, 255), 1)
+
+
+def _vis_select_at(self, x, y):
+    # Select the pore under the canvas point (x, y)
+    if self.vis_index is None or self.vis_view is None:
+        return
+    x_pos, y_pos, scale = self.vis_view
+    img_x = (x - x_pos) / scale
+    img_y = (y - y_pos) / scale
+    candidates = self.vis_index.query_point(int(img_x), int(img_y))
+    if len(candidates) == 0:
+        return
+    pore_ids = self.vis_reader.ids[candidates]
+    contours = self.vis_reader.read_contours(pore_ids)
+    for pore_id in pore_ids.tolist():
+        parent, children = contours[pore_id]
+        # Inside the parent contour but not inside one of its holes
+        if parent is None or cv2.pointPolygonTest(parent, (img_x, img_y), False) < 0:
+            continue
+        if any(cv2.pointPolygonTest(child, (img_x, img_y), False) > 0 for child in children):
+            continue
+        self.vis_pore_id_var.set(str(pore_id))
+        _vis_show_contour(self, focus=False)
+        return
 
 
 def _vis_schedule_render(self, delay_ms=50):
@@ -398,22 +491,6 @@ def _vis_schedule_render(self, delay_ms=50):
     self._vis_render_after_id = self.root.after(delay_ms, _do)
 
 
-def _vis_compute_bbox(parent_contour, children_contours):
-    # parent_contour shape: (N,1,2); children list of same
-    points = []
-    if parent_contour is not None:
-        points.append(parent_contour.reshape(-1, 2))
-    for ch in children_contours or []:
-        if ch is not None:
-            points.append(ch.reshape(-1, 2))
-    if not points:
-        return None
-    all_pts = np.vstack(points)
-    x_min, y_min = np.min(all_pts[:, 0]), np.min(all_pts[:, 1])
-    x_max, y_max = np.max(all_pts[:, 0]), np.max(all_pts[:, 1])
-    return (int(x_min), int(y_min), int(x_max), int(y_max))
-
-
 def _vis_focus_bbox(self, bbox, padding=0.2):
     # bbox: (x1,y1,x2,y2) in image coords
     if self.vis_binary_image is None:
@@ -502,6 +579,7 @@ def _vis_pan_start(self, event):
     self._vis_dragging = True
     self._vis_last_x = event.x
     self._vis_last_y = event.y
+    self._vis_press = (event.x, event.y)
 
 
 def _vis_pan_move(self, event):
@@ -518,6 +596,11 @@ def _vis_pan_move(self, event):
 
 def _vis_pan_end(self, event):
     self._vis_dragging = False
+    # A left click that did not pan selects the pore under the cursor
+    press = getattr(self, '_vis_press', None)
+    if event.num == 1 and press is not None and \
+            abs(event.x - press[0]) <= VIS_CLICK_TOLERANCE and abs(event.y - press[1]) <= VIS_CLICK_TOLERANCE:
+        _vis_select_at(self, event.x, event.y)
 
 
 def _vis_fit(self):